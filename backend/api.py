@@ -1,11 +1,15 @@
 import os
+import re
 import json
+import time
+import uuid
+import queue
 import base64
 import asyncio
 import concurrent.futures
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
@@ -18,6 +22,14 @@ warnings.filterwarnings("ignore", message=".*LLMChain was deprecated.*")
 
 # Import lớp FinancialAgentSystem từ main.py
 from main import FinancialAgentSystem
+from src.utils.jobs import JobQueue
+from src.utils.tracing import current_request_id, propagate, trace
+from src.utils.usage import track_usage
+from src.utils.profiling import ProfilerBusy, profile_request, profiling_enabled
+from src.utils.metrics import REGISTRY, REQUEST_DURATION, REQUESTS_IN_FLIGHT, REQUESTS_TOTAL
+
+# Mã yêu cầu từ header X-Request-ID được dùng làm tên file profile nên chỉ nhận ký tự an toàn
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 # Thiết lập logging
 import logging
@@ -53,15 +65,72 @@ logger.info("Đã mount thư mục visualizations để phục vụ tệp tĩnh"
 # Định nghĩa models
 class QueryRequest(BaseModel):
     question: str
+    background_visualization: bool = False  # Trả lời văn bản trước, biểu đồ được tạo trong tác vụ nền
+    profile: bool = False  # Chạy yêu cầu dưới profiler (chỉ khi PROFILING_ENABLED=true)
 
 class QueryResponse(BaseModel):
     answer: str
     routing_info: Dict[str, Any]
     visualization_base64: Optional[str] = None
     current_agent: Optional[str] = "conversation"  # Thêm trường current_agent với giá trị mặc định
+    job_id: Optional[str] = None  # Mã tác vụ nền tạo biểu đồ (nếu có)
+    request_id: Optional[str] = None  # Mã yêu cầu (dùng để tìm trace)
+    usage: Optional[Dict[str, Any]] = None  # Token, thời gian chờ LLM và chi phí theo agent
+    profile: Optional[Dict[str, Any]] = None  # Tóm tắt profile và đường dẫn artifact (nếu yêu cầu profile)
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    visualization_base64: Optional[str] = None
+    chart_info: Optional[Dict[str, Any]] = None
+    message: Optional[str] = None
     
 # Tạo một đối tượng ThreadPoolExecutor để chạy các tác vụ không phải async trong thread riêng
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+EXECUTOR_WORKERS = 10
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+# ThreadPoolExecutor không có API công khai cho số tác vụ đang chờ: tự đếm quanh run_in_threadpool
+EXECUTOR_QUEUE_DEPTH = REGISTRY.gauge(
+    "agent_executor_queue_depth", "Số tác vụ đang chờ trong thread pool", ("executor",))
+EXECUTOR_QUEUE_DEPTH.set(0, executor="api")
+
+# Hàng đợi riêng cho các biểu đồ render chậm, tách biệt với thread pool phục vụ câu hỏi
+job_queue = JobQueue(
+    num_workers=int(os.getenv("VIZ_JOB_WORKERS", "2")),
+    max_queue_size=int(os.getenv("VIZ_JOB_QUEUE_SIZE", "20")),
+)
+
+def _collect_api_metrics():
+    """Kích thước thread pool và độ sâu hàng đợi tạo biểu đồ (tính lúc scrape)."""
+    yield ("agent_executor_workers", "Số worker tối đa của thread pool", {"executor": "api"}, EXECUTOR_WORKERS)
+    yield ("agent_job_queue_depth", "Số tác vụ tạo biểu đồ đang chờ", {}, job_queue.queue_depth())
+
+REGISTRY.register_collector(_collect_api_metrics)
+REGISTRY.register_collector(agent_system.metrics_samples)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Đếm yêu cầu, số yêu cầu đang xử lý và độ trễ theo endpoint."""
+    if not request.url.path.startswith("/api/") or request.url.path == "/api/metrics":
+        return await call_next(request)
+    REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Dùng mẫu đường dẫn của route (ví dụ /api/jobs/{job_id}) để số nhãn không tăng theo tham số;
+        # đường dẫn không khớp route nào (404) dùng chung một nhãn
+        endpoint = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUESTS_IN_FLIGHT.dec()
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=str(status))
+        REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
 
 async def run_in_threadpool(func, *args, **kwargs):
     """
@@ -73,47 +142,88 @@ async def run_in_threadpool(func, *args, **kwargs):
     Returns:
         Kết quả của hàm
     """
+    # Giữ trace của yêu cầu trong thread (run_in_executor không sao chép contextvars)
+    func = propagate(func)
+    
+    def task():
+        EXECUTOR_QUEUE_DEPTH.dec(executor="api")
+        return func(*args, **kwargs)
+    
+    EXECUTOR_QUEUE_DEPTH.inc(executor="api")
     return await asyncio.get_event_loop().run_in_executor(
-        executor, lambda: func(*args, **kwargs)
+        executor, task
     )
 
-async def process_question_async(question: str) -> Dict[str, Any]:
+async def process_question_async(question: str, background_visualization: bool = False,
+                                 request_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Xử lý câu hỏi của người dùng thông qua FinancialAgentSystem.
     
     Args:
         question (str): Câu hỏi của người dùng
+        background_visualization (bool): Nếu True, biểu đồ được tạo trong tác vụ nền
+            và câu trả lời văn bản được trả về ngay kèm job_id
+        request_id (Optional[str]): Mã yêu cầu gắn với trace (tự sinh nếu không truyền)
     Returns:
         Dict: Kết quả xử lý từ hệ thống agent tài chính
     """
+    # Mọi span và lời gọi LLM của router, agent và synthesizer trong yêu cầu này thuộc cùng một trace
+    with trace("api.query", request_id=request_id, question=question), track_usage() as usage:
+        result = await _process_question(question, background_visualization)
+        result["usage"] = usage.summary()
+        return result
+
+async def _process_question(question: str, background_visualization: bool) -> Dict[str, Any]:
+    """Phần xử lý chính của process_question_async (chạy bên trong trace của yêu cầu)."""
     try:
-        # Lấy thông tin định tuyến từ router (chạy trong thread riêng)
-        routing_info = await run_in_threadpool(agent_system.router.detailed_routing, question)
+        # Lấy thông tin định tuyến từ router, đồng thời sinh SQL suy đoán nếu được bật (chạy trong thread riêng)
+        routing_info, speculation_id = await run_in_threadpool(agent_system.route, question)
         logger.info(f"Thông tin định tuyến: {json.dumps(routing_info, ensure_ascii=False, indent=2)}")
         
+        defer_visualization = background_visualization and "visualize" in routing_info["selected_agents"]
+        
         # Xử lý câu hỏi thông qua hệ thống agent (chạy trong thread riêng)
-        final_answer = await run_in_threadpool(agent_system.process_question, question)
+        # Dùng lại kết quả định tuyến ở trên, đồ thị không định tuyến lại
+        final_state = await run_in_threadpool(
+            agent_system.run_workflow, question,
+            deferred_agents=["visualize"] if defer_visualization else None,
+            selected_agents=routing_info["selected_agents"],
+            draft_sql=routing_info.get("draft_sql"),
+            speculation_id=speculation_id
+        )
+        final_answer = final_state["final_answer"]
+        agent_results = final_state.get("agent_results", [])
         logger.info(f"Xử lý câu hỏi hoàn tất")
         
-        # Tìm kiếm thông tin biểu đồ (nếu có)
+        # Tìm kiếm thông tin biểu đồ (nếu có) trong trạng thái cuối cùng của workflow
         visualization_base64 = None
-        if "visualize" in routing_info["selected_agents"]:
-            # Truy cập trực tiếp vào kết quả cuối cùng của workflow
+        for result in agent_results:
+            if result.get("agent_name") == "visualize" and result.get("additional_data", {}).get("success", False):
+                visualization_base64 = result.get("additional_data", {}).get("visualization_base64", None)
+                if visualization_base64:
+                    logger.info("Tìm thấy dữ liệu biểu đồ")
+                break
+        
+        # Đưa việc tạo biểu đồ vào hàng đợi nền, dùng lại kết quả truy vấn đã có
+        job_id = None
+        if defer_visualization:
+            query_result = None
+            for result in agent_results:
+                data = result.get("additional_data", {})
+                if result.get("agent_name") == "database_query" and data.get("success", False):
+                    query_result = {
+                        "query": data.get("query", ""),
+                        "columns": data.get("columns", []),
+                        "results": data.get("results", []),
+                    }
+                    break
             try:
-                # Lấy final_state từ lần chạy cuối cùng của workflow
-                # Tạo config mặc định để truyền vào hàm get_state
-                config = {"configurable": {"thread_id": "default"}}
-                final_state = await run_in_threadpool(agent_system.workflow.get_state, config)
-                agent_results = final_state.get('agent_results', [])
-                
-                for result in agent_results:
-                    if result.get("agent_name") == "visualize" and result.get("additional_data", {}).get("success", False):
-                        visualization_base64 = result.get("additional_data", {}).get("visualization_base64", None)
-                        if visualization_base64:
-                            logger.info("Tìm thấy dữ liệu biểu đồ")
-                        break
-            except Exception as viz_error:
-                logger.warning(f"Không thể truy cập kết quả visualize: {viz_error}")
+                job_id = job_queue.submit(
+                    agent_system.render_visualization, question, query_result, current_request_id()
+                )
+                logger.info(f"Đã tạo tác vụ nền {job_id} cho biểu đồ (đang chờ: {job_queue.queue_depth()})")
+            except queue.Full:
+                raise HTTPException(status_code=503, detail="Hàng đợi tạo biểu đồ đang đầy, vui lòng thử lại sau")
         
         # Thêm thông tin agent hiện tại đang xử lý dựa trên routing_info
         current_agent = "conversation"  # Mặc định là conversation
@@ -121,7 +231,7 @@ async def process_question_async(question: str) -> Dict[str, Any]:
         # Xác định agent hiện tại dựa trên selected_agents và kết quả
         if routing_info and "selected_agents" in routing_info and routing_info["selected_agents"]:
             # Xác định agent cuối cùng dựa trên thứ tự ưu tiên
-            if "visualize" in routing_info["selected_agents"] and visualization_base64:
+            if "visualize" in routing_info["selected_agents"] and (visualization_base64 or job_id):
                 current_agent = "visualize"
             elif "database_query" in routing_info["selected_agents"]:
                 current_agent = "database_query"
@@ -130,50 +240,88 @@ async def process_question_async(question: str) -> Dict[str, Any]:
             else:
                 current_agent = routing_info["selected_agents"][0]
         
-        # Lấy trạng thái cuối cùng của workflow để kiểm tra agent_results
-        try:
-            config = {"configurable": {"thread_id": "default"}}
-            final_state = await run_in_threadpool(agent_system.workflow.get_state, config)
-            
-            # Kiểm tra trực tiếp trong agent_results nếu có
-            if final_state and "agent_results" in final_state and final_state["agent_results"]:
-                # Lấy agent cuối cùng hoạt động trong chuỗi xử lý
-                for result in reversed(final_state["agent_results"]):
-                    if result.get("agent_name") in ["visualize", "database_query", "google_search", "conversation"]:
-                        current_agent = result["agent_name"]
-                        break
-        except Exception as e:
-            logger.warning(f"Không thể lấy thông tin agent_results: {e}")
+        # Lấy agent cuối cùng hoạt động trong chuỗi xử lý (biểu đồ nền vẫn được coi là visualize)
+        if not job_id:
+            for result in reversed(agent_results):
+                if result.get("agent_name") in ["visualize", "database_query", "google_search", "conversation"]:
+                    current_agent = result["agent_name"]
+                    break
         
         return {
             "answer": final_answer,
             "routing_info": routing_info,
             "visualization_base64": visualization_base64,
-            "current_agent": current_agent
+            "current_agent": current_agent,
+            "job_id": job_id,
+            "request_id": current_request_id()
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Lỗi khi xử lý câu hỏi: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
 
 @app.post("/api/query", response_model=QueryResponse)
-async def query(request: QueryRequest, background_tasks: BackgroundTasks):
+async def query(request: QueryRequest, background_tasks: BackgroundTasks, http_request: Request):
     """
     Xử lý câu hỏi từ người dùng và trả về kết quả từ hệ thống agent tài chính.
     """
     question = request.question
-    logger.info(f"Nhận câu hỏi: {question}")
+    # Dùng mã yêu cầu từ header X-Request-ID nếu client gửi lên và hợp lệ
+    request_id = http_request.headers.get("X-Request-ID", "")
+    if not REQUEST_ID_PATTERN.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    logger.info(f"Nhận câu hỏi [{request_id}]: {question}")
     
-    result = await process_question_async(question)
+    profile = None
+    if request.profile:
+        if not profiling_enabled():
+            raise HTTPException(status_code=403, detail="Profiling đang bị tắt (PROFILING_ENABLED)")
+        try:
+            with profile_request(request_id) as profile:
+                result = await process_question_async(question, request.background_visualization, request_id)
+        except ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    else:
+        result = await process_question_async(question, request.background_visualization, request_id)
     
     # Đảm bảo trả về current_agent cho frontend
     return {
         "answer": result["answer"],
         "routing_info": result["routing_info"],
         "visualization_base64": result["visualization_base64"],
-        "current_agent": result.get("current_agent", "conversation")  # Đặt mặc định là conversation nếu không có
+        "current_agent": result.get("current_agent", "conversation"),  # Đặt mặc định là conversation nếu không có
+        "job_id": result.get("job_id"),
+        "request_id": result.get("request_id"),
+        "usage": result.get("usage"),
+        "profile": profile
     }
 
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    Lấy trạng thái của tác vụ tạo biểu đồ chạy nền (pending | running | done | failed).
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tác vụ hoặc tác vụ đã hết hạn")
+    
+    response = job.to_dict()
+    if job.status == "done" and job.result:
+        response["visualization_base64"] = job.result.get("visualization_base64") or None
+        response["chart_info"] = job.result.get("chart_info")
+        response["message"] = job.result.get("message")
+        if not job.result.get("success", False):
+            response["status"] = "failed"
+            response["error"] = job.result.get("message") or "Không thể tạo biểu đồ"
+    return response
+
+@app.get("/api/metrics")
+async def metrics():
+    """Metric của hệ thống ở định dạng văn bản Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
 async def health_check():
     """Kiểm tra trạng thái hoạt động của API."""
@@ -0,0 +1,173 @@
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from src.agent.companies import EntityResolver
+
+_resolver = EntityResolver()
+
+
+class LatencyModel:
+    """
+    Phân phối độ trễ log-normal (trung vị và độ phân tán cấu hình được).
+
+    sigma = 0 cho độ trễ cố định; sigma khoảng 0.5 cho đuôi dài giống API thật.
+    """
+
+    def __init__(self, median_ms: float = 300.0, sigma: float = 0.5, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Một mẫu độ trễ (giây)."""
+        if self.median_ms <= 0:
+            return 0.0
+        with self._lock:
+            factor = self._random.lognormvariate(0.0, self.sigma) if self.sigma > 0 else 1.0
+        return self.median_ms * factor / 1000.0
+
+
+def _question(prompt: str) -> str:
+    """Câu hỏi của người dùng trong prompt (dòng "Câu hỏi:" cuối cùng)."""
+    matches = re.findall(r"Câu hỏi:\s*(.+)", prompt)
+    return matches[-1].strip() if matches else prompt.strip().splitlines()[-1] if prompt.strip() else ""
+
+
+def _confidences(question: str) -> Dict[str, float]:
+    text = question.lower()
+    if any(word in text for word in ("chart", "plot", "biểu đồ", "graph")):
+        return {"database_query": 0.03, "google_search": 0.01, "visualize": 0.95, "conversation": 0.01}
+    if any(word in text for word in ("news", "latest", "tin tức", "mới nhất")):
+        return {"database_query": 0.1, "google_search": 0.85, "visualize": 0.0, "conversation": 0.05}
+    if any(word in text for word in ("hello", "hi ", "xin chào", "thank", "cảm ơn")):
+        return {"database_query": 0.0, "google_search": 0.0, "visualize": 0.0, "conversation": 1.0}
+    return {"database_query": 0.9, "google_search": 0.05, "visualize": 0.0, "conversation": 0.05}
+
+
+def _sql(question: str) -> str:
+    """Câu query mẫu cho câu hỏi (đủ để đi qua toàn bộ luồng xử lý)."""
+    symbols = _resolver.resolve(question) or ["AAPL"]
+    symbol_list = ", ".join(f"'{symbol}'" for symbol in symbols)
+    text = question.lower()
+    if any(word in text for word in ("chart", "plot", "biểu đồ", "trend")):
+        return (f"SELECT date, symbol, close_price FROM stock_prices WHERE symbol IN ({symbol_list}) "
+                f"ORDER BY date")
+    if "average" in text or "trung bình" in text:
+        return (f"SELECT symbol, AVG(close_price) AS average_close FROM stock_prices "
+                f"WHERE symbol IN ({symbol_list}) GROUP BY symbol")
+    return (f"SELECT symbol, date, close_price FROM stock_prices WHERE symbol IN ({symbol_list}) "
+            f"ORDER BY date DESC LIMIT 1")
+
+
+def canned_response(prompt: str) -> str:
+    """
+    Phản hồi mẫu theo loại prompt (router, planner, sinh SQL, biểu đồ, tổng hợp, hội thoại).
+
+    Args:
+        prompt (str): Nội dung prompt (các message được nối lại)
+    Returns:
+        str: Nội dung phản hồi
+    """
+    question = _question(prompt)
+    if '"confidences"' in prompt and '"sql"' in prompt:
+        confidences = _confidences(question)
+        data_agent = confidences["database_query"] + confidences["visualize"] > 0.5
+        return json.dumps({"confidences": confidences, "sql": _sql(question) if data_agent else None})
+    if "Phân loại câu hỏi sau" in prompt:
+        return json.dumps(_confidences(question))
+    if "câu query SQL" in prompt:
+        return f"```sql\n{_sql(question)}\n```"
+    if "đề xuất loại biểu đồ" in prompt:
+        return "```json\n" + json.dumps({
+            "chart_type": "line", "x_column": "date", "y_column": "close_price",
+            "title": "Giá đóng cửa", "explanation": "Dữ liệu theo thời gian",
+        }) + "\n```"
+    if "Kết quả từ các agent" in prompt:
+        return "Tổng hợp: dữ liệu cho thấy kết quả như bảng trên."
+    return "Xin chào! Tôi có thể giúp gì cho bạn về thông tin tài chính?"
+
+
+class FakeOpenAIServer:
+    """
+    Máy chủ giả lập API chat completions tương thích OpenAI, chạy trong thread nền.
+
+    Mỗi yêu cầu chờ một khoảng thời gian lấy từ LatencyModel rồi trả về phản hồi mẫu.
+    Số lời gọi và tổng độ trễ giả lập được ghi lại để tách khỏi thời gian của hệ thống.
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency or LatencyModel()
+        self.calls = 0
+        self.simulated_seconds = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _record(self, delay: float):
+        with self._lock:
+            self.calls += 1
+            self.simulated_seconds += delay
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                messages: List[Dict[str, Any]] = body.get("messages", [])
+                prompt = "\n".join(str(m.get("content", "")) for m in messages)
+                delay = server.latency.sample()
+                time.sleep(delay)
+                server._record(delay)
+                content = canned_response(prompt)
+                payload = json.dumps({
+                    "id": f"chatcmpl-bench-{server.calls}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "bench"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": len(prompt) // 4,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": (len(prompt) + len(content)) // 4,
+                    },
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
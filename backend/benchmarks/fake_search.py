@@ -0,0 +1,37 @@
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from benchmarks.fake_openai import LatencyModel
+
+
+class FakeTavilySearch:
+    """
+    Thay thế TavilySearch trong GoogleSearchAgent: trả về kết quả mẫu sau một độ trễ giả lập.
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None, max_results: int = 3):
+        self.latency = latency or LatencyModel(median_ms=800.0)
+        self.max_results = max_results
+        self.calls = 0
+        self.simulated_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def invoke(self, query: str) -> Dict[str, Any]:
+        delay = self.latency.sample()
+        time.sleep(delay)
+        with self._lock:
+            self.calls += 1
+            self.simulated_seconds += delay
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Tin tức #{i + 1} về {query[:40]}",
+                    "url": f"https://example.com/news/{i + 1}",
+                    "content": f"Nội dung mẫu #{i + 1} cho truy vấn: {query}. " * 5,
+                    "score": round(0.9 - 0.1 * i, 2),
+                }
+                for i in range(self.max_results)
+            ],
+        }
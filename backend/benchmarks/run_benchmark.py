@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import functools
+import threading
+import concurrent.futures
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from benchmarks.fake_openai import FakeOpenAIServer, LatencyModel
+from benchmarks.fake_search import FakeTavilySearch
+from benchmarks.sqlite_db import create_database, patch_psycopg2
+
+# Các node của đồ thị được đo thời gian
+STAGES = {
+    "_route_question": "router",
+    "_run_conversation_agent": "conversation",
+    "_run_database_query_agent": "database_query",
+    "_run_google_search_agent": "google_search",
+    "_run_visualize_agent": "visualize",
+    "_synthesize_results": "synthesizer",
+}
+
+# Câu hỏi bổ sung để đi qua các nhánh không phải truy vấn dữ liệu
+EXTRA_QUESTIONS = [
+    "Xin chào, bạn có thể giúp gì cho tôi?",
+    "What is the latest news about Apple?",
+    "Plot the closing price of Microsoft as a line chart",
+    "Draw a chart comparing the closing prices of Boeing and Caterpillar",
+]
+
+
+class StageTimer:
+    """Ghi lại thời gian của từng lần chạy theo stage."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (mili giây) của một danh sách thời gian (giây)."""
+    if not values:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)
+
+    return {"count": len(values), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def load_questions(path: str, limit: int) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+    return (questions[:limit] if limit else questions) + EXTRA_QUESTIONS
+
+
+def configure_environment(llm_url: str, workdir: str):
+    """Trỏ ứng dụng tới các dịch vụ giả lập và tắt các tính năng ghi file."""
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["TAVILY_API_KEY"] = "bench"
+    os.environ["LLM_TIER_SMALL_BASE_URL"] = llm_url
+    os.environ["LLM_TIER_LARGE_BASE_URL"] = llm_url
+    os.environ["SQL_EXAMPLES_PATH"] = ""
+    os.environ["ROUTING_LOG_PATH"] = os.path.join(workdir, "routing_log.jsonl")
+    os.environ.setdefault("ROUTING_CACHE_EMBEDDER", "off")
+
+
+def run_graph(system, questions: List[str], clients: int, requests: int) -> List[float]:
+    """Chạy requests câu hỏi qua FinancialAgentSystem với clients luồng đồng thời."""
+    def one(i):
+        start = time.perf_counter()
+        system.run_workflow(questions[i % len(questions)])
+        return time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+        return list(executor.map(one, range(requests)))
+
+
+def run_api(api_module, questions: List[str], clients: int, requests: int) -> List[float]:
+    """Chạy requests câu hỏi qua hàm xử lý của api.py với clients coroutine đồng thời."""
+    async def main():
+        semaphore = asyncio.Semaphore(clients)
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await api_module.process_question_async(questions[i % len(questions)])
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(one(i) for i in range(requests)))
+
+    return list(asyncio.run(main()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ của hệ thống agent với các dịch vụ giả lập")
+    parser.add_argument("--target", choices=["graph", "api"], default="graph")
+    parser.add_argument("--clients", type=int, default=4, help="Số client đồng thời")
+    parser.add_argument("--requests", type=int, default=40, help="Tổng số câu hỏi")
+    parser.add_argument("--questions", default="data/djia_qna.json")
+    parser.add_argument("--question-limit", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Trung vị độ trễ LLM giả lập")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="Độ phân tán log-normal của độ trễ LLM")
+    parser.add_argument("--search-latency-ms", type=float, default=800.0)
+    parser.add_argument("--db-days", type=int, default=500, help="Số ngày giá cho mỗi công ty trong SQLite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Ghi báo cáo JSON vào file này")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    server = FakeOpenAIServer(LatencyModel(args.llm_latency_ms, args.llm_sigma, args.seed)).start()
+    configure_environment(server.base_url, workdir)
+    db_stats = patch_psycopg2(create_database(os.path.join(workdir, "bench.sqlite"), args.db_days, args.seed))
+    search = FakeTavilySearch(LatencyModel(args.search_latency_ms, args.llm_sigma, args.seed + 1))
+
+    # Đo thời gian từng node trước khi đồ thị được xây dựng (các node là bound method)
+    from main import FinancialAgentSystem
+    timer = StageTimer()
+    for method, stage in STAGES.items():
+        setattr(FinancialAgentSystem, method, timer.wrap(stage, getattr(FinancialAgentSystem, method)))
+
+    questions = load_questions(args.questions, args.question_limit)
+    if args.target == "api":
+        import api as api_module
+        system = api_module.agent_system
+    else:
+        api_module = None
+        system = FinancialAgentSystem()
+    system.agents["google_search"].search = search
+
+    start = time.perf_counter()
+    if api_module is not None:
+        latencies = run_api(api_module, questions, args.clients, args.requests)
+    else:
+        latencies = run_graph(system, questions, args.clients, args.requests)
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    report = {
+        "target": args.target,
+        "clients": args.clients,
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 3) if elapsed else 0.0,
+        "end_to_end": percentiles(latencies),
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(timer.samples.items())},
+        # Thời gian của các dịch vụ giả lập: phần còn lại là chi phí của chính hệ thống
+        "backends": {
+            "llm": {"calls": server.calls, "simulated_s": round(server.simulated_seconds, 3)},
+            "search": {"calls": search.calls, "simulated_s": round(search.simulated_seconds, 3)},
+            "db": {"queries": db_stats.queries, "seconds": round(db_stats.seconds, 3)},
+        },
+    }
+    backend_seconds = server.simulated_seconds + search.simulated_seconds + db_stats.seconds
+    report["orchestration_overhead_ms_per_request"] = round(
+        max(sum(latencies) - backend_seconds, 0.0) / max(len(latencies), 1) * 1000, 2
+    )
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    # Chạy từ thư mục backend: python -m benchmarks.run_benchmark --clients 8 --requests 100
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,244 @@
+import math
+import time
+import random
+import sqlite3
+import hashlib
+import datetime
+import threading
+import statistics
+from typing import Any, List, Optional
+
+import psycopg2
+import psycopg2.pool
+import sqlglot
+from sqlglot import exp
+
+from src.agent.companies import COMPANY_ALIASES, CompaniesSnapshot
+
+SCHEMA = """
+CREATE TABLE companies (
+    symbol TEXT PRIMARY KEY, name TEXT NOT NULL, sector TEXT, industry TEXT, country TEXT,
+    website TEXT, market_cap INTEGER, pe_ratio REAL, dividend_yield REAL,
+    fifty_two_week_high REAL, fifty_two_week_low REAL, description TEXT
+);
+CREATE TABLE stock_prices (
+    id INTEGER PRIMARY KEY, date TEXT NOT NULL, open_price REAL, high_price REAL, low_price REAL,
+    close_price REAL, volume INTEGER, dividends REAL, stock_splits REAL, symbol TEXT,
+    UNIQUE (symbol, date)
+);
+CREATE INDEX idx_stock_prices_date ON stock_prices(date);
+CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
+"""
+
+# Các query dùng cú pháp riêng của PostgreSQL mà sqlglot không chuyển được sang SQLite
+REWRITES = {
+    CompaniesSnapshot.VERSION_QUERY: (
+        "SELECT md5(group_concat(symbol || '|' || name || '|' || COALESCE(market_cap, ''), ',')) "
+        "FROM (SELECT * FROM companies ORDER BY symbol)"
+    ),
+}
+
+# Định dạng strftime tương ứng với EXTRACT(<unit> FROM ...) (SQLite không có EXTRACT)
+_EXTRACT_FORMATS = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d", "DOW": "%w", "WEEK": "%W", "DOY": "%j"}
+
+
+def _rewrite_extract(node: exp.Expression) -> exp.Expression:
+    if isinstance(node, exp.Extract):
+        unit = node.this.name.upper()
+        if unit in _EXTRACT_FORMATS:
+            strftime = exp.Anonymous(this="STRFTIME", expressions=[
+                exp.Literal.string(_EXTRACT_FORMATS[unit]), node.expression
+            ])
+            return exp.Cast(this=strftime, to=exp.DataType.build("INTEGER"))
+    return node
+
+
+def to_sqlite(query: str) -> str:
+    """Chuyển câu query PostgreSQL sang SQLite."""
+    if query in REWRITES:
+        return REWRITES[query]
+    tree = sqlglot.parse_one(query, read="postgres").transform(_rewrite_extract)
+    return tree.sql(dialect="sqlite")
+
+
+class _StdDev:
+    """Hàm tổng hợp STDDEV (độ lệch chuẩn mẫu) cho SQLite."""
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(float(value))
+
+    def finalize(self):
+        return statistics.stdev(self.values) if len(self.values) > 1 else None
+
+
+def create_database(path: str, days: int = 500, seed: int = 0) -> str:
+    """
+    Tạo cơ sở dữ liệu SQLite với cùng schema và dữ liệu giá giả lập cho 30 công ty DJIA.
+
+    Args:
+        path (str): Đường dẫn file SQLite
+        days (int): Số ngày giao dịch cho mỗi công ty
+        seed (int): Seed cho dữ liệu ngẫu nhiên
+    Returns:
+        str: Đường dẫn file SQLite
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    start = datetime.date(2023, 1, 2)
+    dates = [start + datetime.timedelta(days=i) for i in range(days * 7 // 5 + 7)]
+    dates = [d.isoformat() for d in dates if d.weekday() < 5][:days]
+    for symbol, aliases in COMPANY_ALIASES.items():
+        price = rng.uniform(30, 500)
+        rows = []
+        for date in dates:
+            open_price = price
+            price = max(1.0, price * (1 + rng.gauss(0.0003, 0.015)))
+            rows.append((date, round(open_price, 2), round(max(open_price, price) * 1.01, 2),
+                         round(min(open_price, price) * 0.99, 2), round(price, 2),
+                         rng.randint(1_000_000, 50_000_000), 0.0, 0.0, symbol))
+        conn.executemany(
+            "INSERT INTO stock_prices (date, open_price, high_price, low_price, close_price, volume, "
+            "dividends, stock_splits, symbol) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        closes = [row[4] for row in rows[-252:]]
+        conn.execute(
+            "INSERT INTO companies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (symbol, f"{aliases[0]} Inc.", "Technology", "Software", "United States",
+             f"https://{aliases[0].lower().replace(' ', '')}.com", rng.randint(10**10, 3 * 10**12),
+             round(rng.uniform(10, 40), 2), round(rng.uniform(0, 4), 2), max(closes), min(closes),
+             f"{aliases[0]} là một công ty thuộc chỉ số DJIA.")
+        )
+    conn.commit()
+    conn.close()
+    return path
+
+
+class SQLiteCursor:
+    """Cursor tương thích psycopg2: chuyển câu query PostgreSQL sang SQLite bằng sqlglot."""
+
+    def __init__(self, connection: "SQLiteConnection"):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self.description = None
+
+    def execute(self, query: str, params: Optional[Any] = None):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(to_sqlite(query), params or ())
+        except (sqlite3.Error, sqlglot.errors.SqlglotError) as e:
+            raise psycopg2.Error(str(e))
+        finally:
+            self._connection.record(time.perf_counter() - start)
+        self.description = self._cursor.description
+
+    def fetchall(self) -> List[tuple]:
+        return self._cursor.fetchall()
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._cursor.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection:
+    """Kết nối tương thích psycopg2 tới file SQLite."""
+
+    def __init__(self, path: str, stats: "QueryStats"):
+        self.raw = sqlite3.connect(path, check_same_thread=False)
+        self.raw.create_function("md5", 1, lambda text: hashlib.md5(str(text).encode()).hexdigest())
+        for name, func in (("sqrt", math.sqrt), ("ln", math.log), ("exp", math.exp)):
+            self.raw.create_function(name, 1, lambda x, f=func: None if x is None else f(x))
+        self.raw.create_function("power", 2, lambda x, y: None if x is None or y is None else math.pow(x, y))
+        for name in ("stddev", "stddev_samp"):
+            self.raw.create_aggregate(name, 1, _StdDev)
+        self.autocommit = False
+        self._stats = stats
+
+    def record(self, seconds: float):
+        self._stats.record(seconds)
+
+    def cursor(self) -> SQLiteCursor:
+        return SQLiteCursor(self)
+
+    def set_session(self, readonly: bool = False, autocommit: bool = False):
+        self.autocommit = autocommit
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+class QueryStats:
+    """Số query và tổng thời gian thực thi trên SQLite."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+
+
+class SQLitePool:
+    """
+    Thay thế psycopg2.pool.ThreadedConnectionPool (mỗi lần lấy là một kết nối SQLite mới).
+
+    Giới hạn maxconn kết nối đang dùng như pool thật: vượt quá thì báo PoolError, để
+    benchmark thấy được tình trạng hết kết nối thay vì có số kết nối không giới hạn.
+    """
+
+    def __init__(self, path: str, stats: QueryStats, minconn: int = 1, maxconn: int = 1):
+        self._path = path
+        self._stats = stats
+        self.maxconn = maxconn
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def getconn(self) -> SQLiteConnection:
+        with self._lock:
+            if self._in_use >= self.maxconn:
+                raise psycopg2.pool.PoolError("connection pool exhausted")
+            self._in_use += 1
+        return SQLiteConnection(self._path, self._stats)
+
+    def putconn(self, conn: SQLiteConnection, close: bool = False):
+        conn.close()
+        with self._lock:
+            self._in_use -= 1
+
+
+def patch_psycopg2(path: str) -> QueryStats:
+    """
+    Chuyển mọi kết nối psycopg2 của ứng dụng sang file SQLite.
+
+    Args:
+        path (str): Đường dẫn file SQLite (tạo bằng create_database)
+    Returns:
+        QueryStats: Thống kê query để tách thời gian cơ sở dữ liệu khỏi thời gian của hệ thống
+    """
+    stats = QueryStats()
+    psycopg2.connect = lambda *args, **kwargs: SQLiteConnection(path, stats)
+    psycopg2.pool.ThreadedConnectionPool = lambda minconn, maxconn, *args, **kwargs: SQLitePool(
+        path, stats, minconn, maxconn
+    )
+    return stats
@@ -0,0 +1 @@
+# Đặt thư mục backend vào sys.path để các test import được "src.*" như main.py và api.py
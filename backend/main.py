@@ -1,10 +1,11 @@
 import os
 import json
+import uuid
 import asyncio
+import threading
 import concurrent.futures
 from dotenv import load_dotenv
-from typing import Dict, List, Any, Callable, TypedDict, Annotated, Literal
-from langchain_openai import ChatOpenAI
+from typing import Dict, List, Any, Callable, Iterator, TypedDict, Annotated, Literal, Optional, Tuple
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langgraph.graph.message import add_messages
@@ -13,8 +14,15 @@ from langgraph.graph.message import add_messages
 from src.router.router import FinancialMultiAgentRouter
 from src.agent.conversation import ConversationAgent
 from src.agent.database_query import DatabaseQueryAgent
+from src.agent.example_store import SQLExampleStore
 from src.agent.google_search import GoogleSearchAgent
 from src.agent.visualize_agent import VisualizeAgent
+from src.utils.llm import TIERS, get_model_policy, is_complex_question, tier_model_name
+from src.utils.context_builder import DEFAULT_CONTEXT_BUDGET, build_synthesis_context, summarize_table
+from src.utils.synthesis import template_answer
+from src.utils.cassette import get_cassette
+from src.utils.tracing import propagate, span, trace, traced
+from src.utils.usage import agent_scope, track_usage
 
 # Load environment variables
 load_dotenv()
@@ -43,12 +51,18 @@ class AgentState(TypedDict):
         agent_results (List[AgentResult]): Kết quả từ các agent
         final_answer (str): Câu trả lời cuối cùng
         status (str): Trạng thái hiện tại
+        deferred_agents (List[str]): Các agent được hoãn sang chạy nền (không chạy trong luồng chính)
+        draft_sql (Optional[str]): Query nháp do planner của router sinh ra (nếu có)
+        speculation_id (Optional[str]): Mã truy vấn suy đoán chạy song song với định tuyến (nếu có)
     """
     question: str
     selected_agents: List[str]
     agent_results: List[AgentResult]
     final_answer: str
     status: Literal["ROUTING", "PROCESSING", "COMPLETE"]
+    deferred_agents: List[str]
+    draft_sql: Optional[str]
+    speculation_id: Optional[str]
 
 class FinancialAgentSystem:
     """
@@ -60,14 +74,18 @@ class FinancialAgentSystem:
         Khởi tạo hệ thống agent tài chính.
         
         Args:
-            model_name (str): Tên của mô hình LLM
+            model_name (str): Tên mô hình LLM của các agent conversation và visualize (sinh SQL
+                và tổng hợp câu trả lời dùng ModelPolicy theo tầng LLM_TIER_SMALL/LLM_TIER_LARGE)
         """
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.model_name = model_name
-        self.llm = ChatOpenAI(
-            model_name=self.model_name,
-            openai_api_key=self.api_key
-        )
+        self.model_policy = get_model_policy()
+        # Chính sách tổng hợp: "auto" dùng mẫu cho trường hợp đơn giản, "llm" luôn gọi LLM
+        self.synthesis_mode = os.getenv("SYNTHESIS_MODE", "auto").lower()
+        # Ghi/phát lại các lời gọi LLM, embedding và tìm kiếm (CASSETTE_MODE)
+        self.cassette = get_cassette()
+        if self.cassette:
+            print(f"Cassette {self.cassette.mode}: {self.cassette.path}")
         
         # Khởi tạo router và các agent
         self.router = FinancialMultiAgentRouter()
@@ -87,7 +105,12 @@ class FinancialAgentSystem:
                 dbname=db_name, 
                 user=db_user, 
                 password=db_password, 
-                model_name=model_name
+                model_name=model_name,
+                readonly_pool_size=int(os.getenv("DB_READONLY_POOL_SIZE", "4")),
+                num_candidates=int(os.getenv("SQL_CANDIDATES", "1")),
+                candidate_strategy=os.getenv("SQL_CANDIDATE_STRATEGY", "first").lower(),
+                example_store=self._create_example_store(),
+                companies_refresh_interval=float(os.getenv("COMPANIES_REFRESH_INTERVAL", "300"))
             ),
             "google_search": GoogleSearchAgent(
                 api_key=os.getenv("TAVILY_API_KEY"),
@@ -104,9 +127,212 @@ class FinancialAgentSystem:
             )
         }
         
+        # Sinh SQL suy đoán song song với định tuyến: off | generate | execute
+        self.speculation_mode = os.getenv("SPECULATIVE_SQL", "off").lower()
+        self._speculation_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.getenv("SPECULATIVE_SQL_WORKERS", "4")),
+            thread_name_prefix="sql-speculation"
+        )
+        # Mã suy đoán -> (future, sự kiện hủy để bỏ qua việc thực thi query khi bị loại bỏ giữa chừng)
+        self._speculations: Dict[str, Tuple[concurrent.futures.Future, threading.Event]] = {}
+        self._speculation_lock = threading.Lock()
+        self._speculation_counts = {"started": 0, "reused_results": 0, "used_as_draft": 0, "discarded": 0, "failed": 0}
+        
         # Xây dựng đồ thị LangGraph
         self.workflow = self._build_graph()
     
+    def route(self, question: str) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Định tuyến câu hỏi, đồng thời sinh SQL suy đoán nếu chế độ suy đoán được bật.
+        
+        Args:
+            question (str): Câu hỏi từ người dùng
+            
+        Returns:
+            Tuple[Dict[str, Any], Optional[str]]: Thông tin định tuyến và mã truy vấn suy đoán
+                (None nếu không suy đoán hoặc kết quả suy đoán bị loại bỏ)
+        """
+        with trace("route", question=question), agent_scope("router"):
+            speculation_id = self._start_speculation(question)
+            with span("router.route"):
+                routing_info = self.router.detailed_routing(question)
+        
+        if speculation_id:
+            needs_data = any(name in ("database_query", "visualize") for name in routing_info["selected_agents"])
+            # Query nháp của planner được ưu tiên hơn kết quả suy đoán
+            if not needs_data or routing_info.get("draft_sql"):
+                self._discard_speculation(speculation_id)
+                speculation_id = None
+        
+        if self.speculation_mode in ("generate", "execute"):
+            routing_info["speculation"] = self.speculation_stats()
+        return routing_info, speculation_id
+    
+    @staticmethod
+    def _create_example_store() -> Optional[SQLExampleStore]:
+        """
+        Tạo kho ví dụ few-shot cho việc sinh SQL.
+        
+        Kho được lưu ở SQL_EXAMPLES_PATH (để trống để tắt) và được bổ sung các cặp đã
+        kiểm chứng trong file kết quả SQL_EXAMPLES_SEED (tùy chọn, là kết quả của một bộ câu
+        hỏi huấn luyện riêng, không phải bộ câu hỏi đánh giá DJIA).
+        
+        Returns:
+            Optional[SQLExampleStore]: Kho ví dụ, hoặc None nếu bị tắt
+        """
+        path = os.getenv("SQL_EXAMPLES_PATH", "data/sql_examples.jsonl")
+        if not path:
+            return None
+        try:
+            store = SQLExampleStore(path)
+            seed_path = os.getenv("SQL_EXAMPLES_SEED", "")
+            if seed_path and os.path.exists(seed_path):
+                added = store.load_verified_results(seed_path)
+                print(f"Đã nạp {added} ví dụ SQL mới từ {seed_path}")
+            print(f"Kho ví dụ SQL có {len(store)} cặp câu hỏi/SQL")
+            return store
+        except Exception as e:
+            print(f"Không thể tạo kho ví dụ SQL: {str(e)}")
+            return None
+    
+    def _start_speculation(self, question: str) -> Optional[str]:
+        """
+        Bắt đầu sinh (và tùy chọn thực thi) SQL trong thread riêng.
+        
+        Không suy đoán khi bộ phân loại cục bộ đã quyết định được (định tuyến gần như
+        tức thì nên suy đoán không giảm được độ trễ mà chỉ tốn thêm một lần gọi LLM),
+        và khi planner của router được bật (planner đã sinh query nháp trong lần gọi định tuyến).
+        
+        Args:
+            question (str): Câu hỏi từ người dùng
+            
+        Returns:
+            Optional[str]: Mã truy vấn suy đoán
+        """
+        if self.speculation_mode not in ("generate", "execute") or self.router.planner is not None:
+            return None
+        local = self.router.local_classifier.classify(question)
+        if local and local["margin"] >= self.router.local_margin:
+            return None
+        
+        speculation_id = uuid.uuid4().hex
+        cancelled = threading.Event()
+        future = self._speculation_executor.submit(
+            propagate(traced("speculation")(self._speculate)), question,
+            execute=self.speculation_mode == "execute", cancelled=cancelled
+        )
+        with self._speculation_lock:
+            self._speculations[speculation_id] = (future, cancelled)
+            self._speculation_counts["started"] += 1
+        return speculation_id
+    
+    def _speculate(self, question: str, execute: bool = False,
+                   cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Chạy DatabaseQueryAgent.speculate (lời gọi LLM được tính cho "speculation")."""
+        with agent_scope("speculation"):
+            return self.agents["database_query"].speculate(question, execute=execute, cancelled=cancelled)
+    
+    def _take_speculation(self, speculation_id: Optional[str], timeout: float = 60) -> Optional[Dict[str, Any]]:
+        """
+        Lấy kết quả truy vấn suy đoán (chỉ lấy được một lần).
+        
+        Args:
+            speculation_id (Optional[str]): Mã truy vấn suy đoán
+            timeout (float): Thời gian chờ tối đa (giây)
+            
+        Returns:
+            Optional[Dict[str, Any]]: Kết quả từ DatabaseQueryAgent.speculate hoặc None
+        """
+        if not speculation_id:
+            return None
+        with self._speculation_lock:
+            future, _ = self._speculations.pop(speculation_id, (None, None))
+        if future is None:
+            return None
+        
+        try:
+            speculation = future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Truy vấn suy đoán thất bại: {str(e)}")
+            with self._speculation_lock:
+                self._speculation_counts["failed"] += 1
+            return None
+        
+        # Kết quả đã thực thi được dùng thẳng, query chưa thực thi chỉ được dùng làm query nháp
+        if "error" in speculation:
+            outcome = "failed"
+        elif "results" in speculation:
+            outcome = "reused_results"
+        else:
+            outcome = "used_as_draft"
+        with self._speculation_lock:
+            self._speculation_counts[outcome] += 1
+        print(f"Dùng kết quả truy vấn suy đoán ({self.speculation_stats()})")
+        return speculation
+    
+    def _discard_speculation(self, speculation_id: Optional[str]):
+        """Hủy truy vấn suy đoán không còn cần đến."""
+        if not speculation_id:
+            return
+        with self._speculation_lock:
+            future, cancelled = self._speculations.pop(speculation_id, (None, None))
+            if future is not None:
+                # Future đang chạy không hủy được: báo cho speculate bỏ qua bước thực thi query
+                cancelled.set()
+                future.cancel()
+                self._speculation_counts["discarded"] += 1
+    
+    def speculation_stats(self) -> Dict[str, Any]:
+        """
+        Thống kê truy vấn suy đoán.
+        
+        Returns:
+            Dict[str, Any]: Số lần bắt đầu/dùng lại kết quả/dùng làm query nháp/bị loại bỏ/thất bại,
+                tỷ lệ trúng (dùng lại kết quả) và tỷ lệ dùng làm query nháp
+        """
+        with self._speculation_lock:
+            counts = dict(self._speculation_counts)
+        started = counts["started"]
+        counts["hit_rate"] = round(counts["reused_results"] / started, 3) if started else 0.0
+        counts["draft_rate"] = round(counts["used_as_draft"] / started, 3) if started else 0.0
+        return counts
+    
+    def metrics_samples(self) -> Iterator[Tuple[str, str, Dict[str, str], float]]:
+        """
+        Các gauge tính lúc scrape cho /api/metrics (cache, suy đoán, tầng mô hình, pool kết nối).
+        
+        Returns:
+            Iterator[Tuple[str, str, Dict[str, str], float]]: (tên metric, mô tả, nhãn, giá trị)
+        """
+        routing_cache = self.router.routing_cache
+        if routing_cache is not None:
+            cache = routing_cache.stats()
+            for key in ("hits", "misses", "hit_rate", "size"):
+                yield (f"agent_routing_cache_{key}", "Bộ nhớ đệm định tuyến", {}, cache[key])
+        
+        speculation = self.speculation_stats()
+        for key, value in speculation.items():
+            yield (f"agent_speculation_{key}", "Truy vấn SQL suy đoán", {}, value)
+        
+        for name, stats in self.model_policy.stats().items():
+            component, tier = name.split("/", 1)
+            labels = {"component": component, "tier": tier}
+            yield ("agent_llm_success_rate", "Tỷ lệ thành công gần đây theo thành phần và tầng", labels,
+                   stats["success_rate"])
+            yield ("agent_llm_p95_latency_seconds", "Độ trễ p95 gần đây theo thành phần và tầng", labels,
+                   stats["p95_latency"])
+        
+        pool = self.agents["database_query"].pool_stats()
+        yield ("agent_db_pool_size", "Số kết nối tối đa của pool chỉ đọc", {}, pool["size"])
+        yield ("agent_db_pool_in_use", "Số kết nối đang dùng của pool chỉ đọc", {}, pool["in_use"])
+        yield ("agent_db_pool_utilization", "Tỷ lệ kết nối đang dùng của pool chỉ đọc", {},
+               pool["in_use"] / pool["size"] if pool["size"] else 0.0)
+        
+        if self.cassette:
+            cassette = self.cassette.stats()
+            yield ("agent_cassette_hits", "Số lời gọi được phát lại từ cassette", {}, cassette["hits"])
+            yield ("agent_cassette_misses", "Số lời gọi không có trong cassette", {}, cassette["misses"])
+    
     def _route_question(self, state: AgentState) -> AgentState:
         """
         Định tuyến câu hỏi đến các agent thích hợp.
@@ -118,11 +344,25 @@ class FinancialAgentSystem:
             AgentState: Trạng thái đã cập nhật
         """
         question = state["question"]
-        routing_info = self.router.detailed_routing(question)
         
-        print(f"Thông tin định tuyến: {json.dumps(routing_info, indent=2, ensure_ascii=False)}")
-        
-        state["selected_agents"] = routing_info["selected_agents"]
+        # Đã có agent được chọn trước (chọn thủ công hoặc API đã định tuyến) thì không định tuyến lại
+        if state["status"] == "PROCESSING" and state["selected_agents"]:
+            selected_agents = state["selected_agents"]
+        else:
+            routing_info, speculation_id = self.route(question)
+            print(f"Thông tin định tuyến: {json.dumps(routing_info, indent=2, ensure_ascii=False)}")
+            selected_agents = routing_info["selected_agents"]
+            state["draft_sql"] = routing_info.get("draft_sql")
+            state["speculation_id"] = speculation_id
+        
+        deferred_agents = state.get("deferred_agents") or []
+        if deferred_agents:
+            selected_agents = [name for name in selected_agents if name not in deferred_agents]
+            # Biểu đồ được hoãn: vẫn trả lời bằng dữ liệu dạng văn bản trước
+            if not selected_agents:
+                selected_agents = ["database_query"] if "visualize" in deferred_agents else ["conversation"]
+        
+        state["selected_agents"] = selected_agents
         state["status"] = "PROCESSING"
         return state
     
@@ -166,23 +406,24 @@ class FinancialAgentSystem:
             return state
         
         try:
-            result = self.agents["database_query"].query_with_retry(state["question"])
+            draft_sql = state.get("draft_sql")
+            speculation = None if draft_sql else self._take_speculation(state.get("speculation_id"))
+            if speculation and "results" in speculation:
+                result = speculation
+            else:
+                # Query suy đoán chưa được thực thi thì dùng như query nháp
+                if speculation and "error" not in speculation:
+                    draft_sql = speculation["query"]
+                result = self.agents["database_query"].query_with_retry(
+                    state["question"], draft_query=draft_sql
+                )
             
-            # Tạo nội dung định dạng từ kết quả
-            formatted_content = ""
+            # Tạo nội dung định dạng từ kết quả (bảng lớn được tóm tắt thay vì liệt kê mọi dòng)
             if result and "results" in result and result["results"]:
-                formatted_content = "Kết quả truy vấn cơ sở dữ liệu:\n"
-                formatted_content += f"SQL: {result.get('query', '')}\n\n"
-                
-                # Thêm header của các cột
-                if "columns" in result and result["columns"]:
-                    formatted_content += "| " + " | ".join(result["columns"]) + " |\n"
-                    formatted_content += "| " + " | ".join(["-" * len(col) for col in result["columns"]]) + " |\n"
-                
-                # Thêm dữ liệu hàng
-                for row in result["results"]:
-                    if isinstance(row, dict):
-                        formatted_content += "| " + " | ".join([str(row.get(col, "")) for col in result["columns"]]) + " |\n"
+                formatted_content = "Kết quả truy vấn cơ sở dữ liệu:\n" + summarize_table(
+                    result.get("columns", []), result["results"], DEFAULT_CONTEXT_BUDGET,
+                    query=result.get("query", "")
+                )
             else:
                 formatted_content = "Không tìm thấy dữ liệu phù hợp."
             
@@ -258,7 +499,9 @@ class FinancialAgentSystem:
             return state
         
         try:
-            result = self.agents["visualize"].visualize_query_result(state["question"])
+            result = self.agents["visualize"].visualize_query_result(
+                state["question"], query_result=self._draft_query_result(state)
+            )
             content = f"Biểu đồ đã được tạo và lưu tại: {result['visualization_path']}" if result["success"] else result["message"]
             
             agent_result = {
@@ -277,6 +520,44 @@ class FinancialAgentSystem:
         
         return state
     
+    def _draft_query_result(self, state: AgentState) -> Optional[Dict[str, Any]]:
+        """
+        Lấy kết quả của query nháp (từ planner hoặc truy vấn suy đoán) cho VisualizeAgent.
+        
+        Dùng lại kết quả của database_query nếu agent này đã chạy chính query nháp (hoặc đã
+        dùng truy vấn suy đoán), nếu không thì thực thi query nháp (None nếu không có hoặc
+        không hợp lệ).
+        
+        Args:
+            state (AgentState): Trạng thái hiện tại
+            
+        Returns:
+            Optional[Dict[str, Any]]: Kết quả truy vấn (query, columns, results) hoặc None
+        """
+        database_result = next(
+            (result.get("additional_data", {}) for result in state["agent_results"]
+             if result["agent_name"] == "database_query" and result.get("additional_data", {}).get("success")),
+            None
+        )
+        draft_sql = state.get("draft_sql")
+        if not draft_sql:
+            # Truy vấn suy đoán chỉ lấy được một lần: database_query đã dùng thì dùng lại kết quả của nó
+            if database_result is not None and state.get("speculation_id"):
+                return {"query": database_result["query"], "columns": database_result["columns"],
+                        "results": database_result["results"]}
+            speculation = self._take_speculation(state.get("speculation_id"))
+            if not speculation or "error" in speculation:
+                return None
+            if "results" in speculation:
+                return speculation
+            draft_sql = speculation["query"]
+        
+        if database_result is not None and database_result.get("query") == draft_sql:
+            return {"query": database_result["query"], "columns": database_result["columns"],
+                    "results": database_result["results"]}
+        
+        return self.agents["database_query"].run_draft_query(draft_sql)
+    
     def _synthesize_results(self, state: AgentState) -> AgentState:
         """
         Tổng hợp kết quả từ các agent để tạo câu trả lời cuối cùng.
@@ -292,16 +573,10 @@ class FinancialAgentSystem:
             state["status"] = "COMPLETE"
             return state
         
-        # Tạo context từ kết quả của các agent
-        context = ""
-        for result in state["agent_results"]:
-            context += f"\n--- Kết quả từ {result['agent_name']} ---\n"
-            context += result["content"] + "\n"
-            
-            # Thêm thông tin về biểu đồ nếu có
-            if result["agent_name"] == "visualize" and result["additional_data"]["success"]:
-                chart_info = result["additional_data"]["chart_info"]
-                context += f"\nThông tin biểu đồ: {json.dumps(chart_info, ensure_ascii=False)}\n"
+        # Tạo context từ kết quả của các agent, giới hạn theo ngân sách token của mô hình tổng hợp
+        complex_question = is_complex_question(state["question"])
+        synthesis_model = tier_model_name(TIERS[-1] if complex_question else TIERS[0])
+        context = build_synthesis_context(state["question"], state["agent_results"], synthesis_model)
         
         # Lấy danh sách các agent đã được sử dụng
         used_agents = []
@@ -309,6 +584,18 @@ class FinancialAgentSystem:
             if result["agent_name"] not in used_agents:
                 used_agents.append(result["agent_name"])
         
+        # Thêm thông tin về các agent đã sử dụng vào câu trả lời cuối cùng
+        agent_info = "\n\n---\n*Các agent được sử dụng: " + ", ".join(used_agents) + "*"
+        
+        # Trường hợp đơn giản (một câu trả lời hội thoại, một giá trị, bảng ngắn): không cần gọi LLM
+        if self.synthesis_mode != "llm":
+            answer = template_answer(state["agent_results"])
+            if answer is not None:
+                print("Tổng hợp bằng mẫu, bỏ qua lời gọi LLM")
+                state["final_answer"] = answer + agent_info
+                state["status"] = "COMPLETE"
+                return state
+        
         # Sử dụng LLM để tổng hợp kết quả
         prompt = f"""
         Dựa trên kết quả từ các agent khác nhau, hãy tạo một câu trả lời tổng hợp, logic và dễ hiểu cho câu hỏi sau của người dùng.
@@ -324,12 +611,12 @@ class FinancialAgentSystem:
         Nếu có thông tin mới nhất từ tìm kiếm Google, hãy đề cập đến nguồn.
         """
         
-        response = self.llm.invoke(prompt)
-        
-        # Thêm thông tin về các agent đã sử dụng vào câu trả lời cuối cùng
-        agent_info = "\n\n---\n*Các agent được sử dụng: " + ", ".join(used_agents) + "*"
+        # Tổng hợp bằng mô hình nhỏ, chỉ dùng mô hình lớn cho câu hỏi phức tạp
+        content, _ = self.model_policy.invoke(
+            "synthesis", prompt, complex_question=complex_question
+        )
         
-        state["final_answer"] = response.content + agent_info
+        state["final_answer"] = content + agent_info
         state["status"] = "COMPLETE"
         return state
     
@@ -365,6 +652,15 @@ class FinancialAgentSystem:
         else:
             raise ValueError(f"Invalid state for checking end: {state['status']}")
     
+    @staticmethod
+    def _instrument_node(agent: str, node: Callable[[AgentState], AgentState]) -> Callable[[AgentState], AgentState]:
+        """Bọc một node của đồ thị bằng span node.<agent> và gán usage LLM cho agent đó."""
+        @traced(f"node.{agent}")
+        def run(state: AgentState) -> AgentState:
+            with agent_scope(agent):
+                return node(state)
+        return run
+    
     def _build_graph(self) -> StateGraph:
         """
         Xây dựng đồ thị luồng xử lý LangGraph.
@@ -375,13 +671,14 @@ class FinancialAgentSystem:
         # Khởi tạo đồ thị
         workflow = StateGraph(AgentState)
         
-        # Thêm các node
-        workflow.add_node("router", self._route_question)
-        workflow.add_node("conversation_agent", self._run_conversation_agent)
-        workflow.add_node("database_query_agent", self._run_database_query_agent)
-        workflow.add_node("google_search_agent", self._run_google_search_agent)
-        workflow.add_node("visualize_agent", self._run_visualize_agent)
-        workflow.add_node("synthesizer", self._synthesize_results)
+        # Thêm các node (mỗi lần chạy node được đo bằng một span, lời gọi LLM được tính cho node)
+        workflow.add_node("router", self._instrument_node("router", self._route_question))
+        workflow.add_node("conversation_agent", self._instrument_node("conversation", self._run_conversation_agent))
+        workflow.add_node("database_query_agent",
+                          self._instrument_node("database_query", self._run_database_query_agent))
+        workflow.add_node("google_search_agent", self._instrument_node("google_search", self._run_google_search_agent))
+        workflow.add_node("visualize_agent", self._instrument_node("visualize", self._run_visualize_agent))
+        workflow.add_node("synthesizer", self._instrument_node("synthesizer", self._synthesize_results))
         
         # Thiết lập node bắt đầu là router
         workflow.set_entry_point("router")
@@ -430,7 +727,10 @@ class FinancialAgentSystem:
             "selected_agents": [selected_agent] if selected_agent else [],
             "agent_results": [],
             "final_answer": "",
-            "status": "PROCESSING" if selected_agent else "ROUTING"
+            "status": "PROCESSING" if selected_agent else "ROUTING",
+            "deferred_agents": [],
+            "draft_sql": None,
+            "speculation_id": None
         }
         
         if selected_agent:
@@ -438,38 +738,94 @@ class FinancialAgentSystem:
         
         # Chạy luồng xử lý trong thread riêng để không chặn event loop
         final_state = await run_in_threadpool(self.workflow.invoke, initial_state)
+        self._discard_speculation(final_state.get("speculation_id"))
         
         # Trả về kết quả cuối cùng
         return final_state["final_answer"]
         
-    def process_question(self, question: str, selected_agent: str = None) -> str:
+    def run_workflow(self, question: str, selected_agent: str = None,
+                     deferred_agents: List[str] = None,
+                     selected_agents: List[str] = None,
+                     draft_sql: Optional[str] = None,
+                     speculation_id: Optional[str] = None) -> AgentState:
         """
-        Xử lý câu hỏi của người dùng thông qua luồng đồ thị LangGraph.
+        Chạy luồng đồ thị LangGraph và trả về toàn bộ trạng thái cuối cùng.
         
         Args:
             question (str): Câu hỏi từ người dùng
             selected_agent (str, optional): Tên agent cụ thể muốn sử dụng. Nếu None, hệ thống sẽ tự động định tuyến.
+            deferred_agents (List[str], optional): Các agent được hoãn để chạy nền (ví dụ "visualize")
+            selected_agents (List[str], optional): Kết quả định tuyến đã có (tránh định tuyến lại trong đồ thị)
+            draft_sql (str, optional): Query nháp do planner sinh ra cùng với kết quả định tuyến
+            speculation_id (str, optional): Mã truy vấn suy đoán trả về từ route()
             
         Returns:
-            str: Câu trả lời cuối cùng
+            AgentState: Trạng thái cuối cùng (bao gồm agent_results và final_answer)
         """
+        if selected_agent:
+            selected_agents = [selected_agent]
+        
         # Khởi tạo trạng thái ban đầu
         initial_state: AgentState = {
             "question": question,
-            "selected_agents": [selected_agent] if selected_agent else [],
+            "selected_agents": list(selected_agents) if selected_agents else [],
             "agent_results": [],
             "final_answer": "",
-            "status": "PROCESSING" if selected_agent else "ROUTING"
+            "status": "PROCESSING" if selected_agents else "ROUTING",
+            "deferred_agents": deferred_agents or [],
+            "draft_sql": draft_sql,
+            "speculation_id": speculation_id
         }
         
         if selected_agent:
             print(f"Chạy agent {selected_agent} theo yêu cầu thủ công")
         
         # Chạy luồng xử lý
-        final_state = self.workflow.invoke(initial_state)
+        final_state = None
+        try:
+            with trace("workflow", question=question), track_usage() as usage:
+                final_state = self.workflow.invoke(initial_state)
+                # Token, thời gian chờ LLM và chi phí của yêu cầu theo agent
+                final_state["usage"] = usage.summary()
+        finally:
+            # Hủy truy vấn suy đoán không được agent nào dùng đến
+            self._discard_speculation(speculation_id)
+            if final_state:
+                self._discard_speculation(final_state.get("speculation_id"))
+        return final_state
+    
+    def process_question(self, question: str, selected_agent: str = None) -> str:
+        """
+        Xử lý câu hỏi của người dùng thông qua luồng đồ thị LangGraph.
+        
+        Args:
+            question (str): Câu hỏi từ người dùng
+            selected_agent (str, optional): Tên agent cụ thể muốn sử dụng. Nếu None, hệ thống sẽ tự động định tuyến.
+            
+        Returns:
+            str: Câu trả lời cuối cùng
+        """
+        final_state = self.run_workflow(question, selected_agent)
         
         # Trả về kết quả cuối cùng
         return final_state["final_answer"]
+    
+    def render_visualization(self, question: str, query_result: Dict[str, Any] = None,
+                             request_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Tạo biểu đồ cho câu hỏi (dùng cho chế độ chạy nền).
+        
+        Args:
+            question (str): Câu hỏi từ người dùng
+            query_result (Dict[str, Any], optional): Kết quả truy vấn đã có từ database_query
+                (gồm query, columns, results) để không phải sinh lại SQL
+            request_id (str, optional): Request id của yêu cầu đã tạo tác vụ (để ghép trace)
+            
+        Returns:
+            Dict[str, Any]: Kết quả từ VisualizeAgent.visualize_query_result
+        """
+        with trace("render_visualization", request_id=request_id, question=question), agent_scope("visualize"):
+            return self.agents["visualize"].visualize_query_result(question, query_result=query_result)
 
 def main(test_mode=True):
     """
@@ -506,6 +862,8 @@ def main(test_mode=True):
             print(f"\nTrả lời: {answer}")
         except Exception as e:
             print(f"\nLỗi: {str(e)}")
+        if agent_system.cassette:
+            print(f"Cassette: {agent_system.cassette.stats()}")
     else:
         # Chế độ tương tác
         print("Nhập 'exit' để thoát.")
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+# Số pixel ngang trên mỗi inch dùng để quy đổi kích thước figure sang số điểm tối đa
+DEFAULT_PX_PER_INCH = 100
+
+
+def target_points_for_width(fig_width_in: float, px_per_inch: int = DEFAULT_PX_PER_INCH) -> int:
+    """
+    Tính số điểm tối đa cần vẽ dựa trên chiều rộng figure.
+
+    Args:
+        fig_width_in (float): Chiều rộng figure (inch)
+        px_per_inch (int): Số pixel trên mỗi inch
+    Returns:
+        int: Số điểm tối đa (một điểm cho mỗi pixel ngang)
+    """
+    return max(int(fig_width_in * px_per_inch), 3)
+
+
+def _as_numeric(values) -> np.ndarray:
+    """Chuyển cột trục x (số hoặc datetime) thành mảng float để tính toán."""
+    series = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_datetime64_any_dtype(series):
+        # psycopg2 trả về cột DATE dưới dạng object (datetime.date)
+        series = pd.to_datetime(series, errors="coerce")
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(float)
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Chọn chỉ số các điểm theo thuật toán Largest-Triangle-Three-Buckets.
+
+    Dữ liệu phải được sắp xếp theo x. Số vòng lặp Python chỉ phụ thuộc vào
+    n_out, còn phép tính trong mỗi bucket được vector hóa bằng NumPy.
+
+    Args:
+        x (np.ndarray): Giá trị trục x (đã sắp xếp)
+        y (np.ndarray): Giá trị trục y
+        n_out (int): Số điểm đầu ra mong muốn
+    Returns:
+        np.ndarray: Mảng chỉ số các điểm được giữ lại
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Biên của n_out - 2 bucket ở giữa (điểm đầu và cuối luôn được giữ)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    mean_x = sums_x / counts
+    mean_y = sums_y / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Điểm neo bên phải là trung bình bucket kế tiếp (hoặc điểm cuối)
+        if i + 1 < n_out - 2:
+            next_x, next_y = mean_x[i + 1], mean_y[i + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        bx = x[start:stop]
+        by = y[start:stop]
+        areas = np.abs(
+            (x[prev] - next_x) * (by - y[prev]) - (x[prev] - bx) * (next_y - y[prev])
+        )
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+    return selected
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    Chọn điểm nhỏ nhất và lớn nhất trong mỗi bucket pixel theo trục x.
+
+    Toàn bộ thao tác được vector hóa (không có vòng lặp Python).
+
+    Args:
+        x (np.ndarray): Giá trị trục x
+        y (np.ndarray): Giá trị trục y
+        n_buckets (int): Số bucket (thường bằng số pixel ngang)
+    Returns:
+        np.ndarray: Mảng chỉ số các điểm được giữ lại (đã sắp xếp)
+    """
+    n = len(x)
+    if n <= 2 * n_buckets or n_buckets < 1:
+        return np.arange(n)
+
+    x_min, x_max = np.nanmin(x), np.nanmax(x)
+    span = x_max - x_min
+    if not np.isfinite(span) or span == 0:
+        buckets = (np.arange(n) * n_buckets) // n
+    else:
+        buckets = np.minimum(((x - x_min) / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+    # Sắp xếp theo (bucket, y): phần tử đầu/cuối của mỗi nhóm là min/max
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    keep = np.unique(np.concatenate([order[starts], order[ends], [0, n - 1]]))
+    return keep
+
+
+def downsample_frame(df: pd.DataFrame, x_column: str, y_columns: List[str],
+                     max_points: int, group_column: Optional[str] = None,
+                     method: str = "lttb") -> pd.DataFrame:
+    """
+    Giảm số điểm của DataFrame trước khi vẽ biểu đồ line/scatter.
+
+    Mỗi nhóm (ví dụ mỗi mã cổ phiếu) và mỗi cột y được giảm mẫu độc lập,
+    sau đó hợp các chỉ số lại để giữ nguyên hình dạng của từng đường.
+
+    Args:
+        df (pd.DataFrame): DataFrame gốc
+        x_column (str): Cột trục x (số hoặc thời gian)
+        y_columns (List[str]): Các cột trục y
+        max_points (int): Số điểm tối đa cho mỗi nhóm
+        group_column (Optional[str]): Cột phân nhóm (ví dụ symbol)
+        method (str): "lttb" hoặc "minmax"
+    Returns:
+        pd.DataFrame: DataFrame đã được giảm mẫu
+    """
+    if df.empty or x_column not in df.columns:
+        return df
+
+    if group_column and group_column in df.columns:
+        groups = df.groupby(group_column, sort=False).indices.values()
+    else:
+        groups = [np.arange(len(df))]
+
+    if all(len(idx) <= max_points for idx in groups):
+        return df
+
+    x_all = _as_numeric(df[x_column])
+    y_all = {col: pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+             for col in y_columns if col in df.columns}
+
+    kept = []
+    for idx in groups:
+        idx = np.asarray(idx)
+        if len(idx) <= max_points:
+            kept.append(idx)
+            continue
+        idx = idx[np.argsort(x_all[idx], kind="stable")]
+        x = x_all[idx]
+        for y_full in y_all.values():
+            y = np.nan_to_num(y_full[idx])
+            if method == "minmax":
+                local = minmax_indices(x, y, max(max_points // 2, 1))
+            else:
+                local = lttb_indices(x, y, max_points)
+            kept.append(idx[local])
+
+    keep = np.unique(np.concatenate(kept)) if kept else np.arange(len(df))
+    return df.iloc[keep]
@@ -0,0 +1,204 @@
+import re
+import datetime
+import pandas as pd
+from typing import Dict, List, Any, Optional
+
+# Từ khóa để nhận biết loại biểu đồ người dùng yêu cầu (so khớp theo ranh giới từ)
+CHART_KEYWORDS = {
+    "pie": ["pie chart", "pie", "biểu đồ tròn", "proportion", "proportions", "share of", "tỷ trọng"],
+    "line": ["line chart", "line graph", "time series", "trend", "biểu đồ đường", "xu hướng"],
+    "bar": ["bar chart", "bar graph", "bar", "biểu đồ cột", "column chart"],
+    "scatter": ["scatter plot", "scatter", "biểu đồ phân tán", "versus", "vs"],
+    "heatmap": ["heatmap", "heat map", "correlation matrix", "bản đồ nhiệt"],
+    "boxplot": ["boxplot", "box plot", "box-plot", "biểu đồ hộp"],
+    "histogram": ["histogram", "distribution", "phân phối"],
+}
+
+# Từ khóa mạnh (chỉ định trực tiếp loại biểu đồ) so với từ khóa gợi ý
+EXPLICIT_KEYWORDS = {
+    "pie chart", "pie", "biểu đồ tròn", "line chart", "line graph", "biểu đồ đường",
+    "bar chart", "bar graph", "biểu đồ cột", "column chart", "scatter plot", "scatter",
+    "biểu đồ phân tán", "heatmap", "heat map", "bản đồ nhiệt", "boxplot", "box plot",
+    "box-plot", "biểu đồ hộp", "histogram",
+}
+
+_KEYWORD_PATTERNS = {
+    chart_type: [(kw, re.compile(rf"(?<!\w){re.escape(kw)}(?!\w)")) for kw in keywords]
+    for chart_type, keywords in CHART_KEYWORDS.items()
+}
+
+# Số danh mục tối đa để một biểu đồ tròn còn dễ đọc
+MAX_PIE_CATEGORIES = 12
+
+
+def match_chart_keyword(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Tìm loại biểu đồ được nhắc đến trong câu hỏi.
+
+    Args:
+        question (str): Câu hỏi người dùng
+    Returns:
+        Optional[Dict[str, Any]]: {"chart_type", "keyword", "explicit"} hoặc None
+    """
+    text = question.lower()
+    best = None
+    for chart_type, patterns in _KEYWORD_PATTERNS.items():
+        for keyword, pattern in patterns:
+            if pattern.search(text):
+                explicit = keyword in EXPLICIT_KEYWORDS
+                if best is None or (explicit and not best["explicit"]):
+                    best = {"chart_type": chart_type, "keyword": keyword, "explicit": explicit}
+                break
+    return best
+
+
+def _is_temporal(series: pd.Series, name: str) -> bool:
+    """Kiểm tra một cột có phải dữ liệu thời gian (datetime, date hoặc chuỗi ngày/tháng)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    if pd.api.types.is_numeric_dtype(series):
+        return False
+    sample = series.dropna().head(20)
+    if sample.empty:
+        return False
+    if all(isinstance(v, (datetime.date, datetime.datetime)) for v in sample):
+        return True
+    if any(token in name.lower() for token in ("date", "month", "week", "day", "year", "time")):
+        parsed = pd.to_datetime(sample.astype(str), errors="coerce", format="mixed")
+        return parsed.notna().mean() >= 0.9
+    return False
+
+
+def describe_columns(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Phân loại các cột theo kiểu dữ liệu: thời gian, số và phân loại.
+
+    Args:
+        df (pd.DataFrame): DataFrame kết quả truy vấn
+    Returns:
+        Dict[str, List[str]]: {"temporal": [...], "numeric": [...], "categorical": [...]}
+    """
+    kinds = {"temporal": [], "numeric": [], "categorical": []}
+    for col in df.columns:
+        series = df[col]
+        if _is_temporal(series, str(col)):
+            kinds["temporal"].append(col)
+            continue
+        numeric = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors="coerce")
+        if series.notna().any() and numeric.notna().sum() >= 0.9 * series.notna().sum():
+            # Các cột id thường không có ý nghĩa khi vẽ
+            if str(col).lower() == "id":
+                continue
+            kinds["numeric"].append(col)
+        else:
+            kinds["categorical"].append(col)
+    return kinds
+
+
+def _spec(chart_type: str, x_column: str, y_columns: List[str], question: str,
+          confidence: float, explanation: str) -> Dict[str, Any]:
+    title = question.strip().rstrip("?.")
+    if len(title) > 80:
+        title = title[:77] + "..."
+    return {
+        "chart_type": chart_type,
+        "x_column": x_column,
+        "y_column": ", ".join(y_columns),
+        "title": title or f"Biểu đồ {chart_type}",
+        "explanation": explanation,
+        "confidence": round(min(confidence, 1.0), 2),
+        "source": "rules",
+    }
+
+
+def infer_chart_spec(question: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Suy luận cấu hình biểu đồ từ câu hỏi và hình dạng dữ liệu mà không cần gọi LLM.
+
+    Kết hợp từ khóa trong câu hỏi, kiểu dữ liệu và số lượng giá trị phân biệt
+    của các cột để chọn loại biểu đồ, trục x/y và độ tin cậy của đề xuất.
+
+    Args:
+        question (str): Câu hỏi người dùng
+        df (pd.DataFrame): Kết quả truy vấn
+    Returns:
+        Dict[str, Any]: Cấu hình biểu đồ (cùng định dạng với đề xuất từ LLM) kèm "confidence"
+    """
+    columns = [str(c) for c in df.columns]
+    if df.empty or not columns:
+        return _spec("bar", columns[0] if columns else "", columns[1:2], question, 0.0,
+                     "Không có dữ liệu để suy luận")
+
+    kinds = describe_columns(df)
+    temporal, numeric, categorical = kinds["temporal"], kinds["numeric"], kinds["categorical"]
+    n_rows = len(df)
+    keyword = match_chart_keyword(question)
+    requested = keyword["chart_type"] if keyword else None
+    # Độ tin cậy cộng thêm khi người dùng chỉ định loại biểu đồ
+    boost = 0.0
+    if keyword:
+        boost = 0.25 if keyword["explicit"] else 0.1
+
+    def cardinality(col):
+        return df[col].nunique(dropna=True)
+
+    label_col = next((c for c in categorical if cardinality(c) == n_rows), categorical[0] if categorical else None)
+
+    if requested == "histogram" and numeric:
+        return _spec("histogram", numeric[0], numeric[:1], question, 0.6 + boost,
+                     "Histogram thể hiện phân phối của một biến số")
+
+    if requested == "pie" and numeric:
+        x_col = label_col or (temporal[0] if temporal else columns[0])
+        confidence = 0.6 + boost if cardinality(x_col) <= MAX_PIE_CATEGORIES * 3 else 0.4
+        return _spec("pie", x_col, numeric[:1], question, confidence,
+                     "Biểu đồ tròn thể hiện tỷ trọng của từng thành phần")
+
+    if requested == "scatter" and len(numeric) >= 2:
+        return _spec("scatter", numeric[0], numeric[1:2], question, 0.6 + boost,
+                     "Biểu đồ phân tán thể hiện quan hệ giữa hai biến số")
+
+    if requested == "heatmap" and len(categorical) + len(temporal) >= 2 and numeric:
+        dims = (categorical + temporal)[:2]
+        return _spec("heatmap", dims[0], [dims[1], numeric[0]], question, 0.6 + boost,
+                     "Heatmap thể hiện giá trị theo hai chiều phân loại")
+
+    if requested == "boxplot" and numeric:
+        x_col = (temporal + categorical)[0] if temporal or categorical else numeric[0]
+        return _spec("boxplot", x_col, numeric[:1], question, 0.55 + boost,
+                     "Boxplot thể hiện phân phối giá trị theo từng nhóm")
+
+    if temporal and numeric:
+        # Một cột thời gian và các cột số: chuỗi thời gian
+        x_col = temporal[0]
+        confidence = 0.85 if requested in (None, "line") else 0.5
+        if requested == "bar":
+            return _spec("bar", x_col, numeric, question, 0.6 + boost,
+                         "Biểu đồ cột so sánh giá trị theo từng mốc thời gian")
+        return _spec("line", x_col, numeric, question, confidence + boost,
+                     "Dữ liệu gồm cột thời gian và cột số, phù hợp với biểu đồ đường")
+
+    if categorical and numeric:
+        x_col = label_col
+        if requested == "line":
+            return _spec("line", x_col, numeric, question, 0.5 + boost,
+                         "Biểu đồ đường theo yêu cầu của người dùng")
+        if len(numeric) >= 2 and requested is None and cardinality(x_col) > 10:
+            return _spec("scatter", numeric[0], numeric[1:2], question, 0.55,
+                         "Nhiều đối tượng với hai chỉ số, phù hợp với biểu đồ phân tán")
+        confidence = 0.8 if cardinality(x_col) <= 40 else 0.55
+        if requested not in (None, "bar"):
+            confidence = 0.45
+        return _spec("bar", x_col, numeric, question, confidence + boost,
+                     "Biểu đồ cột so sánh giá trị giữa các danh mục")
+
+    if len(numeric) >= 2:
+        return _spec("scatter", numeric[0], numeric[1:2], question, 0.5 + boost,
+                     "Hai biến số, phù hợp với biểu đồ phân tán")
+
+    if len(numeric) == 1 and n_rows > 1:
+        return _spec("histogram", numeric[0], numeric, question, 0.5 + boost,
+                     "Một biến số với nhiều giá trị, phù hợp với histogram")
+
+    return _spec(requested or "bar", columns[0], columns[1:2] or columns[:1], question, 0.2,
+                 "Không xác định rõ được cấu trúc dữ liệu")
@@ -0,0 +1,159 @@
+import time
+import numpy as np
+from typing import List, Sequence
+
+# Hướng dịch chuyển nhãn ứng viên (theo đơn vị chiều rộng/chiều cao nhãn), ưu tiên từ trên xuống dưới
+_CANDIDATE_OFFSETS = np.array([
+    (0.0, 0.6),    # phía trên
+    (0.6, 0.6),    # trên - phải
+    (-0.6, 0.6),   # trên - trái
+    (0.75, 0.0),   # bên phải
+    (-0.75, 0.0),  # bên trái
+    (0.0, -0.6),   # phía dưới
+    (0.6, -0.6),   # dưới - phải
+    (-0.6, -0.6),  # dưới - trái
+])
+
+
+def _overlap_counts(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    Đếm số hộp trong `others` chồng lên từng hộp trong `boxes`.
+
+    Args:
+        boxes (np.ndarray): Mảng (K, 4) gồm x0, y0, x1, y1
+        others (np.ndarray): Mảng (M, 4) gồm x0, y0, x1, y1
+    Returns:
+        np.ndarray: Mảng (K,) số lần chồng lấn
+    """
+    if len(others) == 0:
+        return np.zeros(len(boxes), dtype=np.int64)
+    overlap = (
+        (boxes[:, None, 0] < others[None, :, 2]) & (boxes[:, None, 2] > others[None, :, 0]) &
+        (boxes[:, None, 1] < others[None, :, 3]) & (boxes[:, None, 3] > others[None, :, 1])
+    )
+    return overlap.sum(axis=1)
+
+
+class _GridIndex:
+    """Chỉ mục lưới đơn giản để chỉ so sánh nhãn với các hộp ở ô lân cận."""
+
+    def __init__(self, cell_w: float, cell_h: float, capacity: int):
+        self.cell_w = max(cell_w, 1.0)
+        self.cell_h = max(cell_h, 1.0)
+        self.boxes = np.empty((capacity, 4), dtype=float)
+        self.size = 0
+        self.cells = {}
+
+    def _cells_for(self, box: np.ndarray):
+        cx0, cx1 = int(box[0] // self.cell_w), int(box[2] // self.cell_w)
+        cy0, cy1 = int(box[1] // self.cell_h), int(box[3] // self.cell_h)
+        return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+
+    def add(self, box: np.ndarray):
+        if self.size == len(self.boxes):
+            self.boxes = np.vstack([self.boxes, np.empty_like(self.boxes)])
+        self.boxes[self.size] = box
+        for cell in self._cells_for(box):
+            self.cells.setdefault(cell, []).append(self.size)
+        self.size += 1
+
+    def neighbours(self, boxes: np.ndarray) -> np.ndarray:
+        """Trả về các hộp đã đặt nằm trong ô lưới giao với bao của `boxes`."""
+        if self.size == 0:
+            return self.boxes[:0]
+        envelope = np.array([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+        idx = set()
+        for cell in self._cells_for(envelope):
+            idx.update(self.cells.get(cell, ()))
+        if not idx:
+            return self.boxes[:0]
+        return self.boxes[np.fromiter(idx, dtype=np.int64)]
+
+
+def place_labels(ax, x: Sequence[float], y: Sequence[float], labels: Sequence[str],
+                 fontsize: int = 10, time_budget: float = 0.2, max_rounds: int = 3,
+                 **text_kwargs) -> List:
+    """
+    Đặt nhãn cho các điểm scatter, tránh chồng chéo với nhãn khác và với các điểm dữ liệu.
+
+    Thay thế adjustText: mỗi nhãn chỉ thử một số vị trí ứng viên cố định, việc
+    kiểm tra va chạm được vector hóa bằng NumPy trên các ô lưới lân cận, và toàn
+    bộ quá trình dừng khi hết thời gian cho phép (nhãn còn lại dùng vị trí mặc định).
+
+    Args:
+        ax: Trục matplotlib đã thiết lập giới hạn x/y
+        x (Sequence[float]): Tọa độ x của các điểm
+        y (Sequence[float]): Tọa độ y của các điểm
+        labels (Sequence[str]): Nhãn tương ứng
+        fontsize (int): Cỡ chữ của nhãn
+        time_budget (float): Thời gian tối đa (giây) dành cho việc tìm vị trí
+        max_rounds (int): Số vòng nới rộng khoảng cách khi mọi vị trí đều bị chồng lấn
+        **text_kwargs: Tham số bổ sung cho ax.annotate
+    Returns:
+        List: Danh sách các đối tượng Annotation đã tạo
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    labels = [str(label) for label in labels]
+    n = len(labels)
+    if n == 0:
+        return []
+
+    fig = ax.figure
+    px_per_pt = fig.dpi / 72.0
+    points = ax.transData.transform(np.column_stack([x, y]))
+
+    # Ước lượng kích thước nhãn (pixel) mà không cần render chữ
+    widths = np.array([len(label) for label in labels], dtype=float) * fontsize * 0.62 * px_per_pt + 4
+    height = fontsize * 1.25 * px_per_pt
+    marker_half = 5 * px_per_pt
+
+    grid = _GridIndex(widths.max(), height, capacity=2 * n)
+    # Các điểm dữ liệu cũng được coi là vật cản
+    for px, py in points:
+        grid.add(np.array([px - marker_half, py - marker_half, px + marker_half, py + marker_half]))
+
+    # Đặt nhãn ở vùng dày đặc trước để chúng có nhiều lựa chọn hơn
+    cells = (points // np.array([widths.max(), height])).astype(np.int64)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    order = np.argsort(-counts[inverse.ravel()], kind="stable")
+
+    offsets = np.zeros((n, 2))
+    deadline = time.perf_counter() + time_budget
+    for i in order:
+        w = widths[i]
+        default = np.array([0.0, 0.6 * height + marker_half])
+        if time.perf_counter() > deadline:
+            offsets[i] = default
+            continue
+        best_offset, best_score = default, None
+        for round_idx in range(max_rounds):
+            scale = 1.0 + round_idx
+            deltas = _CANDIDATE_OFFSETS * np.array([w, height]) * scale
+            deltas[:, 1] += np.sign(deltas[:, 1]) * marker_half
+            centers = points[i] + deltas
+            boxes = np.column_stack([
+                centers[:, 0] - w / 2, centers[:, 1] - height / 2,
+                centers[:, 0] + w / 2, centers[:, 1] + height / 2,
+            ])
+            counts = _overlap_counts(boxes, grid.neighbours(boxes))
+            k = int(np.argmin(counts))
+            if best_score is None or counts[k] < best_score:
+                best_offset, best_score = deltas[k], counts[k]
+            if counts[k] == 0 or time.perf_counter() > deadline:
+                break
+        offsets[i] = best_offset
+        center = points[i] + best_offset
+        grid.add(np.array([center[0] - w / 2, center[1] - height / 2, center[0] + w / 2, center[1] + height / 2]))
+
+    texts = []
+    for i in range(n):
+        dx, dy = offsets[i] / px_per_pt
+        far = np.hypot(dx, dy) > 2.5 * fontsize
+        texts.append(ax.annotate(
+            labels[i], (x[i], y[i]), xytext=(dx, dy), textcoords="offset points",
+            ha="center", va="center", fontsize=fontsize,
+            arrowprops=dict(arrowstyle="-", color="gray", alpha=0.5, lw=0.8) if far else None,
+            **text_kwargs,
+        ))
+    return texts
@@ -0,0 +1,241 @@
+import decimal
+import datetime
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+
+
+def _is_object_like(series: pd.Series) -> bool:
+    """Cột kiểu object hoặc chuỗi (pandas mới dùng kiểu str riêng cho chuỗi)."""
+    return series.dtype == object or pd.api.types.is_string_dtype(series)
+
+
+def _first_valid(series: pd.Series):
+    """Lấy giá trị khác null đầu tiên của một cột (None nếu cột rỗng)."""
+    idx = series.first_valid_index()
+    return None if idx is None else series.loc[idx]
+
+
+def is_array_column(series: pd.Series) -> bool:
+    """
+    Kiểm tra cột có chứa mảng (list từ psycopg2 hoặc chuỗi mảng PostgreSQL "{1,2}") không.
+
+    Args:
+        series (pd.Series): Cột cần kiểm tra
+    Returns:
+        bool: True nếu giá trị đầu tiên là mảng
+    """
+    if not _is_object_like(series):
+        return False
+    value = _first_valid(series)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return True
+    return isinstance(value, str) and value.startswith("{") and value.endswith("}")
+
+
+def parse_pg_array(series: pd.Series) -> pd.Series:
+    """
+    Chuyển cột mảng PostgreSQL thành cột list.
+
+    Giá trị dạng list được giữ nguyên; chuỗi "{89.9,92.64}" được tách bằng
+    các phép toán chuỗi vector hóa của pandas.
+
+    Args:
+        series (pd.Series): Cột chứa list hoặc chuỗi mảng
+    Returns:
+        pd.Series: Cột chứa list
+    """
+    is_str = series.map(type).eq(str)
+    if not is_str.any():
+        return series
+    split = (
+        series[is_str].astype(str).str.strip().str.strip("{}").str.replace('"', "", regex=False).str.split(",")
+    )
+    return series.astype(object).where(~is_str, split.reindex(series.index))
+
+
+def coerce_numeric(series: pd.Series, strip: Sequence[str] = ("%", "$", ",")) -> pd.Series:
+    """
+    Chuyển một cột sang số (Decimal, chuỗi có ký tự %, $, dấu phẩy...).
+
+    Args:
+        series (pd.Series): Cột cần chuyển
+        strip (Sequence[str]): Các ký tự bị loại bỏ trước khi chuyển đổi
+    Returns:
+        pd.Series: Cột kiểu float (giá trị không hợp lệ thành NaN)
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    converted = pd.to_numeric(series, errors="coerce")
+    needs_text = converted.isna() & series.notna()
+    if needs_text.any():
+        text = series[needs_text].astype(str).str.strip()
+        for token in strip:
+            text = text.str.replace(token, "", regex=False)
+        converted[needs_text] = pd.to_numeric(text, errors="coerce")
+    return converted.astype(float)
+
+
+def explode_array_column(df: pd.DataFrame, column: str, value_name: Optional[str] = None) -> pd.DataFrame:
+    """
+    Trải phẳng cột mảng (ví dụ kết quả ARRAY_AGG) thành nhiều hàng, mỗi hàng một giá trị số.
+
+    Args:
+        df (pd.DataFrame): DataFrame gốc
+        column (str): Tên cột mảng
+        value_name (Optional[str]): Tên cột giá trị sau khi trải phẳng (mặc định giữ tên cũ)
+    Returns:
+        pd.DataFrame: DataFrame dạng dài với cột giá trị kiểu float
+    """
+    value_name = value_name or column
+    exploded = df.assign(**{column: parse_pg_array(df[column])}).explode(column, ignore_index=True)
+    exploded[column] = coerce_numeric(exploded[column])
+    exploded = exploded.dropna(subset=[column])
+    if value_name != column:
+        exploded = exploded.rename(columns={column: value_name})
+    return exploded
+
+
+def to_datetime_column(series: pd.Series) -> pd.Series:
+    """Chuyển cột ngày (datetime.date, chuỗi...) sang datetime64."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, errors="coerce")
+
+
+def bucket_dates(df: pd.DataFrame, column: str, freq: str = "month",
+                 out_column: Optional[str] = None) -> pd.DataFrame:
+    """
+    Gom cột ngày theo tháng hoặc tuần thành nhãn chuỗi (ví dụ "2024-03").
+
+    Args:
+        df (pd.DataFrame): DataFrame gốc
+        column (str): Cột ngày
+        freq (str): "month" hoặc "week"
+        out_column (Optional[str]): Tên cột kết quả (mặc định là "month"/"week")
+    Returns:
+        pd.DataFrame: DataFrame có thêm cột nhãn thời gian
+    """
+    out_column = out_column or freq
+    dates = to_datetime_column(df[column])
+    if freq == "week":
+        labels = dates.dt.to_period("W-SUN").dt.start_time.dt.strftime("%Y-%m-%d")
+    else:
+        labels = dates.dt.strftime("%Y-%m")
+    return df.assign(**{out_column: labels})
+
+
+def to_long(df: pd.DataFrame, id_vars: List[str], value_vars: List[str],
+            var_name: str = "variable", value_name: str = "value") -> pd.DataFrame:
+    """
+    Chuyển DataFrame dạng rộng sang dạng dài, ép cột giá trị sang số.
+
+    Args:
+        df (pd.DataFrame): DataFrame dạng rộng
+        id_vars (List[str]): Các cột định danh
+        value_vars (List[str]): Các cột giá trị
+        var_name (str): Tên cột biến
+        value_name (str): Tên cột giá trị
+    Returns:
+        pd.DataFrame: DataFrame dạng dài (đã bỏ giá trị không hợp lệ)
+    """
+    long_df = df.melt(id_vars=id_vars, value_vars=value_vars, var_name=var_name, value_name=value_name)
+    long_df[value_name] = coerce_numeric(long_df[value_name])
+    return long_df.dropna(subset=[value_name])
+
+
+def to_wide(df: pd.DataFrame, index: str, columns: str, values: str,
+            aggfunc: str = "mean") -> pd.DataFrame:
+    """
+    Chuyển DataFrame dạng dài sang dạng rộng (pivot), gộp các giá trị trùng.
+
+    Args:
+        df (pd.DataFrame): DataFrame dạng dài
+        index (str): Cột dùng làm chỉ mục hàng
+        columns (str): Cột dùng làm tên cột
+        values (str): Cột giá trị
+        aggfunc (str): Hàm gộp khi có nhiều giá trị
+    Returns:
+        pd.DataFrame: DataFrame dạng rộng
+    """
+    data = df.assign(**{values: coerce_numeric(df[values])})
+    return pd.pivot_table(data, index=index, columns=columns, values=values, aggfunc=aggfunc)
+
+
+def coerce_dtypes(df: pd.DataFrame, parse_dates: bool = False) -> pd.DataFrame:
+    """
+    Chuẩn hóa kiểu dữ liệu theo từng cột (không lặp theo từng hàng).
+
+    - Cột Decimal/chuỗi số được chuyển sang float khi mọi giá trị đều chuyển được
+    - Cột datetime.date được chuyển sang datetime64 nếu parse_dates=True
+
+    Args:
+        df (pd.DataFrame): DataFrame gốc
+        parse_dates (bool): Có chuyển cột ngày sang datetime64 hay không
+    Returns:
+        pd.DataFrame: DataFrame đã chuẩn hóa kiểu dữ liệu
+    """
+    converted: Dict[str, pd.Series] = {}
+    for col in df.columns:
+        series = df[col]
+        if not _is_object_like(series):
+            continue
+        value = _first_valid(series)
+        if value is None or isinstance(value, (list, tuple, np.ndarray)):
+            continue
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            if parse_dates:
+                converted[col] = to_datetime_column(series)
+            continue
+        if isinstance(value, (decimal.Decimal, int, float, np.number)) or isinstance(value, str):
+            numeric = pd.to_numeric(series, errors="coerce")
+            if numeric.notna().sum() == series.notna().sum():
+                converted[col] = numeric.astype(float)
+    return df.assign(**converted) if converted else df
+
+
+def fill_nulls(df: pd.DataFrame, numeric_strategy: str = "mean", fill_value: str = "N/A") -> pd.DataFrame:
+    """
+    Xử lý giá trị null: cột số dùng giá trị trung bình (hoặc 0), cột khác dùng fill_value.
+
+    Args:
+        df (pd.DataFrame): DataFrame gốc
+        numeric_strategy (str): "mean" hoặc "zero"
+        fill_value (str): Giá trị thay thế cho cột không phải số
+    Returns:
+        pd.DataFrame: DataFrame không còn null (trừ cột mảng và cột thời gian)
+    """
+    null_cols = df.columns[df.isna().any().to_numpy()]
+    if len(null_cols) == 0:
+        return df
+    numeric_cols = [c for c in null_cols if pd.api.types.is_numeric_dtype(df[c])]
+    other_cols = [c for c in null_cols if c not in numeric_cols
+                  and not pd.api.types.is_datetime64_any_dtype(df[c]) and not is_array_column(df[c])]
+    values = {}
+    if numeric_cols:
+        fills = df[numeric_cols].mean() if numeric_strategy == "mean" else pd.Series(0.0, index=numeric_cols)
+        values.update(fills.fillna(0.0).to_dict())
+    values.update({c: fill_value for c in other_cols})
+    print(f"Phát hiện giá trị null trong các cột {list(null_cols)}, đang xử lý...")
+    return df.fillna(value=values)
+
+
+def shape_frame(df: pd.DataFrame, parse_dates: bool = False, explode_arrays: bool = True) -> pd.DataFrame:
+    """
+    Chuỗi chuẩn hóa dữ liệu dùng chung cho mọi loại biểu đồ.
+
+    Trình tự: chuẩn hóa kiểu dữ liệu -> trải phẳng cột mảng -> xử lý null.
+
+    Args:
+        df (pd.DataFrame): Kết quả truy vấn dưới dạng DataFrame
+        parse_dates (bool): Chuyển cột ngày sang datetime64 (hữu ích cho biểu đồ đường)
+        explode_arrays (bool): Trải phẳng các cột mảng (ARRAY_AGG) thành nhiều hàng
+    Returns:
+        pd.DataFrame: DataFrame sẵn sàng để vẽ
+    """
+    shaped = coerce_dtypes(df, parse_dates=parse_dates)
+    if explode_arrays:
+        for col in [c for c in shaped.columns if is_array_column(shaped[c])]:
+            print(f"Trải phẳng cột mảng {col}")
+            shaped = explode_array_column(shaped, col)
+    return fill_nulls(shaped)
@@ -0,0 +1,258 @@
+import re
+import time
+import threading
+import psycopg2
+from typing import Any, Dict, List, Optional
+
+from src.utils.tracing import span
+
+# Tên gọi và bí danh của 30 công ty DJIA (không phân biệt hoa thường)
+COMPANY_ALIASES: Dict[str, List[str]] = {
+    "AAPL": ["Apple"],
+    "AMGN": ["Amgen"],
+    "AXP": ["American Express", "Amex"],
+    "BA": ["Boeing"],
+    "CAT": ["Caterpillar"],
+    "CRM": ["Salesforce"],
+    "CSCO": ["Cisco"],
+    "CVX": ["Chevron"],
+    "DIS": ["Disney", "Walt Disney"],
+    "DOW": ["Dow Inc", "Dow Chemical"],
+    "GS": ["Goldman Sachs", "Goldman"],
+    "HD": ["Home Depot"],
+    "HON": ["Honeywell"],
+    "IBM": ["IBM", "International Business Machines"],
+    "INTC": ["Intel"],
+    "JNJ": ["Johnson & Johnson", "Johnson and Johnson", "J&J"],
+    "JPM": ["JPMorgan", "JP Morgan", "JPMorgan Chase", "J.P. Morgan"],
+    "KO": ["Coca-Cola", "Coca Cola", "Coke"],
+    "MCD": ["McDonald's", "McDonalds", "McDonald"],
+    "MMM": ["3M"],
+    "MRK": ["Merck"],
+    "MSFT": ["Microsoft"],
+    "NKE": ["Nike"],
+    "PG": ["Procter & Gamble", "Procter and Gamble", "P&G"],
+    "TRV": ["Travelers"],
+    "UNH": ["UnitedHealth", "United Health", "UnitedHealth Group"],
+    "V": ["Visa"],
+    "VZ": ["Verizon"],
+    "WBA": ["Walgreens", "Walgreens Boots Alliance"],
+    "WMT": ["Walmart", "Wal-Mart"],
+}
+
+# Các trường thông tin công ty và từ khóa tương ứng trong câu hỏi
+METADATA_FIELDS: Dict[str, List[str]] = {
+    "name": ["full name", "company name", "tên đầy đủ"],
+    "sector": ["sector", "lĩnh vực"],
+    "industry": ["industry", "ngành"],
+    "country": ["country", "headquartered", "quốc gia"],
+    "website": ["website", "trang web"],
+    "market_cap": ["market cap", "market capitalization", "vốn hóa"],
+    "pe_ratio": ["pe ratio", "p/e", "price-to-earnings", "price to earnings"],
+    "dividend_yield": ["dividend yield", "tỷ suất cổ tức"],
+    "fifty_two_week_high": ["52-week high", "52 week high", "fifty-two week high", "đỉnh 52 tuần"],
+    "fifty_two_week_low": ["52-week low", "52 week low", "fifty-two week low", "đáy 52 tuần"],
+    "description": ["description", "what does", "mô tả"],
+}
+
+SNAPSHOT_COLUMNS = [
+    "symbol", "name", "sector", "industry", "country", "website", "market_cap", "pe_ratio",
+    "dividend_yield", "fifty_two_week_high", "fifty_two_week_low", "description",
+]
+
+# Câu hỏi có các dấu hiệu này cần dữ liệu giá theo thời gian hoặc phép so sánh, không trả lời từ snapshot
+_NON_SNAPSHOT_PATTERN = re.compile(
+    r"\b(?:19|20)\d{2}\b|\b(?:price|close|closing|open|opening|volume|return|chart|plot|graph|"
+    r"highest|lowest|largest|smallest|rank\w*|average|compar\w*|giá|biểu đồ|so sánh)\b",
+    re.IGNORECASE,
+)
+
+# Tiền tố/hậu tố pháp lý bị bỏ khi dùng tên công ty trong cơ sở dữ liệu làm bí danh
+_NAME_SUFFIX_PATTERN = re.compile(
+    r"^the\s+|[,.]?\s+(?:inc|corp|corporation|company|co|group|holdings|ltd|plc)\.?$", re.IGNORECASE
+)
+
+# Tên rút gọn dễ nhầm lẫn, không dùng làm bí danh ("Dow" thường là chỉ số Dow Jones)
+AMBIGUOUS_ALIASES = {"dow"}
+
+
+def _field_pattern(keywords: List[str]) -> "re.Pattern":
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(kw) for kw in keywords) + r")s?(?!\w)", re.IGNORECASE)
+
+
+_FIELD_PATTERNS = {field: _field_pattern(keywords) for field, keywords in METADATA_FIELDS.items()}
+
+
+class EntityResolver:
+    """
+    Ánh xạ tên công ty, bí danh và mã cổ phiếu trong câu hỏi sang mã cổ phiếu.
+
+    Bí danh được khớp không phân biệt hoa thường; mã cổ phiếu chỉ được khớp khi
+    viết hoa (để "V" hay "KO" không khớp với từ thông thường).
+    """
+
+    def __init__(self, aliases: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            aliases (Optional[Dict[str, List[str]]]): Bí danh theo mã cổ phiếu (mặc định COMPANY_ALIASES)
+        """
+        self.aliases = {symbol: list(names) for symbol, names in (aliases or COMPANY_ALIASES).items()}
+        self._compile()
+
+    def _compile(self):
+        self._alias_to_symbol = {
+            alias.lower(): symbol for symbol, names in self.aliases.items() for alias in names
+        }
+        # Bí danh dài được thử trước ("JPMorgan Chase" trước "JPMorgan")
+        ordered = sorted(self._alias_to_symbol, key=len, reverse=True)
+        self._alias_pattern = re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(alias) for alias in ordered) + r")(?:'s)?(?!\w)", re.IGNORECASE
+        )
+        self._symbol_pattern = re.compile(
+            r"(?<![\w$])(" + "|".join(sorted(self.aliases, key=len, reverse=True)) + r")(?!\w)"
+        )
+
+    def add_alias(self, symbol: str, alias: str):
+        """Thêm một bí danh (ví dụ tên đầy đủ từ bảng companies)."""
+        alias = alias.strip()
+        if alias and alias.lower() not in self._alias_to_symbol and alias.lower() not in AMBIGUOUS_ALIASES:
+            self.aliases.setdefault(symbol, []).append(alias)
+            self._compile()
+
+    def resolve(self, question: str) -> List[str]:
+        """
+        Tìm các mã cổ phiếu được nhắc đến trong câu hỏi.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            List[str]: Các mã cổ phiếu theo thứ tự xuất hiện (không trùng lặp)
+        """
+        matches = [(m.start(), self._alias_to_symbol[m.group(1).lower()]) for m in self._alias_pattern.finditer(question)]
+        matches += [(m.start(), m.group(1)) for m in self._symbol_pattern.finditer(question)]
+        return list(dict.fromkeys(symbol for _, symbol in sorted(matches)))
+
+    def describe(self, question: str) -> str:
+        """
+        Dòng mô tả các mã cổ phiếu đã nhận diện để đưa vào prompt sinh SQL.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            str: Ví dụ "Các mã cổ phiếu được nhắc đến: Apple = AAPL, Microsoft = MSFT" (rỗng nếu không có)
+        """
+        symbols = self.resolve(question)
+        if not symbols:
+            return ""
+        return "Các mã cổ phiếu được nhắc đến: " + ", ".join(
+            f"{self.aliases[symbol][0]} = {symbol}" for symbol in symbols
+        )
+
+
+class CompaniesSnapshot:
+    """
+    Bản sao trong bộ nhớ của bảng companies (30 dòng).
+
+    Snapshot được nạp ở lần dùng đầu tiên. Sau mỗi refresh_interval giây, một query
+    nhỏ kiểm tra phiên bản dữ liệu (md5 của toàn bộ bảng); snapshot chỉ được nạp lại
+    khi phiên bản thay đổi. Câu hỏi về thông tin công ty (ngành, vốn hóa, P/E...) của
+    các công ty được nhắc đến được trả lời trực tiếp từ snapshot, không cần sinh SQL.
+    """
+
+    VERSION_QUERY = "SELECT md5(string_agg(c::text, ',' ORDER BY c.symbol)) FROM companies c"
+
+    def __init__(self, conn_params: Dict[str, Any], refresh_interval: float = 300.0,
+                 resolver: Optional[EntityResolver] = None):
+        """
+        Args:
+            conn_params (Dict[str, Any]): Tham số kết nối psycopg2
+            refresh_interval (float): Số giây giữa hai lần kiểm tra phiên bản dữ liệu
+            resolver (Optional[EntityResolver]): Bộ nhận diện công ty (mặc định dùng COMPANY_ALIASES)
+        """
+        self.conn_params = conn_params
+        self.refresh_interval = refresh_interval
+        self.resolver = resolver or EntityResolver()
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Kiểm tra phiên bản dữ liệu và nạp lại snapshot nếu cần (gọi khi đang giữ lock)."""
+        conn = psycopg2.connect(**self.conn_params)
+        try:
+            with conn.cursor() as cursor, span("db.execute", statement="companies_snapshot"):
+                cursor.execute(self.VERSION_QUERY)
+                version = cursor.fetchone()[0]
+                if version != self._version or not self._rows:
+                    cursor.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM companies ORDER BY symbol")
+                    self._rows = {row[0]: dict(zip(SNAPSHOT_COLUMNS, row)) for row in cursor.fetchall()}
+                    self._version = version
+                    for symbol, row in self._rows.items():
+                        if row.get("name"):
+                            self.resolver.add_alias(symbol, _NAME_SUFFIX_PATTERN.sub("", row["name"]))
+                    print(f"Đã nạp snapshot bảng companies ({len(self._rows)} công ty)")
+        finally:
+            conn.close()
+        self._checked_at = time.monotonic()
+
+    def rows(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Các dòng của bảng companies theo mã cổ phiếu (nạp lại nếu dữ liệu đã thay đổi).
+
+        Returns:
+            Dict[str, Dict[str, Any]]: {symbol: dòng}
+        """
+        with self._lock:
+            if not self._rows or time.monotonic() - self._checked_at >= self.refresh_interval:
+                self._refresh()
+            return self._rows
+
+    @staticmethod
+    def requested_fields(question: str) -> List[str]:
+        """Các trường thông tin công ty được hỏi trong câu hỏi."""
+        return [field for field, pattern in _FIELD_PATTERNS.items() if pattern.search(question)]
+
+    def answer_metadata(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Trả lời câu hỏi về thông tin công ty từ snapshot.
+
+        Chỉ áp dụng khi câu hỏi nhắc đến công ty cụ thể, hỏi các trường của bảng companies
+        và không cần dữ liệu giá, mốc thời gian hay phép so sánh.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Optional[Dict[str, Any]]: Kết quả cùng định dạng với query_with_retry
+                (query, columns, results), hoặc None nếu cần sinh SQL
+        """
+        fields = self.requested_fields(question)
+        if not fields or _NON_SNAPSHOT_PATTERN.search(question):
+            return None
+        symbols = self.resolver.resolve(question)
+        if not symbols:
+            return None
+        try:
+            rows = self.rows()
+        except psycopg2.Error as e:
+            print(f"Không thể nạp snapshot bảng companies: {str(e)}")
+            return None
+        if any(symbol not in rows for symbol in symbols):
+            return None
+
+        columns = ["symbol"] + (["name"] if "name" not in fields else []) + fields
+        symbol_list = ", ".join(f"'{symbol}'" for symbol in symbols)
+        return {
+            "query": f"SELECT {', '.join(columns)} FROM companies WHERE symbol IN ({symbol_list})",
+            "columns": columns,
+            "results": [{col: rows[symbol][col] for col in columns} for symbol in symbols],
+            "source": "companies_snapshot",
+        }
+
+
+_default_resolver = EntityResolver()
+
+
+def describe_entities(question: str) -> str:
+    """Mô tả các mã cổ phiếu được nhắc đến trong câu hỏi (dùng bộ nhận diện mặc định)."""
+    return _default_resolver.describe(question)
@@ -1,6 +1,10 @@
-def prompt_template_schema():
-    
-    outputs = """
+import re
+from typing import Dict, List, Tuple
+
+# Schema và công thức được chia thành từng phần để chỉ đưa vào prompt những phần liên quan
+# đến câu hỏi. Các phần dùng raw string để giữ nguyên ký hiệu LaTeX (\frac, \text, ...).
+
+COMPANIES_TABLE = r"""
 -- Creating the companies table to store company information
 CREATE TABLE companies (
     symbol VARCHAR(10) PRIMARY KEY,
@@ -17,6 +21,22 @@ CREATE TABLE companies (
     description TEXT
 );
 
+-- companies: 
+-- Purpose: Stores essential details about publicly traded companies, limited to the 30 constituents of the Dow Jones Industrial Average (DJIA).
+-- Data Description: Contains metadata for exactly 30 companies with the following stock tickers: AAPL, AMGN, AXP, BA, CAT, CRM, CSCO, CVX, DIS, DOW, GS, HD, HON, IBM, INTC, JNJ, JPM, KO, MCD, MMM, MRK, MSFT, NKE, PG, TRV, UNH, V, VZ, WBA, WMT.
+-- Key Fields:
+--   - symbol (Primary Key): Unique stock ticker (e.g., AAPL for Apple).
+--   - name: Full company name (required).
+--   - sector, industry: Business sector and industry classification (e.g., Technology, Consumer Electronics).
+--   - country, website: Company’s country of origin (typically United States) and official website.
+--   - market_cap: Total market capitalization in USD.
+--   - pe_ratio, dividend_yield: Price-to-earnings ratio and dividend yield percentage.
+--   - fifty_two_week_high, fifty_two_week_low: Highest and lowest stock prices in the past 52 weeks.
+--   - description: Brief overview of the company’s operations and offerings.
+-- Significance: Acts as the primary reference for DJIA company metadata, linked to stock_prices via symbol.
+"""
+
+STOCK_PRICES_TABLE = r"""
 -- Creating the stock_prices table to store historical stock price data
 CREATE TABLE stock_prices (
     id BIGSERIAL PRIMARY KEY,
@@ -37,20 +57,6 @@ CREATE TABLE stock_prices (
 CREATE INDEX idx_stock_prices_date ON stock_prices(date);
 CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
 
--- companies: 
--- Purpose: Stores essential details about publicly traded companies, limited to the 30 constituents of the Dow Jones Industrial Average (DJIA).
--- Data Description: Contains metadata for exactly 30 companies with the following stock tickers: AAPL, AMGN, AXP, BA, CAT, CRM, CSCO, CVX, DIS, DOW, GS, HD, HON, IBM, INTC, JNJ, JPM, KO, MCD, MMM, MRK, MSFT, NKE, PG, TRV, UNH, V, VZ, WBA, WMT.
--- Key Fields:
---   - symbol (Primary Key): Unique stock ticker (e.g., AAPL for Apple).
---   - name: Full company name (required).
---   - sector, industry: Business sector and industry classification (e.g., Technology, Consumer Electronics).
---   - country, website: Company’s country of origin (typically United States) and official website.
---   - market_cap: Total market capitalization in USD.
---   - pe_ratio, dividend_yield: Price-to-earnings ratio and dividend yield percentage.
---   - fifty_two_week_high, fifty_two_week_low: Highest and lowest stock prices in the past 52 weeks.
---   - description: Brief overview of the company’s operations and offerings.
--- Significance: Acts as the primary reference for DJIA company metadata, linked to stock_prices via symbol.
-
 -- stock_prices: 
 -- Purpose: Captures historical daily stock price data for the 30 DJIA companies.
 -- Data Description: Contains daily price records for the 30 DJIA tickers (AAPL, AMGN, AXP, BA, CAT, CRM, CSCO, CVX, DIS, DOW, GS, HD, HON, IBM, INTC, JNJ, JPM, KO, MCD, MMM, MRK, MSFT, NKE, PG, TRV, UNH, V, VZ, WBA, WMT), covering open, high, low, close prices, trading volume, dividends, and stock splits.
@@ -66,7 +72,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
 --   - idx_stock_prices_date: Optimizes queries filtering by date.
 --   - idx_stock_prices_symbol: Speeds up queries filtering by company symbol.
 -- Significance: Enables tracking and analysis of stock performance trends for DJIA companies over time.
+"""
 
+RETURN_FORMULAS = r"""
 ### Return Calculations
 
 1. **Daily Return**:
@@ -94,9 +102,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
 
    Where $n$ is the number of years.
+"""
 
----
-
+VOLATILITY_FORMULAS = r"""
 ### Volatility Calculations
 
 1. **Daily Volatility**:
@@ -110,9 +118,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Annualized Volatility} = \text{Daily Volatility} \times \sqrt{252}
    $$
+"""
 
----
-
+RISK_ADJUSTED_FORMULAS = r"""
 ### Risk-Adjusted Metrics
 
 1. **Sharpe Ratio**:
@@ -132,9 +140,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Correlation} = \frac{\text{Covariance}(\text{Asset Returns}, \text{Benchmark Returns})}{\text{Standard Deviation of Asset Returns} \times \text{Standard Deviation of Benchmark Returns}}
    $$
+"""
 
----
-
+DATE_SPECIFIC_FORMULAS = r"""
 ### Date-Specific Metrics
 
 1. **Moving Average (e.g., 30-day)**:
@@ -148,9 +156,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Standard Deviation} = \sqrt{\frac{1}{n} \sum_{i=1}^{n} (\text{Close}_i - \text{Mean Close})^2}
    $$
+"""
 
----
-
+DIVIDEND_FORMULAS = r"""
 ### Dividend Metrics
 
 1. **Dividend Yield**:
@@ -164,9 +172,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Total Dividends} = \text{Dividend per Share} \times \text{Number of Shares}
    $$
+"""
 
----
-
+VOLUME_FORMULAS = r"""
 ### Volume Metrics
 
 1. **Average Daily Trading Volume**:
@@ -180,9 +188,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Total Volume} = \sum \text{Daily Volume}
    $$
+"""
 
----
-
+COMPARATIVE_FORMULAS = r"""
 ### Comparative Metrics
 
 1. **Percentage Change Over Period**:
@@ -196,9 +204,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Absolute Change} = \text{Close}_{\text{end}} - \text{Close}_{\text{start}}
    $$
+"""
 
----
-
+MAX_DRAWDOWN_FORMULAS = r"""
 ### Maximum Drawdown
 
 1. **Maximum Drawdown**:
@@ -208,9 +216,9 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
 
    Where "Peak" is the highest value before a decline, and "Trough" is the lowest value after the peak.
+"""
 
----
-
+OTHER_FORMULAS = r"""
 ### Other Metrics
 
 1. **Median Closing Price**:
@@ -224,7 +232,153 @@ CREATE INDEX idx_stock_prices_symbol ON stock_prices(symbol);
    $$
    \text{Standard Deviation} = \sqrt{\frac{1}{n} \sum_{i=1}^{n} (\text{Daily Return}_i - \text{Mean Daily Return})^2}
    $$
+"""
+
+# Các phần công thức theo thứ tự cố định (để prompt của các câu hỏi tương tự có cùng tiền tố)
+FORMULA_SECTIONS: Dict[str, str] = {
+    "Return Calculations": RETURN_FORMULAS,
+    "Volatility Calculations": VOLATILITY_FORMULAS,
+    "Risk-Adjusted Metrics": RISK_ADJUSTED_FORMULAS,
+    "Date-Specific Metrics": DATE_SPECIFIC_FORMULAS,
+    "Dividend Metrics": DIVIDEND_FORMULAS,
+    "Volume Metrics": VOLUME_FORMULAS,
+    "Comparative Metrics": COMPARATIVE_FORMULAS,
+    "Maximum Drawdown": MAX_DRAWDOWN_FORMULAS,
+    "Other Metrics": OTHER_FORMULAS,
+}
+
+# Từ khóa (tiếng Anh và tiếng Việt) để chọn các bảng liên quan đến câu hỏi
+COMPANY_KEYWORDS = [
+    "sector", "industry", "country", "website", "market cap", "market capitalization", "pe ratio",
+    "p/e", "price-to-earnings", "dividend yield", "52-week", "52 week", "fifty two week",
+    "description", "headquarter", "company name", "ngành", "lĩnh vực", "quốc gia", "vốn hóa",
+    "tỷ suất cổ tức", "mô tả",
+]
+PRICE_KEYWORDS = [
+    "price", "close", "closed", "closing", "open", "opening", "volume", "return", "dividend",
+    "split", "volatility", "trend", "daily", "moving average", "drawdown", "sharpe", "beta",
+    "correlation", "chart", "plot", "giá", "đóng cửa", "mở cửa", "khối lượng", "lợi nhuận",
+    "cổ tức", "biến động", "xu hướng", "biểu đồ",
+]
+
+# Từ khóa để chọn các phần công thức
+SECTION_KEYWORDS: Dict[str, List[str]] = {
+    "Return Calculations": [
+        "return", "cagr", "growth", "annualized", "cumulative", "performance", "lợi nhuận",
+        "tăng trưởng", "hiệu suất",
+    ],
+    "Volatility Calculations": ["volatility", "volatile", "risk", "biến động", "rủi ro"],
+    "Risk-Adjusted Metrics": [
+        "sharpe", "beta", "correlation", "correlated", "covariance", "risk-adjusted", "tương quan",
+    ],
+    "Date-Specific Metrics": [
+        "moving average", "rolling", "standard deviation", "trung bình động", "độ lệch chuẩn",
+    ],
+    "Dividend Metrics": ["dividend", "cổ tức"],
+    "Volume Metrics": ["volume", "traded", "trading", "khối lượng", "giao dịch"],
+    "Comparative Metrics": [
+        "change", "compare", "comparison", "percentage", "percent", "increase", "decrease", "gain",
+        "loss", "so sánh", "thay đổi", "phần trăm", "tăng", "giảm",
+    ],
+    "Maximum Drawdown": ["drawdown", "peak", "trough", "sụt giảm"],
+    "Other Metrics": ["median", "standard deviation", "trung vị", "độ lệch chuẩn"],
+}
+
+# Một số công thức được định nghĩa dựa trên công thức của phần khác
+SECTION_DEPENDENCIES: Dict[str, List[str]] = {
+    "Volatility Calculations": ["Return Calculations"],
+    "Risk-Adjusted Metrics": ["Return Calculations", "Volatility Calculations"],
+    "Other Metrics": ["Return Calculations"],
+}
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    # Cho phép dạng số nhiều tiếng Anh (prices, returns...)
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(kw) for kw in keywords) + r")s?(?!\w)", re.IGNORECASE)
+
+
+_COMPANY_PATTERN = _keyword_pattern(COMPANY_KEYWORDS)
+_PRICE_PATTERN = _keyword_pattern(PRICE_KEYWORDS)
+_SECTION_PATTERNS = {title: _keyword_pattern(keywords) for title, keywords in SECTION_KEYWORDS.items()}
+
+
+def prompt_template_schema():
+    """Toàn bộ schema và mọi phần công thức."""
+    return build_schema_context(
+        (COMPANIES_TABLE, STOCK_PRICES_TABLE), list(FORMULA_SECTIONS)
+    )
+
+
+def build_schema_context(tables: Tuple[str, ...], sections: List[str]) -> str:
+    """
+    Ghép các bảng và phần công thức thành context schema.
 
+    Args:
+        tables (Tuple[str, ...]): Định nghĩa các bảng (theo thứ tự cố định)
+        sections (List[str]): Tên các phần công thức
+    Returns:
+        str: Context schema
+    """
+    parts = [table.strip("\n") for table in tables]
+    formulas = [FORMULA_SECTIONS[title].strip("\n") for title in FORMULA_SECTIONS if title in sections]
+    if formulas:
+        parts.append("\n\n---\n\n".join(formulas))
+    return "\n\n".join(parts) + "\n"
+
+
+# Định nghĩa đầy đủ các bảng: phần cố định của prompt sinh SQL, không rút gọn theo câu hỏi
+# để mọi prompt có chung một tiền tố dài (prompt caching phía nhà cung cấp)
+TABLES_CONTEXT = build_schema_context((COMPANIES_TABLE, STOCK_PRICES_TABLE), [])
+
+
+def select_schema_sections(question: str) -> Tuple[Tuple[str, ...], List[str]]:
+    """
+    Chọn các bảng và phần công thức liên quan đến câu hỏi theo từ khóa.
+
+    Args:
+        question (str): Câu hỏi của người dùng
+    Returns:
+        Tuple[Tuple[str, ...], List[str]]: Định nghĩa các bảng và tên các phần công thức
+    """
+    wants_company = bool(_COMPANY_PATTERN.search(question))
+    wants_prices = bool(_PRICE_PATTERN.search(question))
+    # Không nhận ra bảng nào thì giữ cả hai bảng để không thiếu thông tin
+    if wants_company and not wants_prices:
+        tables = (COMPANIES_TABLE,)
+    elif wants_prices and not wants_company:
+        tables = (STOCK_PRICES_TABLE,)
+    else:
+        tables = (COMPANIES_TABLE, STOCK_PRICES_TABLE)
+
+    sections = [title for title, pattern in _SECTION_PATTERNS.items() if pattern.search(question)]
+    for title in list(sections):
+        for dependency in SECTION_DEPENDENCIES.get(title, []):
+            if dependency not in sections:
+                sections.append(dependency)
+    return tables, sections
+
+
+def select_formula_context(question: str) -> str:
+    """
+    Các phần công thức liên quan đến câu hỏi (chuỗi rỗng nếu không có phần nào).
+
+    Args:
+        question (str): Câu hỏi của người dùng
+    Returns:
+        str: Các phần công thức
+    """
+    _, sections = select_schema_sections(question)
+    return build_schema_context((), sections) if sections else ""
+
+
+def select_schema_context(question: str) -> str:
+    """
+    Context schema rút gọn cho câu hỏi: chỉ gồm các bảng và công thức liên quan.
 
+    Args:
+        question (str): Câu hỏi của người dùng
+    Returns:
+        str: Context schema
     """
-    return outputs
\ No newline at end of file
+    tables, sections = select_schema_sections(question)
+    return build_schema_context(tables, sections)
@@ -1,11 +1,24 @@
 import os
 import asyncio
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnableSequence
 import time
 from datetime import datetime
+from src.utils.llm import create_chat_model
+from src.utils.tracing import span
+from src.utils.usage import timed_llm_call
+
+# Danh sách lời chào và câu hỏi thông thường (dùng chung với bộ phân loại cục bộ của router)
+GREETINGS = [
+    "xin chào", "chào", "hello", "hi", "hey", "alo", "chào bạn", 
+    "chào buổi sáng", "chào buổi chiều", "chào buổi tối"
+]
+
+COMMON_QUESTIONS = [
+    "bạn là ai", "bạn có thể làm gì", "giúp tôi", "trợ giúp", 
+    "hướng dẫn", "khả năng", "chức năng"
+]
 
 class ConversationAgent:
     def __init__(self, max_retries=3, model_name="gpt-4o-mini"):
@@ -14,10 +27,7 @@ class ConversationAgent:
         
         # Khởi tạo LLM
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(
-            model_name=model_name,
-            openai_api_key=self.api_key
-        )
+        self.llm = create_chat_model(model_name)
         
         # Đặt các tham số
         self.max_retries = max_retries
@@ -42,15 +52,8 @@ class ConversationAgent:
         self.chain = self.conversation_prompt | self.llm
         
         # Danh sách lời chào và câu hỏi thông thường
-        self.greetings = [
-            "xin chào", "chào", "hello", "hi", "hey", "alo", "chào bạn", 
-            "chào buổi sáng", "chào buổi chiều", "chào buổi tối"
-        ]
-        
-        self.common_questions = [
-            "bạn là ai", "bạn có thể làm gì", "giúp tôi", "trợ giúp", 
-            "hướng dẫn", "khả năng", "chức năng"
-        ]
+        self.greetings = list(GREETINGS)
+        self.common_questions = list(COMMON_QUESTIONS)
 
     def is_greeting(self, message):
         """Kiểm tra xem tin nhắn có phải là lời chào không."""
@@ -169,7 +172,10 @@ class ConversationAgent:
                 user_context_str = user_context if user_context else "Không có thông tin ngữ cảnh."
                 
                 # Sử dụng invoke thay vì run
-                response = self.chain.invoke({"input": message, "user_context": user_context_str})
+                with span("llm", component="conversation"), \
+                        timed_llm_call("conversation", self.llm.model_name) as llm_call:
+                    response = self.chain.invoke({"input": message, "user_context": user_context_str})
+                    llm_call["response"] = response
                 
                 return {
                     "type": "conversation",
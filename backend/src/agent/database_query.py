@@ -1,14 +1,30 @@
 import psycopg2
+import psycopg2.pool
+import threading
 import asyncio
 import concurrent.futures
-from langchain_openai import ChatOpenAI
+from collections import Counter
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 import time
-import os
-from .configs.promtting import prompt_template_schema
+import decimal
+from .configs.promtting import TABLES_CONTEXT, select_formula_context
+from .sql_utils import clean_sql, validate_readonly_sql
+from .example_store import format_examples
+from .companies import CompaniesSnapshot
+from src.utils.llm import get_model_policy, is_complex_question
+from src.utils.tracing import propagate, span
+from src.utils.metrics import RETRIES_TOTAL
+
+# Temperature của từng query ứng viên (lặp lại nếu số ứng viên lớn hơn)
+CANDIDATE_TEMPERATURES = (0.0, 0.4, 0.7, 1.0)
+
+
 class DatabaseQueryAgent:
-    def __init__(self, host, port, dbname, user, password, model_name="gpt-4o-mini", max_retries=3):
+    def __init__(self, host, port, dbname, user, password, model_name="gpt-4o-mini", max_retries=3,
+                 readonly_pool_size=4, readonly_statement_timeout_ms=5000,
+                 num_candidates=1, candidate_strategy="first", example_store=None, num_examples=3,
+                 companies_refresh_interval=300):
         """Khởi tạo agent truy vấn cơ sở dữ liệu PostgreSQL.
         
         Args:
@@ -17,8 +33,18 @@ class DatabaseQueryAgent:
             dbname (str): Tên cơ sở dữ liệu
             user (str): Tên người dùng
             password (str): Mật khẩu
-            model_name (str): Tên mô hình LLM (mặc định: gpt-4o-mini)
+            model_name (str): Không dùng, giữ để tương thích (mô hình sinh SQL do ModelPolicy chọn theo
+                tầng LLM_TIER_SMALL/LLM_TIER_LARGE)
             max_retries (int): Số lần thử lại tối đa khi query lỗi
+            readonly_pool_size (int): Số kết nối tối đa của pool chỉ đọc (dùng cho truy vấn suy đoán và
+                query ứng viên; không nhỏ hơn num_candidates để một yêu cầu luôn chạy đủ ứng viên)
+            readonly_statement_timeout_ms (int): Thời gian tối đa cho mỗi query trên pool chỉ đọc
+            num_candidates (int): Số query ứng viên sinh và thực thi song song (1 = tắt)
+            candidate_strategy (str): "first" (lấy kết quả thành công đầu tiên) hoặc
+                "vote" (chờ mọi ứng viên và chọn kết quả được nhiều ứng viên trả về nhất)
+            example_store (SQLExampleStore, optional): Kho cặp câu hỏi/SQL đã kiểm chứng dùng làm ví dụ few-shot
+            num_examples (int): Số ví dụ tối đa đưa vào prompt
+            companies_refresh_interval (float): Số giây giữa hai lần kiểm tra phiên bản của snapshot bảng companies
         """
         self.conn_params = {
             "host": host,
@@ -28,24 +54,43 @@ class DatabaseQueryAgent:
             "password": password
         }
         self.max_retries = max_retries
-        self.llm = Chaturya = ChatOpenAI(
-            model_name=model_name,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self.readonly_pool_size = max(readonly_pool_size, num_candidates)
+        self.readonly_statement_timeout_ms = readonly_statement_timeout_ms
+        self._readonly_pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_in_use = 0
+        # ThreadedConnectionPool báo lỗi ngay khi hết kết nối: chờ đến lượt thay vì thất bại
+        self._pool_slots = threading.BoundedSemaphore(self.readonly_pool_size)
+        self.num_candidates = num_candidates
+        self.candidate_strategy = candidate_strategy
+        self.example_store = example_store
+        self.num_examples = num_examples
+        # Snapshot bảng companies: trả lời trực tiếp câu hỏi về thông tin công ty và
+        # nhận diện mã cổ phiếu để đưa vào prompt sinh SQL
+        self.companies = CompaniesSnapshot(self.conn_params, companies_refresh_interval)
+        # Sinh SQL theo chính sách tầng mô hình: câu hỏi đơn giản dùng mô hình nhỏ,
+        # leo thang khi query không hợp lệ hoặc câu hỏi phức tạp
+        self.model_policy = get_model_policy()
         self.prompt_template = PromptTemplate(
-            input_variables=["question", "schema"],
+            input_variables=["question", "tables", "formulas", "examples", "entities"],
+            # Hướng dẫn và định nghĩa đầy đủ các bảng (cố định, khoảng 1000 token) đặt đầu; các phần
+            # thay đổi theo câu hỏi (công thức, ví dụ, mã cổ phiếu, câu hỏi) đặt sau. Prompt caching
+            # của OpenAI chỉ áp dụng cho tiền tố chung từ 1024 token trở lên.
             template="""
             Giả sử bạn là một chuyên gia về tạo câu query cho dữ liệu, dữ liệu của người dùng liên quan đến tài chính,nếu câu hỏi liên quan đến tính toán bạn phải viết thêm các hàm tính toán từ tài chính.
-            Dựa trên schema cơ sở dữ liệu sau:
-            {schema}
+            Hãy tạo một câu query SQL chuẩn PostgreSQL để trả lời câu hỏi của người dùng.
+            Chỉ trả về câu query SQL, không giải thích.
 
-            Hãy tạo một câu query SQL chuẩn PostgreSQL để trả lời câu hỏi sau:
-            {question}
+            Schema cơ sở dữ liệu:
+            {tables}
 
-            Chỉ trả về câu query SQL, không giải thích.
+            {formulas}
+
+            {examples}
+            {entities}
+            Câu hỏi: {question}
             """
         )
-        self.chain = self.prompt_template | self.llm    
 
     # def get_schema(self):
     #     """Lấy schema của cơ sở dữ liệu."""
@@ -71,27 +116,48 @@ class DatabaseQueryAgent:
     #     except psycopg2.Error as e:
     #         raise Exception(f"Không thể lấy schema: {str(e)}")
 
-    def generate_query(self, question):
-        """Tạo câu query SQL từ câu hỏi người dùng."""
-        schema = prompt_template_schema()
-        response = self.chain.invoke({"question": question, "schema": schema})
-        raw_query = response.content if hasattr(response, 'content') else str(response)
+    def generate_query(self, question, escalate=False, temperature=None):
+        """Tạo câu query SQL từ câu hỏi người dùng.
+        
+        Args:
+            question (str): Câu hỏi của người dùng
+            escalate (bool): Bắt đầu thẳng ở tầng mô hình lớn (ví dụ sau khi query trước đó lỗi)
+            temperature (float, optional): Temperature cho lời gọi LLM (dùng khi sinh nhiều ứng viên)
+        Returns:
+            str: Câu query SQL
+        """
+        # Các bảng luôn được đưa vào đầy đủ; chỉ các công thức được chọn theo câu hỏi
+        examples = self.example_store.search(question, self.num_examples) if self.example_store else []
+        prompt = self.prompt_template.format(
+            question=question, tables=TABLES_CONTEXT, formulas=select_formula_context(question),
+            examples=format_examples(examples),
+            entities=self.companies.resolver.describe(question)
+        )
+        raw_query, tier = self.model_policy.invoke(
+            "sql", prompt,
+            validate=lambda content: validate_readonly_sql(clean_sql(content)),
+            complex_question=escalate or is_complex_question(question),
+            temperature=temperature
+        )
+        print(f"Sinh query bằng mô hình tầng {tier}")
         
-        clean_query = raw_query.replace('```sql', '').replace('```', '').strip()
-        return clean_query
+        return clean_sql(raw_query)
 
     def execute_query(self, query):
         """Thực thi câu query và trả về kết quả."""
         conn = psycopg2.connect(**self.conn_params)
         cursor = conn.cursor()
         try:
-            cursor.execute(query)
-            if cursor.description:
-                columns = [desc[0] for desc in cursor.description]
-                results = cursor.fetchall()
-            else:
-                columns = []
-                results = []
+            with span("db.execute", statement=query) as db_span:
+                cursor.execute(query)
+                if cursor.description:
+                    columns = [desc[0] for desc in cursor.description]
+                    results = cursor.fetchall()
+                else:
+                    columns = []
+                    results = []
+                if db_span:
+                    db_span.set(rows=len(results))
             conn.commit()
             conn.close()
             return columns, results
@@ -100,6 +166,92 @@ class DatabaseQueryAgent:
             conn.close()
             raise Exception(f"Lỗi khi thực thi query: {str(e)}")
 
+    def _get_readonly_pool(self):
+        """Khởi tạo (lần đầu) và trả về pool kết nối chỉ đọc."""
+        with self._pool_lock:
+            if self._readonly_pool is None:
+                self._readonly_pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, self.readonly_pool_size,
+                    options=f"-c statement_timeout={self.readonly_statement_timeout_ms}",
+                    **self.conn_params
+                )
+            return self._readonly_pool
+
+    def execute_readonly_query(self, query):
+        """
+        Thực thi câu query SELECT trên pool kết nối chỉ đọc (có giới hạn thời gian).
+        
+        Args:
+            query (str): Câu query SQL
+        Returns:
+            Tuple (columns, results)
+        """
+        error = validate_readonly_sql(query)
+        if error:
+            raise Exception(error)
+        
+        pool = self._get_readonly_pool()
+        # Chờ tối đa bằng thời gian của một query (mọi kết nối đang bận đều sẽ được trả lại trong khoảng này)
+        if not self._pool_slots.acquire(timeout=self.readonly_statement_timeout_ms / 1000):
+            raise Exception("Pool kết nối chỉ đọc đã hết kết nối")
+        conn = None
+        healthy = False
+        with self._pool_lock:
+            self._pool_in_use += 1
+        try:
+            conn = pool.getconn()
+            if not conn.autocommit:
+                conn.set_session(readonly=True, autocommit=True)
+            with conn.cursor() as cursor, span("db.execute", statement=query, readonly=True) as db_span:
+                cursor.execute(query)
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                results = cursor.fetchall() if cursor.description else []
+                if db_span:
+                    db_span.set(rows=len(results))
+            healthy = True
+            return columns, results
+        except psycopg2.Error as e:
+            raise Exception(f"Lỗi khi thực thi query: {str(e)}")
+        finally:
+            # Kết nối gặp lỗi (kể cả lỗi không phải của psycopg2) bị đóng thay vì trả lại pool
+            if conn is not None:
+                pool.putconn(conn, close=not healthy)
+            with self._pool_lock:
+                self._pool_in_use -= 1
+            self._pool_slots.release()
+
+    def pool_stats(self):
+        """Số kết nối tối đa và số kết nối đang dùng của pool chỉ đọc."""
+        with self._pool_lock:
+            return {"size": self.readonly_pool_size, "in_use": self._pool_in_use}
+
+    def speculate(self, question, execute=False, cancelled=None):
+        """
+        Sinh (và tùy chọn thực thi) query trước khi biết kết quả định tuyến.
+        
+        Args:
+            question (str): Câu hỏi của người dùng
+            execute (bool): Có thực thi query trên pool chỉ đọc hay không
+            cancelled (threading.Event, optional): Được đặt khi kết quả suy đoán bị loại bỏ;
+                khi đó query đã sinh không được thực thi
+        Returns:
+            Dict chứa query; nếu execute=True thì có thêm columns và results,
+            hoặc error nếu thực thi thất bại
+        """
+        snapshot_result = self.companies.answer_metadata(question)
+        if snapshot_result is not None:
+            return snapshot_result
+        query = self.generate_query(question)
+        speculation = {"query": query}
+        if execute and not (cancelled is not None and cancelled.is_set()):
+            try:
+                columns, results = self.execute_readonly_query(query)
+                speculation["columns"] = columns
+                speculation["results"] = [dict(zip(columns, row)) for row in results]
+            except Exception as e:
+                speculation["error"] = str(e)
+        return speculation
+
     async def query_with_retry_async(self, question):
         """
         Thực hiện truy vấn bất đồng bộ với cơ chế thử lại nếu lỗi.
@@ -120,8 +272,8 @@ class DatabaseQueryAgent:
         retries = 0
         while retries < self.max_retries:
             try:
-                # Sinh câu truy vấn bằng cách bất đồng bộ
-                query = await run_in_executor(self.generate_query, question)
+                # Sinh câu truy vấn bằng cách bất đồng bộ (leo thang mô hình khi thử lại)
+                query = await run_in_executor(self.generate_query, question, escalate=retries > 0)
                 print(f"Generated query: {query}")
                 
                 # Thực hiện truy vấn bằng cách bất đồng bộ
@@ -135,24 +287,150 @@ class DatabaseQueryAgent:
                 }
             except Exception as e:
                 retries += 1
+                RETRIES_TOTAL.inc(component="sql")
                 print(f"Lỗi (thử lại {retries}/{self.max_retries}): {str(e)}")
                 if retries == self.max_retries:
                     raise Exception(f"Đã thử {self.max_retries} lần nhưng vẫn thất bại: {str(e)}")
                 await asyncio.sleep(1)
     
-    def query_with_retry(self, question):
+    def run_draft_query(self, query):
+        """
+        Kiểm tra và thực thi câu query nháp (ví dụ do planner của router sinh ra).
+        
+        Args:
+            query (str): Câu query SQL nháp
+        Returns:
+            Dict chứa query, columns và kết quả, hoặc None nếu query không hợp lệ hoặc lỗi
+        """
+        error = validate_readonly_sql(query)
+        if error:
+            print(f"Bỏ qua query nháp không hợp lệ: {error}")
+            return None
+        try:
+            # Query nháp do LLM viết: chạy trên pool chỉ đọc (có giới hạn thời gian), không commit
+            columns, results = self.execute_readonly_query(query)
+        except Exception as e:
+            print(f"Query nháp thất bại, chuyển sang sinh query thông thường: {str(e)}")
+            return None
+        print(f"Dùng query nháp: {query}")
+        return {
+            "query": query,
+            "columns": columns,
+            "results": [dict(zip(columns, row)) for row in results]
+        }
+    
+    @staticmethod
+    def _result_signature(columns, results):
+        """Dấu hiệu của một kết quả truy vấn để so sánh giữa các ứng viên (không phụ thuộc thứ tự dòng)."""
+        def normalize(value):
+            if isinstance(value, (float, decimal.Decimal)):
+                return round(float(value), 6)
+            return value
+        rows = sorted(repr(tuple(normalize(v) for v in row)) for row in results)
+        return (len(columns), tuple(rows))
+
+    def _run_candidate(self, question, temperature, cancelled=None):
+        """Sinh, kiểm tra và thực thi một query ứng viên trên pool chỉ đọc (bỏ qua nếu đã bị hủy)."""
+        query = self.generate_query(question, temperature=temperature)
+        if cancelled is not None and cancelled.is_set():
+            raise concurrent.futures.CancelledError()
+        columns, results = self.execute_readonly_query(query)
+        return {"query": query, "columns": columns, "results": results}
+
+    def query_candidates(self, question):
+        """
+        Sinh nhiều query ứng viên song song và thực thi chúng trên pool chỉ đọc.
+        
+        Với chiến lược "first", trả về kết quả thành công đầu tiên (độ trễ bằng lần thử
+        nhanh nhất thành công thay vì tổng các lần thử). Với chiến lược "vote", chờ mọi
+        ứng viên và chọn kết quả được nhiều ứng viên trả về nhất (hòa thì lấy kết quả về sớm hơn).
+        
+        Mỗi yêu cầu có thread pool riêng để không phải xếp hàng sau ứng viên của yêu cầu
+        khác. Khi đã có kết quả, các ứng viên còn lại bị hủy: ứng viên đang chờ LLM không
+        thực thi query nữa nên không chiếm kết nối của pool.
+        
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Dict chứa query, columns và kết quả, hoặc None nếu mọi ứng viên đều thất bại
+        """
+        cancelled = threading.Event()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.num_candidates, thread_name_prefix="sql-candidate"
+        )
+        futures = [
+            executor.submit(
+                propagate(self._run_candidate), question, CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)],
+                cancelled
+            )
+            for i in range(self.num_candidates)
+        ]
+        
+        successes = []
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    candidate = future.result()
+                except Exception as e:
+                    print(f"Query ứng viên thất bại: {str(e)}")
+                    continue
+                successes.append(candidate)
+                if self.candidate_strategy != "vote":
+                    break
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if not successes:
+            return None
+        
+        chosen = successes[0]
+        if len(successes) > 1:
+            signatures = [self._result_signature(c["columns"], c["results"]) for c in successes]
+            votes = Counter(signatures)
+            best = max(votes.values())
+            chosen = successes[next(i for i, sig in enumerate(signatures) if votes[sig] == best)]
+            print(f"Bỏ phiếu giữa {len(successes)} ứng viên: {len(votes)} kết quả khác nhau, "
+                  f"kết quả được chọn có {best} phiếu")
+        print(f"Dùng query ứng viên: {chosen['query']}")
+        return {
+            "query": chosen["query"],
+            "columns": chosen["columns"],
+            "results": [dict(zip(chosen["columns"], row)) for row in chosen["results"]]
+        }
+
+    def query_with_retry(self, question, draft_query=None):
         """
         Thực hiện truy vấn với cơ chế thử lại nếu lỗi.
         
         Args:
             question (str): Câu hỏi của người dùng
+            draft_query (str, optional): Câu query nháp; nếu hợp lệ và chạy thành công thì
+                không cần gọi LLM để sinh query
         Returns:
             Dict chứa query, columns và kết quả
         """
+        # Câu hỏi về thông tin công ty được trả lời từ snapshot, không cần sinh SQL
+        snapshot_result = self.companies.answer_metadata(question)
+        if snapshot_result is not None:
+            print(f"Trả lời từ snapshot bảng companies: {snapshot_result['query']}")
+            return snapshot_result
+        
+        if draft_query:
+            result = self.run_draft_query(draft_query)
+            if result is not None:
+                return result
+        
+        # Sinh nhiều ứng viên song song; chỉ thử lại tuần tự khi mọi ứng viên đều thất bại
         retries = 0
+        if self.num_candidates > 1:
+            result = self.query_candidates(question)
+            if result is not None:
+                return result
+            retries = 1
         while retries < self.max_retries:
             try:
-                query = self.generate_query(question)
+                query = self.generate_query(question, escalate=retries > 0)
                 print(f"Generated query: {query}")
                 
                 columns, results = self.execute_query(query)
@@ -165,6 +443,7 @@ class DatabaseQueryAgent:
                 }
             except Exception as e:
                 retries += 1
+                RETRIES_TOTAL.inc(component="sql")
                 print(f"Lỗi (thử lại {retries}/{self.max_retries}): {str(e)}")
                 if retries == self.max_retries:
                     raise Exception(f"Đã thử {self.max_retries} lần nhưng vẫn thất bại: {str(e)}")
@@ -0,0 +1,292 @@
+import re
+import sys
+import json
+import decimal
+import datetime
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from src.agent.companies import COMPANY_ALIASES, EntityResolver
+
+# Từ ngữ cho biết câu trả lời mẫu chỉ là giá trị xấp xỉ
+_APPROX_PATTERN = re.compile(r"\b(?:around|about|approximately|approx|roughly|near|nearly|close to)\b|~", re.IGNORECASE)
+_ORDER_OF_PATTERN = re.compile(r"\bon the order of\b", re.IGNORECASE)
+
+_SCALES = {"thousand": 1e3, "million": 1e6, "billion": 1e9, "trillion": 1e12}
+_NUMBER = r"-?\d[\d,]*(?:\.\d+)?"
+_CURRENCY_PATTERN = re.compile(r"(-?)\$\s?(" + _NUMBER + r")(?:\s*(thousand|million|billion|trillion))?", re.IGNORECASE)
+_PERCENT_PATTERN = re.compile(r"(" + _NUMBER + r")\s?%")
+_SHARES_PATTERN = re.compile(
+    r"(" + _NUMBER + r")(?:\s*(thousand|million|billion|trillion))?\s+shares", re.IGNORECASE
+)
+_SCALED_PATTERN = re.compile(r"(" + _NUMBER + r")\s*(thousand|million|billion|trillion)\b", re.IGNORECASE)
+_BARE_NUMBER_PATTERN = re.compile(r"(?<![\w$.])(" + _NUMBER + r")(?![\w%.])")
+
+_MONTHS = ("january february march april may june july august september october november december").split()
+_MONTH_PATTERN = r"(jan|feb|mar|apr|may|jun|jul|aug|sept?|oct|nov|dec)[a-z]*\.?"
+_DATE_PATTERN = re.compile(_MONTH_PATTERN + r"\s+(\d{1,2})(?:,?\s+(\d{4}))?", re.IGNORECASE)
+_ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+
+# Sai số cho phép theo loại giá trị: (sai số tương đối, sai số tuyệt đối)
+TOLERANCES = {
+    "currency": (0.001, 0.01),
+    "percent": (0.01, 0.05),
+    "count": (0.001, 0.5),
+    "number": (0.001, 0.01),
+}
+APPROX_TOLERANCE = 0.10
+ORDER_OF_TOLERANCE = 0.5
+
+
+@dataclass(frozen=True)
+class ExpectedValue:
+    """Một giá trị được trích từ câu trả lời mẫu."""
+    kind: str  # currency | percent | count | number | date | entity | text
+    value: Any
+    approximate: bool = False
+    tolerance: Optional[float] = None
+
+
+def _to_float(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+def parse_expected(answer: str) -> List[ExpectedValue]:
+    """
+    Trích các giá trị có kiểu (tiền tệ, số cổ phiếu, phần trăm, ngày, công ty) từ câu trả lời mẫu.
+
+    Số đứng riêng chỉ được dùng khi câu trả lời không có giá trị có kiểu hay tên công ty
+    nào (ví dụ "8"); nếu không trích được gì, cả câu trả lời được so khớp như văn bản.
+
+    Args:
+        answer (str): Câu trả lời mẫu, ví dụ "$27.81, on October 13, 2023"
+    Returns:
+        List[ExpectedValue]: Các giá trị cần tìm thấy trong kết quả truy vấn
+    """
+    approximate = bool(_APPROX_PATTERN.search(answer))
+    tolerance = ORDER_OF_TOLERANCE if _ORDER_OF_PATTERN.search(answer) else (APPROX_TOLERANCE if approximate else None)
+    approximate = approximate or tolerance is not None
+    values: List[ExpectedValue] = []
+    consumed = []
+
+    def add(kind, value, span):
+        values.append(ExpectedValue(kind, value, approximate, tolerance))
+        consumed.append(span)
+
+    for m in _CURRENCY_PATTERN.finditer(answer):
+        amount = _to_float(m.group(2)) * _SCALES.get((m.group(3) or "").lower(), 1)
+        add("currency", -amount if m.group(1) else amount, m.span())
+    for m in _PERCENT_PATTERN.finditer(answer):
+        add("percent", _to_float(m.group(1)), m.span())
+    for m in _SHARES_PATTERN.finditer(answer):
+        add("count", _to_float(m.group(1)) * _SCALES.get((m.group(2) or "").lower(), 1), m.span())
+    for m in _SCALED_PATTERN.finditer(answer):
+        if not any(start <= m.start() < end for start, end in consumed):
+            add("count", _to_float(m.group(1)) * _SCALES[m.group(2).lower()], m.span())
+    for m in _ISO_DATE_PATTERN.finditer(answer):
+        add("date", (int(m.group(1)), int(m.group(2)), int(m.group(3))), m.span())
+    for m in _DATE_PATTERN.finditer(answer):
+        month = next(i for i, name in enumerate(_MONTHS, 1) if name.startswith(m.group(1).lower()[:3]))
+        year = int(m.group(3)) if m.group(3) else None
+        add("date", (year, month, int(m.group(2))), m.span())
+
+    for symbol in EntityResolver().resolve(answer):
+        values.append(ExpectedValue("entity", symbol))
+
+    if not values:
+        numbers = [m for m in _BARE_NUMBER_PATTERN.finditer(answer)]
+        for m in numbers:
+            values.append(ExpectedValue("number", _to_float(m.group(1)), approximate, tolerance))
+    if not values:
+        values.append(ExpectedValue("text", answer.strip().casefold()))
+    return values
+
+
+def _cells(results: List[Any]) -> List[Any]:
+    """Mọi ô trong kết quả truy vấn (dòng dạng dict hoặc list/tuple)."""
+    cells = []
+    for row in results or []:
+        if isinstance(row, dict):
+            cells.extend(row.values())
+        elif isinstance(row, (list, tuple)):
+            cells.extend(row)
+        else:
+            cells.append(row)
+    return cells
+
+
+def _as_number(cell: Any) -> Optional[float]:
+    if isinstance(cell, bool):
+        return None
+    if isinstance(cell, (int, float, decimal.Decimal)):
+        return float(cell)
+    if isinstance(cell, str):
+        try:
+            return _to_float(cell.strip().lstrip("$").rstrip("%"))
+        except ValueError:
+            return None
+    return None
+
+
+def _as_date(cell: Any) -> Optional[datetime.date]:
+    if isinstance(cell, datetime.datetime):
+        return cell.date()
+    if isinstance(cell, datetime.date):
+        return cell
+    if isinstance(cell, str):
+        m = _ISO_DATE_PATTERN.search(cell)
+        if m:
+            try:
+                return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            except ValueError:
+                return None
+    return None
+
+
+def _close(actual: float, expected: float, kind: str, tolerance: Optional[float]) -> bool:
+    rel, abs_tol = TOLERANCES.get(kind, TOLERANCES["number"])
+    if tolerance is not None:
+        rel = max(rel, tolerance)
+    return abs(actual - expected) <= max(abs_tol, rel * abs(expected))
+
+
+def value_matches(expected: ExpectedValue, cells: List[Any], resolver: EntityResolver) -> bool:
+    """
+    Kiểm tra một giá trị mẫu có xuất hiện trong các ô kết quả (theo sai số của loại giá trị).
+
+    Args:
+        expected (ExpectedValue): Giá trị mẫu
+        cells (List[Any]): Các ô của kết quả truy vấn
+        resolver (EntityResolver): Bộ nhận diện công ty (cho giá trị loại entity)
+    Returns:
+        bool: True nếu tìm thấy
+    """
+    if expected.kind == "date":
+        year, month, day = expected.value
+        return any(
+            d is not None and d.month == month and d.day == day and (year is None or d.year == year)
+            for d in map(_as_date, cells)
+        )
+    if expected.kind == "entity":
+        return any(
+            isinstance(cell, str) and (cell.strip() == expected.value or expected.value in resolver.resolve(cell))
+            for cell in cells
+        )
+    if expected.kind == "text":
+        return any(isinstance(cell, str) and expected.value in cell.casefold() for cell in cells) or \
+            any(cell.strip().casefold() in expected.value
+                for cell in cells if isinstance(cell, str) and cell.strip())
+    candidates = [expected.value]
+    if expected.kind == "percent":
+        # Phần trăm có thể được trả về dưới dạng tỷ lệ (0.22 thay vì 22%)
+        candidates.append(expected.value / 100)
+    for actual in map(_as_number, cells):
+        if actual is None:
+            continue
+        if any(_close(actual, candidate, expected.kind, expected.tolerance) for candidate in candidates):
+            return True
+    return False
+
+
+def score_answer(results: List[Any], expected_answer: str) -> Dict[str, Any]:
+    """
+    Chấm kết quả truy vấn so với câu trả lời mẫu.
+
+    Args:
+        results (List[Any]): Kết quả truy vấn (mọi dòng, mọi cột đều được xét)
+        expected_answer (str): Câu trả lời mẫu
+    Returns:
+        Dict[str, Any]: {"correct": bool, "matched": int, "expected": int, "missing": List[str]}
+    """
+    expected = parse_expected(expected_answer)
+    cells = _cells(results)
+    resolver = EntityResolver(COMPANY_ALIASES)
+    missing = [f"{value.kind}:{value.value}" for value in expected if not value_matches(value, cells, resolver)]
+    return {
+        "correct": bool(cells) and not missing,
+        "matched": len(expected) - len(missing),
+        "expected": len(expected),
+        "missing": missing,
+    }
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    """
+    Đọc kết quả đã thực thi (file JSON của DJIAQueryRunner hoặc file checkpoint JSONL).
+
+    Args:
+        path (str): Đường dẫn file
+    Returns:
+        List[Dict[str, Any]]: Các câu hỏi kèm query_result
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            by_number = {}
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    by_number[entry["number"]] = entry
+            return [by_number[number] for number in sorted(by_number)]
+        return json.load(f)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def evaluate(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Chấm lại toàn bộ kết quả đã lưu (không cần gọi LLM hay cơ sở dữ liệu).
+
+    Args:
+        items (List[Dict[str, Any]]): Các câu hỏi kèm answer và query_result
+    Returns:
+        Dict[str, Any]: Độ chính xác tổng, theo type, theo complexity, độ trễ và chi tiết từng câu
+    """
+    groups = {"type": defaultdict(list), "complexity": defaultdict(list)}
+    details, latencies, errors = [], [], 0
+    for item in items:
+        result = item.get("query_result") or {}
+        if "answer" not in item or not result:
+            continue
+        if "error" in result:
+            errors += 1
+            score = {"correct": False, "matched": 0, "expected": len(parse_expected(item["answer"])), "missing": []}
+        else:
+            score = score_answer(result.get("results", []), item["answer"])
+            if result.get("execution_time") is not None:
+                latencies.append(result["execution_time"])
+        details.append({"number": item.get("number"), "question": item["question"], **score})
+        for key in groups:
+            groups[key][item.get(key, "unknown")].append(score["correct"])
+
+    def accuracy(flags):
+        return round(sum(flags) / len(flags), 3) if flags else 0.0
+
+    all_flags = [d["correct"] for d in details]
+    return {
+        "total": len(details),
+        "correct": sum(all_flags),
+        "errors": errors,
+        "accuracy": accuracy(all_flags),
+        "by_type": {k: {"total": len(v), "accuracy": accuracy(v)} for k, v in sorted(groups["type"].items())},
+        "by_complexity": {k: {"total": len(v), "accuracy": accuracy(v)} for k, v in sorted(groups["complexity"].items())},
+        "latency": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+        },
+        "details": details,
+    }
+
+
+if __name__ == "__main__":
+    # Chấm lại kết quả đã lưu: python -m src.agent.evaluation data/djia_qna_results.json
+    report = evaluate(load_results(sys.argv[1] if len(sys.argv) > 1 else "data/djia_qna_results.json"))
+    print(f"Độ chính xác: {report['correct']}/{report['total']} ({report['accuracy']:.1%}), lỗi: {report['errors']}")
+    for key in ("by_type", "by_complexity"):
+        for name, stats in report[key].items():
+            print(f"  {key[3:]}={name}: {stats['accuracy']:.1%} ({stats['total']} câu)")
+    print(f"Độ trễ: trung bình {report['latency']['mean']}s, p50 {report['latency']['p50']}s, p95 {report['latency']['p95']}s")
@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from src.router.routing_cache import HashedTextEmbedder
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+class SQLExampleStore:
+    """
+    Kho các cặp câu hỏi/SQL đã được kiểm chứng, dùng làm ví dụ few-shot khi sinh query.
+
+    Các cặp được lưu trong một file JSONL (mỗi dòng một cặp) và được đánh chỉ mục bằng
+    vector n-gram ký tự băm trong bộ nhớ. Cặp mới được ghi nối vào file và thêm vào
+    chỉ mục ngay lập tức, không cần xây dựng lại.
+    """
+
+    def __init__(self, path: Optional[str] = None, embedder=None, min_similarity: float = 0.3,
+                 max_similarity: float = 0.99):
+        """
+        Args:
+            path (Optional[str]): File JSONL lưu các cặp (None = chỉ giữ trong bộ nhớ)
+            embedder: Đối tượng có phương thức create_embedding (mặc định HashedTextEmbedder)
+            min_similarity (float): Độ tương đồng cosine tối thiểu để một cặp được dùng làm ví dụ
+            max_similarity (float): Cặp có độ tương đồng từ ngưỡng này trở lên được coi là chính câu
+                hỏi đang hỏi và không được dùng làm ví dụ (tránh lộ đáp án khi chạy bộ câu hỏi đánh giá)
+        """
+        self.path = path
+        self.embedder = embedder or HashedTextEmbedder()
+        self.min_similarity = min_similarity
+        self.max_similarity = max_similarity
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, self.embedder.dimensions), dtype=np.float32)
+        self._examples: List[Dict[str, str]] = []
+        self._index: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self._insert(entry["question"], entry["sql"])
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    @staticmethod
+    def _key(question: str) -> str:
+        """Câu hỏi đã chuẩn hóa (chữ thường, bỏ dấu câu, gộp khoảng trắng)."""
+        return " ".join(_PUNCTUATION.sub(" ", question.lower()).split())
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.create_embedding(question), dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _insert(self, question: str, sql: str) -> bool:
+        """Thêm hoặc cập nhật một cặp trong chỉ mục (không ghi file). Trả về True nếu là cặp mới."""
+        vector = self._embed(question)
+        with self._lock:
+            key = self._key(question)
+            if key in self._index:
+                self._examples[self._index[key]]["sql"] = sql
+                return False
+            # Tăng gấp đôi dung lượng ma trận khi đầy để việc thêm có chi phí khấu hao O(1)
+            if len(self._examples) == len(self._matrix):
+                grown = np.zeros((max(2 * len(self._matrix), 64), self._matrix.shape[1]), dtype=np.float32)
+                grown[:len(self._matrix)] = self._matrix
+                self._matrix = grown
+            self._matrix[len(self._examples)] = vector
+            self._index[key] = len(self._examples)
+            self._examples.append({"question": question, "sql": sql})
+            return True
+
+    def add(self, question: str, sql: str):
+        """
+        Thêm một cặp câu hỏi/SQL đã kiểm chứng (ghi nối vào file nếu là cặp mới).
+
+        Args:
+            question (str): Câu hỏi
+            sql (str): Câu query SQL cho kết quả đúng
+        """
+        if self._insert(question, sql) and self.path:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"question": question, "sql": sql}, ensure_ascii=False) + "\n")
+
+    def load_verified_results(self, results_path: str) -> int:
+        """
+        Nạp các cặp đã kiểm chứng từ file kết quả của DJIAQueryRunner (matches_expected = true).
+
+        Chỉ dùng file kết quả của một bộ câu hỏi huấn luyện riêng, không dùng kết quả của bộ
+        câu hỏi đánh giá (djia_qna_results.json) để ví dụ không chứa sẵn đáp án.
+
+        Args:
+            results_path (str): Đường dẫn tới file kết quả (định dạng của DJIAQueryRunner)
+        Returns:
+            int: Số cặp mới được thêm
+        """
+        with open(results_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        added = 0
+        for item in data:
+            result = item.get("query_result") or {}
+            if result.get("matches_expected") and result.get("sql_query"):
+                before = len(self)
+                self.add(item["question"], result["sql_query"])
+                added += len(self) - before
+        return added
+
+    def search(self, question: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Tìm các cặp có câu hỏi gần nhất (bỏ qua cặp trùng hoặc gần như trùng với chính câu hỏi).
+
+        Args:
+            question (str): Câu hỏi của người dùng
+            k (int): Số cặp tối đa
+        Returns:
+            List[Dict[str, Any]]: Các cặp {"question", "sql", "similarity"} theo độ tương đồng giảm dần
+        """
+        if not self._examples or k <= 0:
+            return []
+        vector = self._embed(question)
+        key = self._key(question)
+        with self._lock:
+            size = len(self._examples)
+            similarities = self._matrix[:size] @ vector
+            examples = []
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.min_similarity or len(examples) == k:
+                    break
+                if similarities[i] >= self.max_similarity or self._key(self._examples[i]["question"]) == key:
+                    continue
+                examples.append({**self._examples[i], "similarity": float(similarities[i])})
+            return examples
+
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    """
+    Hiển thị các cặp ví dụ để đưa vào prompt sinh SQL.
+
+    Args:
+        examples (List[Dict[str, Any]]): Các cặp từ SQLExampleStore.search
+    Returns:
+        str: Đoạn ví dụ (chuỗi rỗng nếu không có ví dụ)
+    """
+    if not examples:
+        return ""
+    blocks = [f"Câu hỏi: {example['question']}\nSQL: {example['sql']}" for example in examples]
+    return "Một số ví dụ đã được kiểm chứng:\n\n" + "\n\n".join(blocks) + "\n"
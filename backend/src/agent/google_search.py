@@ -5,6 +5,10 @@ from dotenv import load_dotenv
 import time
 from datetime import datetime
 
+from src.utils.cassette import wrap_search
+from src.utils.tracing import span
+from src.utils.metrics import RETRIES_TOTAL
+
 class GoogleSearchAgent:
     def __init__(self, api_key=None, max_retries=3, max_results=3):
         """Khởi tạo agent tìm kiếm trên web.
@@ -18,11 +22,11 @@ class GoogleSearchAgent:
         
         self.tavily_api_key = api_key or os.getenv("TAVILY_API_KEY")
         
-        self.search = TavilySearch(
+        self.search = wrap_search(TavilySearch(
             api_key=self.tavily_api_key,
             max_results=max_results,
             search_depth="advanced"
-        )
+        ))
         
         self.max_retries = max_retries
         self.max_results = max_results
@@ -33,7 +37,8 @@ class GoogleSearchAgent:
         while retries < self.max_retries:
             try:
 
-                search_response = self.search.invoke(query)
+                with span("search", query=query, attempt=retries + 1):
+                    search_response = self.search.invoke(query)
                 if isinstance(search_response, dict):
                     search_results = search_response.get('results', [])
                 elif isinstance(search_response, list):
@@ -85,6 +90,7 @@ class GoogleSearchAgent:
             
             except Exception as e:
                 retries += 1
+                RETRIES_TOTAL.inc(component="search")
                 print(f"Lỗi (thử lại {retries}/{self.max_retries}): {str(e)}")
                 if retries == self.max_retries:
                     return {
@@ -3,7 +3,13 @@ import os
 import time
 import decimal
 import datetime
-from database_query import DatabaseQueryAgent
+import threading
+import concurrent.futures
+from src.agent.database_query import DatabaseQueryAgent
+from src.agent.example_store import SQLExampleStore
+from src.agent.evaluation import score_answer
+from src.utils.cassette import get_cassette
+from src.utils.usage import track_usage
 
 # Định nghĩa class JSONEncoder tùy chỉnh để xử lý các kiểu dữ liệu đặc biệt
 class CustomJSONEncoder(json.JSONEncoder):
@@ -36,10 +42,17 @@ class DJIAQueryRunner:
         json_file_path (str): Đường dẫn đến file JSON chứa các câu hỏi
         db_config (dict): Thông tin cấu hình kết nối database
         output_file_path (str): Đường dẫn để lưu kết quả (mặc định là file gốc)
+        checkpoint_path (str): File JSONL ghi nối kết quả của từng câu hỏi khi chạy song song
+            (mặc định: output_file_path với đuôi .checkpoint.jsonl)
+
+    db_config có thể chứa 'examples_path' (file JSONL của kho ví dụ SQL) để các câu query
+    cho kết quả đúng được thêm vào kho ví dụ few-shot.
     """
-    def __init__(self, json_file_path, db_config, output_file_path=None):
+    def __init__(self, json_file_path, db_config, output_file_path=None, checkpoint_path=None):
         self.json_file_path = json_file_path
         self.output_file_path = output_file_path or json_file_path
+        self.checkpoint_path = checkpoint_path or os.path.splitext(self.output_file_path)[0] + '.checkpoint.jsonl'
+        self._checkpoint_lock = threading.Lock()
         self.db_config = db_config
         self.agent = DatabaseQueryAgent(
             host=db_config['host'],
@@ -48,7 +61,8 @@ class DJIAQueryRunner:
             user=db_config['user'],
             password=db_config['password'],
             model_name=db_config.get('model_name', 'gpt-4o-mini'),
-            max_retries=db_config.get('max_retries', 3)
+            max_retries=db_config.get('max_retries', 3),
+            example_store=SQLExampleStore(db_config['examples_path']) if db_config.get('examples_path') else None
         )
         
     def load_questions(self):
@@ -94,7 +108,8 @@ class DJIAQueryRunner:
         
         try:
             start_time = time.time()
-            result = self.agent.query_with_retry(question)
+            with track_usage() as usage:
+                result = self.agent.query_with_retry(question)
             end_time = time.time()
             
             # Thêm kết quả truy vấn vào dữ liệu câu hỏi
@@ -102,7 +117,9 @@ class DJIAQueryRunner:
                 'sql_query': result['query'],
                 'columns': result['columns'],
                 'results': result['results'],
-                'execution_time': round(end_time - start_time, 2)
+                'execution_time': round(end_time - start_time, 2),
+                # Token và chi phí LLM của câu hỏi (để đo hiệu quả của việc rút gọn prompt)
+                'usage': usage.summary()['total']
             }
             
             # So sánh kết quả với câu trả lời gốc nếu có
@@ -110,6 +127,11 @@ class DJIAQueryRunner:
                 question_data['query_result']['matches_expected'] = self._compare_results(
                     result['results'], question_data['answer']
                 )
+                # Cặp câu hỏi/SQL cho kết quả đúng được thêm vào kho ví dụ few-shot (chỉ khi chạy
+                # bộ câu hỏi huấn luyện, nếu không các lần đánh giá sau sẽ thấy sẵn đáp án)
+                if (question_data['query_result']['matches_expected'] and self.db_config.get('record_examples')
+                        and self.agent.example_store is not None):
+                    self.agent.example_store.add(question, result['query'])
                 
             # Thêm câu trả lời được rút ra từ kết quả truy vấn
             question_data['query_result']['extracted_answer'] = self._extract_answer_from_results(result['results'])
@@ -129,7 +151,10 @@ class DJIAQueryRunner:
     def _compare_results(self, results, expected_answer):
         """
         So sánh kết quả truy vấn với câu trả lời gốc.
-        Phương thức này có thể được mở rộng để xử lý so sánh phức tạp hơn.
+        
+        Các giá trị trong câu trả lời gốc (tiền tệ, số cổ phiếu, phần trăm, ngày, tên công ty)
+        được tìm trong mọi ô của kết quả với sai số theo từng loại giá trị
+        (xem src/agent/evaluation.py).
         
         Args:
             results (list): Kết quả từ truy vấn SQL
@@ -138,20 +163,7 @@ class DJIAQueryRunner:
         Returns:
             bool: True nếu kết quả khớp với câu trả lời mong đợi
         """
-        # Đây là một phương pháp so sánh đơn giản
-        # Có thể cần phát triển thuật toán phức tạp hơn tùy theo định dạng dữ liệu
-        if not results:
-            return False
-            
-        # Chuyển đổi kết quả sang chuỗi để so sánh
-        result_str = str(results[0])
-        
-        # Xóa các ký tự không cần thiết để so sánh
-        expected_clean = expected_answer.replace('$', '').replace(',', '').lower()
-        result_clean = result_str.replace('$', '').replace(',', '').lower()
-        
-        # Kiểm tra nếu kết quả mong đợi có trong kết quả truy vấn
-        return expected_clean in result_clean
+        return score_answer(results, expected_answer)['correct']
         
     def _extract_answer_from_results(self, results):
         """
@@ -219,6 +231,109 @@ class DJIAQueryRunner:
             
         return data
         
+    def load_checkpoint(self):
+        """
+        Đọc các kết quả đã ghi trong file checkpoint.
+        
+        Returns:
+            dict: Kết quả theo số thứ tự câu hỏi (kết quả ghi sau cùng được giữ lại)
+        """
+        completed = {}
+        if not os.path.exists(self.checkpoint_path):
+            return completed
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối có thể bị ghi dở nếu tiến trình bị dừng đột ngột
+                    continue
+                completed[entry['number']] = entry
+        return completed
+    
+    def append_checkpoint(self, question_data):
+        """
+        Ghi nối kết quả của một câu hỏi vào file checkpoint.
+        
+        Args:
+            question_data (dict): Dữ liệu câu hỏi đã có kết quả truy vấn
+        """
+        line = json.dumps(question_data, ensure_ascii=False, cls=CustomJSONEncoder)
+        with self._checkpoint_lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+    
+    def run_parallel(self, workers=4, start_index=0, limit=None, retry_failed=True, resume=True):
+        """
+        Thực hiện các truy vấn song song, ghi nối từng kết quả vào file checkpoint.
+        
+        Các câu hỏi đã có kết quả trong checkpoint được bỏ qua, nên chạy lại sau khi bị
+        dừng sẽ tự tiếp tục từ chỗ cũ. Khi hoàn tất, kết quả được ghi vào output_file_path
+        một lần duy nhất.
+        
+        Args:
+            workers (int): Số câu hỏi được xử lý đồng thời
+            start_index (int): Chỉ số bắt đầu
+            limit (int): Số lượng câu hỏi tối đa cần xử lý
+            retry_failed (bool): Chạy lại các câu hỏi bị lỗi trong lần chạy trước
+            resume (bool): Tiếp tục từ checkpoint; nếu False thì xóa checkpoint cũ và chạy lại từ đầu
+            
+        Returns:
+            list: Danh sách các câu hỏi đã được bổ sung kết quả
+        """
+        data = self.load_questions()
+        end_index = len(data) if limit is None else min(start_index + limit, len(data))
+        if not resume and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        completed = self.load_checkpoint()
+        
+        def is_done(number):
+            entry = completed.get(number)
+            if entry is None:
+                return False
+            return not (retry_failed and 'error' in entry.get('query_result', {}))
+        
+        pending = [q for q in data[start_index:end_index] if not is_done(q['number'])]
+        print(f"Bắt đầu xử lý {len(pending)} câu hỏi với {workers} luồng "
+              f"({end_index - start_index - len(pending)} câu đã có trong checkpoint)")
+        
+        latencies = []
+        tokens = {'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+        start_time = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.run_single_query, dict(q)): q['number'] for q in pending}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                self.append_checkpoint(result)
+                completed[result['number']] = result
+                latency = result['query_result'].get('execution_time')
+                if latency is not None:
+                    latencies.append(latency)
+                for key in tokens:
+                    tokens[key] += result['query_result'].get('usage', {}).get(key, 0)
+                print(f"[{done}/{len(pending)}] Câu hỏi {result['number']}: "
+                      f"{latency if latency is not None else 'lỗi'} giây")
+        elapsed = time.time() - start_time
+        
+        if pending:
+            latencies.sort()
+            summary = f"Đã xử lý {len(pending)} câu hỏi trong {elapsed:.1f} giây ({len(pending) / elapsed:.2f} câu/giây)"
+            if latencies:
+                summary += (f", độ trễ p50={latencies[len(latencies) // 2]:.2f}s, "
+                            f"p95={latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s")
+            summary += (f", token prompt={tokens['prompt_tokens']} "
+                        f"(trung bình {tokens['prompt_tokens'] / len(pending):.0f}/câu), "
+                        f"completion={tokens['completion_tokens']}, chi phí ~${tokens['cost_usd']:.4f}")
+            print(summary)
+        
+        data = [completed.get(q['number'], q) for q in data]
+        self.save_results(data)
+        return data
+    
     def run_filtered_queries(self, filter_func, save_after_each=True):
         """
         Thực hiện các truy vấn được lọc bởi hàm filter.
@@ -258,7 +373,11 @@ if __name__ == "__main__":
         'user': 'postgres',
         'password': 'postgres',
         'model_name': 'gpt-4o-mini',
-        'max_retries': 3
+        'max_retries': 3,
+        # Kho ví dụ few-shot (tắt khi đánh giá); record_examples=True để bổ sung các cặp cho kết quả
+        # đúng vào kho, chỉ dùng với bộ câu hỏi huấn luyện
+        'examples_path': os.getenv('SQL_EXAMPLES_PATH') or None,
+        'record_examples': False
     }
     
     # Đường dẫn đến file JSON
@@ -276,11 +395,18 @@ if __name__ == "__main__":
         output_file_path=output_file_path  # Nếu muốn lưu vào file gốc, bỏ dòng này
     )
     
-    # Chạy tất cả 100 câu hỏi
+    # Chạy tất cả 100 câu hỏi song song (tự tiếp tục từ checkpoint nếu lần chạy trước bị dừng)
     print("Bắt đầu xử lý tất cả 100 câu hỏi...")
-    runner.run_all_queries(save_after_each=True)
+    runner.run_parallel(workers=int(os.getenv("DJIA_RUNNER_WORKERS", "4")))
+    
+    # Chạy lại không cần mạng: CASSETTE_MODE=record lần đầu, sau đó CASSETTE_MODE=replay
+    if get_cassette():
+        print(f"Cassette: {get_cassette().stats()}")
     
     # Các tùy chọn khác (đã bị comment out)
+    # Chạy tuần tự từng câu hỏi
+    # runner.run_all_queries(save_after_each=True)
+    
     # Chạy một số câu hỏi đầu tiên
     # runner.run_all_queries(start_index=0, limit=5)
     
@@ -0,0 +1,47 @@
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+
+# Các câu lệnh được phép chạy trên dữ liệu người dùng (chỉ đọc)
+_READONLY_ROOTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+# exp.Into: SELECT ... INTO tạo bảng mới dù gốc của câu lệnh là SELECT
+_WRITE_NODES = (exp.Insert, exp.Update, exp.Delete, exp.Create, exp.Drop, exp.Alter, exp.Command, exp.Into)
+
+
+def clean_sql(raw_query: str) -> str:
+    """
+    Loại bỏ markdown code fence (```sql ... ```) khỏi câu query do LLM sinh ra.
+
+    Args:
+        raw_query (str): Đầu ra thô từ LLM
+    Returns:
+        str: Câu query SQL
+    """
+    return raw_query.replace('```sql', '').replace('```', '').strip()
+
+
+def validate_readonly_sql(query: str, dialect: str = "postgres") -> Optional[str]:
+    """
+    Kiểm tra câu query là một câu lệnh SELECT hợp lệ (cú pháp đúng, chỉ đọc).
+
+    Args:
+        query (str): Câu query SQL
+        dialect (str): Phương ngữ SQL dùng để phân tích
+    Returns:
+        Optional[str]: Thông báo lỗi, hoặc None nếu câu query hợp lệ
+    """
+    if not query or not query.strip():
+        return "Câu query rỗng"
+    try:
+        statements = [s for s in sqlglot.parse(query, read=dialect) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        return f"Lỗi cú pháp SQL: {e}"
+    if len(statements) != 1:
+        return f"Cần đúng một câu lệnh SQL, nhận được {len(statements)}"
+    statement = statements[0]
+    if not isinstance(statement, _READONLY_ROOTS):
+        return f"Chỉ cho phép câu lệnh SELECT, nhận được {statement.key.upper()}"
+    if statement.find(*_WRITE_NODES):
+        return "Câu query chứa lệnh ghi dữ liệu"
+    return None
@@ -9,7 +9,6 @@ import decimal
 import asyncio
 import concurrent.futures
 from typing import Dict, List, Tuple, Any, Optional
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from datetime import datetime
@@ -19,12 +18,21 @@ import json
 import re  # Đảm bảo re được import ở cấp độ module
 
 from .database_query import DatabaseQueryAgent
+from src.utils.llm import create_chat_model
+from src.utils.tracing import span, traced
+from src.utils.usage import timed_llm_call
+from .charts.downsample import downsample_frame, target_points_for_width
+from .charts.inference import infer_chart_spec
+from .charts.labels import place_labels
+from .charts.shaping import shape_frame, explode_array_column, bucket_dates, coerce_numeric, to_long, to_wide
 # from database_query import DatabaseQueryAgent
 
 class VisualizeAgent:
     def __init__(self, host="localhost", port="5432", dbname="postgres", 
                  user="postgres", password="postgres", model_name="gpt-4o-mini", 
-                 max_retries=3, save_dir="./visualizations"):
+                 max_retries=3, save_dir="./visualizations", max_plot_points=None,
+                 downsample_method="lttb", chart_confidence_threshold=0.75,
+                 label_time_budget=0.2):
         """
         Khởi tạo agent trực quan hóa dữ liệu từ PostgreSQL.
         
@@ -37,19 +45,26 @@ class VisualizeAgent:
             model_name (str): Tên mô hình LLM (mặc định: gpt-4o-mini)
             max_retries (int): Số lần thử lại tối đa khi query lỗi
             save_dir (str): Thư mục lưu biểu đồ
+            max_plot_points (int, optional): Số điểm tối đa cho mỗi đường trên biểu đồ line/scatter.
+                Mặc định tính theo chiều rộng figure (một điểm cho mỗi pixel ngang)
+            downsample_method (str): Thuật toán giảm mẫu, "lttb" hoặc "minmax"
+            chart_confidence_threshold (float): Ngưỡng tin cậy của bộ suy luận theo luật;
+                dưới ngưỡng này mới gọi LLM để đề xuất biểu đồ
+            label_time_budget (float): Thời gian tối đa (giây) để bố trí nhãn trên biểu đồ scatter
         """
         self.db_agent = DatabaseQueryAgent(host, port, dbname, user, password, model_name, max_retries)
         self.save_dir = save_dir
+        self.max_plot_points = max_plot_points
+        self.downsample_method = downsample_method
+        self.chart_confidence_threshold = chart_confidence_threshold
+        self.label_time_budget = label_time_budget
         
         # Tạo thư mục lưu biểu đồ nếu chưa tồn tại
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
             
         # Khởi tạo LLM để phân tích và đề xuất loại biểu đồ
-        self.llm = ChatOpenAI(
-            model_name=model_name,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self.llm = create_chat_model(model_name)
         
         # Template cho việc phân tích dữ liệu và đề xuất loại biểu đồ
         self.viz_prompt_template = PromptTemplate(
@@ -93,6 +108,16 @@ class VisualizeAgent:
             Dict[str, str]: Thông tin về loại biểu đồ đề xuất
         """
         import re  # Đảm bảo import re trong phạm vi này
+        # Suy luận theo luật (kiểu dữ liệu, số giá trị phân biệt, từ khóa) trước khi gọi LLM
+        try:
+            rule_spec = infer_chart_spec(question, pd.DataFrame(results, columns=columns))
+            if rule_spec["confidence"] >= self.chart_confidence_threshold:
+                print(f"Sử dụng cấu hình biểu đồ suy luận theo luật (confidence={rule_spec['confidence']}): {rule_spec['chart_type']}")
+                return rule_spec
+            print(f"Độ tin cậy suy luận theo luật thấp ({rule_spec['confidence']}), chuyển sang LLM")
+        except Exception as e:
+            print(f"Lỗi khi suy luận biểu đồ theo luật: {e}")
+        
         # Kiểm tra xem người dùng đã chỉ định loại biểu đồ chưa
         chart_types = ["bar", "line", "pie", "scatter", "heatmap", "boxplot", "histogram"]
         specified_chart_type = None
@@ -113,11 +138,14 @@ class VisualizeAgent:
                 
                 # Phân tích dữ liệu
                 # Sử dụng invoke thay vì run với RunnableSequence
-                response = self.viz_chain.invoke({
-                    "question": question,
-                    "columns": columns,
-                    "sample_data": sample_data
-                })
+                with span("llm", component="visualize"), \
+                        timed_llm_call("visualize", self.llm.model_name) as llm_call:
+                    response = self.viz_chain.invoke({
+                        "question": question,
+                        "columns": columns,
+                        "sample_data": sample_data
+                    })
+                    llm_call["response"] = response
                 raw_response = response.content if hasattr(response, 'content') else str(response)
                 
                 # Trích xuất phần JSON từ phản hồi để lấy các thông tin khác
@@ -154,11 +182,14 @@ class VisualizeAgent:
             
             # Phân tích dữ liệu để đề xuất loại biểu đồ
             # Sử dụng invoke thay vì run với RunnableSequence
-            response = self.viz_chain.invoke({
-                "question": question,
-                "columns": columns,
-                "sample_data": sample_data
-            })
+            with span("llm", component="visualize"), \
+                    timed_llm_call("visualize", self.llm.model_name) as llm_call:
+                response = self.viz_chain.invoke({
+                    "question": question,
+                    "columns": columns,
+                    "sample_data": sample_data
+                })
+                llm_call["response"] = response
             raw_response = response.content if hasattr(response, 'content') else str(response)
             
             # Trích xuất phần JSON từ phản hồi
@@ -185,43 +216,66 @@ class VisualizeAgent:
                 "explanation": "Mặc định sử dụng biểu đồ cột do lỗi phân tích"
             }
 
-    def preprocess_data(self, df: pd.DataFrame) -> pd.DataFrame:
+    def preprocess_data(self, df: pd.DataFrame, parse_dates: bool = False) -> pd.DataFrame:
         """
         Tiền xử lý dữ liệu trước khi tạo biểu đồ.
         
+        Mọi loại biểu đồ đều đi qua cùng một chuỗi chuẩn hóa vector hóa
+        (xem src/agent/charts/shaping.py): ép kiểu Decimal/chuỗi số sang float,
+        trải phẳng cột mảng ARRAY_AGG và xử lý giá trị null.
+        
         Args:
             df (pd.DataFrame): DataFrame gốc
+            parse_dates (bool): Chuyển cột ngày sang datetime64
             
         Returns:
             pd.DataFrame: DataFrame đã xử lý
         """
-        # Chuyển đổi các cột sang kiểu dữ liệu phù hợp
+        return shape_frame(df, parse_dates=parse_dates)
+
+    def _find_group_column(self, df: pd.DataFrame, x_column: str, y_columns: List[str]) -> Optional[str]:
+        """
+        Tìm cột phân nhóm (ví dụ symbol) cho dữ liệu dạng dài nhiều mã cổ phiếu.
+
+        Args:
+            df (pd.DataFrame): DataFrame chứa dữ liệu
+            x_column (str): Cột trục x
+            y_columns (List[str]): Các cột trục y
+
+        Returns:
+            Optional[str]: Tên cột phân nhóm hoặc None nếu không có
+        """
         for col in df.columns:
-            # Xử lý các giá trị None/NaN
-            if df[col].isnull().any():
-                print(f"Phát hiện giá trị null trong cột {col}, đang xử lý...")
-                # Với cột số, thay thế None bằng 0 hoặc giá trị trung bình
-                if pd.api.types.is_numeric_dtype(df[col]):
-                    df[col] = df[col].fillna(df[col].mean() if not df[col].isnull().all() else 0)
-                else:
-                    df[col] = df[col].fillna("N/A")
-            
-            # Chuyển đổi các cột chứa decimal.Decimal thành float
-            try:
-                if "decimal" in str(df[col].dtype).lower() or df[col].apply(lambda x: hasattr(x, "as_tuple")).any():
-                    print(f"Chuyển đổi cột {col} từ Decimal sang float")
-                    df[col] = df[col].astype(float)
-            except Exception as e:
-                print(f"Lỗi khi xử lý cột {col}: {str(e)}")
-                # Nếu không thể chuyển đổi, thử cách khác
-                try:
-                    df[col] = df[col].apply(lambda x: float(x) if x is not None else None)
-                    df[col] = df[col].fillna(0)  # Thay thế None bằng 0
-                except:
-                    pass
-                    
-        return df
-    
+            if col == x_column or col in y_columns:
+                continue
+            if pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_datetime64_any_dtype(df[col]):
+                continue
+            if 1 < df[col].nunique() <= 30:
+                return col
+        return None
+
+    def _downsample_for_plot(self, df: pd.DataFrame, x_column: str, y_columns: List[str],
+                             group_column: Optional[str] = None) -> pd.DataFrame:
+        """
+        Giảm số điểm cần vẽ để thời gian render không phụ thuộc vào khoảng thời gian truy vấn.
+
+        Args:
+            df (pd.DataFrame): DataFrame đã tiền xử lý
+            x_column (str): Cột trục x
+            y_columns (List[str]): Các cột trục y
+            group_column (Optional[str]): Cột phân nhóm (mỗi nhóm được giảm mẫu riêng)
+
+        Returns:
+            pd.DataFrame: DataFrame đã giảm mẫu
+        """
+        max_points = self.max_plot_points or target_points_for_width(plt.gcf().get_figwidth())
+        sampled = downsample_frame(df, x_column, y_columns, max_points,
+                                   group_column=group_column, method=self.downsample_method)
+        if len(sampled) < len(df):
+            print(f"Giảm mẫu dữ liệu biểu đồ từ {len(df)} xuống {len(sampled)} điểm ({self.downsample_method})")
+        return sampled
+
+    @traced("chart.render")
     def create_visualization(self, df: pd.DataFrame, chart_info: Dict[str, str], question: str = "") -> plt.Figure:
         """
         Tạo biểu đồ theo loại được đề xuất.
@@ -234,14 +288,15 @@ class VisualizeAgent:
         Returns:
             plt.Figure: Đối tượng biểu đồ đã tạo
         """
-        # Tiền xử lý dữ liệu
-        df = self.preprocess_data(df)
+        chart_type = chart_info.get("chart_type", "bar")
+        
+        # Tiền xử lý dữ liệu (biểu đồ đường/phân tán cần trục thời gian dạng datetime64)
+        df = self.preprocess_data(df, parse_dates=chart_type in ("line", "scatter"))
         
         # Thiết lập style cho biểu đồ
         sns.set_theme(style="whitegrid")
         plt.figure(figsize=(12, 6))
         
-        chart_type = chart_info.get("chart_type", "bar")
         x_column = chart_info.get("x_column", "")
         y_columns = [col.strip() for col in chart_info.get("y_column", "").split(",")]
         title = chart_info.get("title", "Biểu đồ dữ liệu")
@@ -275,18 +330,23 @@ class VisualizeAgent:
                 plt.xlabel(x_column)
                 plt.ylabel(valid_y_columns[0])
             else:
-                df_melted = df.melt(id_vars=[x_column], value_vars=valid_y_columns)
+                df_melted = to_long(df, [x_column], valid_y_columns)
                 ax = sns.barplot(x=x_column, y="value", hue="variable", data=df_melted)
                 plt.xlabel(x_column)
                 plt.ylabel("Giá trị")
                 
         elif chart_type == "line":
+            group_column = self._find_group_column(df, x_column, valid_y_columns)
+            df = self._downsample_for_plot(df, x_column, valid_y_columns, group_column)
             if len(valid_y_columns) == 1:
-                ax = sns.lineplot(x=x_column, y=valid_y_columns[0], data=df, marker="o")
+                # Dữ liệu dạng dài nhiều mã được vẽ mỗi mã một đường; trước đây seaborn gộp
+                # các mã thành một đường trung bình kèm khoảng tin cậy. Mỗi nhóm được giảm mẫu
+                # riêng nên không thể gộp lại theo trục x sau khi giảm mẫu.
+                ax = sns.lineplot(x=x_column, y=valid_y_columns[0], hue=group_column, data=df, marker="o")
                 plt.xlabel(x_column)
                 plt.ylabel(valid_y_columns[0])
             else:
-                df_melted = df.melt(id_vars=[x_column], value_vars=valid_y_columns)
+                df_melted = to_long(df, [x_column], valid_y_columns)
                 ax = sns.lineplot(x=x_column, y="value", hue="variable", data=df_melted, marker="o")
                 plt.xlabel(x_column)
                 plt.ylabel("Giá trị")
@@ -451,46 +511,6 @@ class VisualizeAgent:
                     # Vẽ các điểm với màu gradient và kích thước lớn hơn
                     scatter = plt.scatter(x_data, y_data, c=colors, s=80, alpha=0.8, edgecolors='white', linewidths=0.5)
                     
-                    # Thêm nhãn cho các điểm nếu có cột công ty
-                    if company_col:
-                        # Sắp xếp lại vị trí nhãn để tránh chồng chéo
-                        from adjustText import adjust_text
-                        import re  # Đảm bảo re được import trong phạm vi này
-                        
-                        texts = []
-                        for i, (x, y, label) in enumerate(zip(x_data, y_data, df[company_col])):
-                            # Lấy symbol từ chuỗi nếu là tên dài
-                            symbol = str(label)
-                            if len(symbol) > 5 and '(' in symbol and ')' in symbol:
-                                # Trích xuất mã chứng khoán trong ngoặc
-                                match = re.search(r'\(([A-Z]+)\)', symbol)
-                                if match:
-                                    symbol = match.group(1)
-                            elif len(symbol) > 10:
-                                # Rút gọn tên công ty quá dài
-                                symbol = symbol.split(' ')[0][:5]
-                            
-                            # Giới hạn độ dài nhãn
-                            if len(symbol) > 5:
-                                symbol = symbol[:5]
-                            
-                            # Thêm nhãn vào danh sách để điều chỉnh sau
-                            text = plt.text(x, y, symbol, fontsize=10, weight='bold')
-                            texts.append(text)
-                        
-                        # Cố gắng điều chỉnh vị trí các nhãn để tránh chồng chéo
-                        try:
-                            import importlib
-                            if importlib.util.find_spec("adjustText") is not None:
-                                adjust_text(texts, arrowprops=dict(arrowstyle='->', color='red', alpha=0.5))
-                        except Exception as e:
-                            print(f"Không thể điều chỉnh vị trí nhãn: {e}")
-                            # Nếu không có adjustText, sử dụng phương pháp thay thế
-                            for text in texts:
-                                text.set_ha('center')
-                                text.set_va('bottom')
-                                text.set_y(text.get_position()[1] + 0.5)  # Di chuyển nhãn lên trên một chút
-                    
                     # Thêm tiêu đề, nhãn trục và lưới
                     plt.title('Average Volume vs Average Close (2024)', fontsize=16, weight='bold')
                     plt.xlabel(f'Average {x_column.replace("_", " ").title()} ($)', fontsize=14)
@@ -518,23 +538,40 @@ class VisualizeAgent:
                         if min(y_data) > 0 and min(y_data) < max(y_data) * 0.1:
                             plt.ylim(bottom=0)
                     
+                    # Thêm nhãn cho các điểm nếu có cột công ty (sau khi cố định giới hạn trục)
+                    if company_col:
+                        labels = df[company_col].astype(str)
+                        # Lấy mã chứng khoán trong ngoặc nếu là tên dài, ví dụ "Apple Inc. (AAPL)"
+                        in_parens = labels.str.extract(r'\(([A-Z]+)\)', expand=False)
+                        first_word = labels.str.split(' ').str[0]
+                        symbols = in_parens.where(in_parens.notna() & (labels.str.len() > 5),
+                                                  first_word.where(labels.str.len() > 10, labels))
+                        # Giới hạn độ dài nhãn
+                        symbols = symbols.str[:5]
+                        
+                        # Bố trí nhãn tránh chồng chéo với ngân sách thời gian cố định
+                        place_labels(plt.gca(), x_data, y_data, symbols.tolist(),
+                                     fontsize=10, time_budget=self.label_time_budget, weight='bold')
+                    
                     plt.tight_layout()
                     
                     return plt.gcf()
                     
                 # Sử dụng Seaborn cho các trường hợp khác
+                if pd.api.types.is_numeric_dtype(df[x_column]) or pd.api.types.is_datetime64_any_dtype(df[x_column]):
+                    df = self._downsample_for_plot(df, x_column, valid_y_columns[:1])
                 ax = sns.scatterplot(x=x_column, y=valid_y_columns[0], data=df)
                 plt.xlabel(x_column)
                 plt.ylabel(valid_y_columns[0])
                 
         elif chart_type == "heatmap":
-            # Sử dụng pivot_table thay vì pivot để hiển thị toàn bộ heatmap
-            pivot_df = pd.pivot_table(
-                data=df,
-                index=x_column, 
-                columns=valid_y_columns[0], 
+            # Chuyển sang dạng rộng (pivot_table, gộp trung bình) để hiển thị toàn bộ heatmap
+            pivot_df = to_wide(
+                df,
+                index=x_column,
+                columns=valid_y_columns[0],
                 values=valid_y_columns[1] if len(valid_y_columns) > 1 else df.columns[2],
-                aggfunc='mean'  # Sử dụng hàm trung bình để tổng hợp nhiều giá trị
+                aggfunc='mean'
             )
             
             # Vẽ heatmap đầy đủ
@@ -577,12 +614,9 @@ class VisualizeAgent:
                 # Boxplot với nhiều biến số
                 try:
                     # Chuyển dữ liệu sang định dạng melted cho nhiều biến
-                    df_melted = df.melt(id_vars=[x_column], value_vars=valid_y_columns, 
-                                       var_name='Biến', value_name='Giá trị')
-                    
-                    # Chuyển dữ liệu sang kiểu số
-                    df_melted['Giá trị'] = pd.to_numeric(df_melted['Giá trị'], errors='coerce')
-                    df_melted = df_melted.dropna(subset=['Giá trị'])
+                    # (cột giá trị được ép sang kiểu số và bỏ giá trị không hợp lệ)
+                    df_melted = to_long(df, [x_column], valid_y_columns,
+                                        var_name='Biến', value_name='Giá trị')
                     
                     # Vẽ boxplot với phân nhóm
                     ax = sns.boxplot(x=x_column, y='Giá trị', hue='Biến', data=df_melted)
@@ -600,9 +634,7 @@ class VisualizeAgent:
                     # Thử cách khác nếu cách trên thất bại
                     try:
                         # Chỉ vẽ boxplot cho các biến số, không phân nhóm theo x_column
-                        df_selected = df[valid_y_columns].apply(pd.to_numeric, errors='coerce')
-                        df_melted = df_selected.melt(var_name='Biến', value_name='Giá trị')
-                        df_melted = df_melted.dropna(subset=['Giá trị'])
+                        df_melted = to_long(df, [], valid_y_columns, var_name='Biến', value_name='Giá trị')
                         
                         ax = sns.boxplot(x='Biến', y='Giá trị', data=df_melted)
                         plt.xlabel('Biến')
@@ -620,6 +652,7 @@ class VisualizeAgent:
         
         return plt.gcf()
         
+    @traced("chart.save")
     def save_visualization(self, fig: plt.Figure, filename: Optional[str] = None) -> str:
         """
         Lưu biểu đồ vào file.
@@ -641,6 +674,7 @@ class VisualizeAgent:
         
         return filepath
     
+    @traced("chart.encode")
     def get_visualization_as_base64(self, fig: plt.Figure) -> str:
         """
         Chuyển đổi biểu đồ thành chuỗi base64 để hiển thị trên web.
@@ -742,7 +776,8 @@ class VisualizeAgent:
             filepath = os.path.join(self.save_dir, filename)
             
             # Lưu biểu đồ
-            plt.savefig(filepath, dpi=300, bbox_inches="tight")
+            with span("chart.save"):
+                plt.savefig(filepath, dpi=300, bbox_inches="tight")
             plt.close(fig)
             
             # Chuyển biểu đồ thành base64 để trả về
@@ -768,13 +803,16 @@ class VisualizeAgent:
                 "data": df.to_dict("records")
             }
     
-    def visualize_query_result(self, question: str, max_retries: int = 3) -> Dict[str, Any]:
+    def visualize_query_result(self, question: str, max_retries: int = 3,
+                               query_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Truy vấn cơ sở dữ liệu và tạo biểu đồ trực quan từ kết quả.
         
         Args:
             question (str): Câu hỏi để truy vấn dữ liệu
             max_retries (int): Số lần thử lại tối đa
+            query_result (Optional[Dict[str, Any]]): Kết quả truy vấn đã có (query, columns, results).
+                Nếu được truyền vào, lần thử đầu tiên dùng lại kết quả này thay vì truy vấn lại
             
         Returns:
             Dict[str, Any]: Kết quả bao gồm query, dữ liệu và đường dẫn đến biểu đồ
@@ -784,8 +822,9 @@ class VisualizeAgent:
         
         while retries < max_retries:
             try:
-                # Truy vấn cơ sở dữ liệu
-                query_result = self.db_agent.query_with_retry(question)
+                # Truy vấn cơ sở dữ liệu (dùng lại kết quả có sẵn ở lần thử đầu tiên)
+                if query_result is None or retries > 0:
+                    query_result = self.db_agent.query_with_retry(question)
                 
                 # Chuyển kết quả thành DataFrame
                 df = pd.DataFrame(query_result["results"])
@@ -821,11 +860,8 @@ class VisualizeAgent:
                             date_col = next((col for col in df.columns if any(dc in col.lower() for dc in date_cols)), None)
                             
                             if date_col:
-                                if not pd.api.types.is_datetime64_dtype(df[date_col]):
-                                    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-                                
-                                # Tạo cột tháng từ cột ngày
-                                df['month'] = df[date_col].dt.strftime('%Y-%m')
+                                # Tạo cột tháng từ cột ngày (vector hóa)
+                                df = bucket_dates(df, date_col, "month")
                                 month_col = 'month'
                             else:
                                 # Không tìm thấy cột ngày phù hợp
@@ -841,53 +877,13 @@ class VisualizeAgent:
                                 # Không tìm thấy cột giá phù hợp
                                 price_col = df.columns[1]  # Sử dụng cột thứ hai
                         
-                        # Nếu cột giá đang ở dạng mảng PostgreSQL (do dùng ARRAY_AGG)
+                        # Nếu cột giá đang ở dạng mảng PostgreSQL (do dùng ARRAY_AGG):
+                        # list các Decimal hoặc chuỗi "{89.9,92.64}", trải phẳng thành mỗi hàng một giá
                         if price_col == 'closing_prices':
-                            print(f"Kiểm tra kiểu dữ liệu của closing_prices: {type(df[price_col].iloc[0])}, giá trị: {df[price_col].iloc[0]}")
-                            
                             try:
-                                # Xử lý trực tiếp danh sách các đối tượng Decimal
-                                if isinstance(df[price_col].iloc[0], list):
-                                    print("Phát hiện dữ liệu dạng danh sách, đang xử lý...")
-                                    
-                                    # Chuyển đổi dữ liệu sang dạng thích hợp cho boxplot
-                                    new_rows = []
-                                    for idx, row in df.iterrows():
-                                        month_value = row['month']
-                                        prices_list = row[price_col]
-                                        
-                                        if not isinstance(prices_list, list):
-                                            continue
-                                            
-                                        # Chuyển Decimal sang float và tạo hàng mới
-                                        for price in prices_list:
-                                            try:
-                                                price_float = float(price)
-                                                new_rows.append({'month': month_value, 'price': price_float})
-                                            except:
-                                                pass
-                                    
-                                    # Tạo DataFrame mới với các hàng mở rộng
-                                    if new_rows:
-                                        df = pd.DataFrame(new_rows)
-                                        month_col = 'month'
-                                        price_col = 'price'
-                                        print(f"DataFrame mới sau khi xử lý danh sách: {len(df)} hàng")
-                                        print(df.head())
-                                    else:
-                                        print("Không thể chuyển đổi danh sách thành DataFrame")
-                                
-                                # Xử lý chuỗi đại diện cho mảng PostgreSQL (dự phòng)
-                                elif isinstance(df[price_col].iloc[0], str) and '{' in df[price_col].iloc[0]:
-                                    print("Xử lý dữ liệu dạng chuỗi mảng PostgreSQL")
-                                    
-                                    # Xử lý mảng dạng chuỗi "{89.9,92.64}"
-                                    df['price_value'] = df[price_col].apply(lambda x: 
-                                        pd.to_numeric(
-                                            # Tách giá trị từ chuỗi mảng PostgreSQL "{89.9,92.64}"
-                                            str(x).replace('{', '').replace('}', '').split(',')[0],
-                                            errors='coerce'))
-                                    price_col = 'price_value'
+                                df = explode_array_column(df[[month_col, price_col]], price_col, value_name='price')
+                                price_col = 'price'
+                                print(f"DataFrame mới sau khi trải phẳng mảng: {len(df)} hàng")
                             except Exception as e:
                                 print(f"Lỗi khi xử lý mảng PostgreSQL: {e}")
                         
@@ -927,7 +923,7 @@ class VisualizeAgent:
                         
                         # Chuyển giá thành số
                         if price_col:
-                            df[price_col] = pd.to_numeric(df[price_col], errors='coerce')
+                            df[price_col] = coerce_numeric(df[price_col])
                         
                         print(f"Dữ liệu đã xử lý thành công, cột month_col={month_col}, price_col={price_col}")
                         print(f"Mẫu dữ liệu đầu tiên:\n{df.head().to_string()}")
@@ -938,8 +934,7 @@ class VisualizeAgent:
                             month_col = 'month_str'
                             print(f"Chuyển đổi cột month thành chuỗi: {df['month_str'].unique()}")
                         
-                        # Đảm bảo giá trị price_col là số
-                        df[price_col] = pd.to_numeric(df[price_col], errors='coerce')
+                        # Bỏ các hàng không có giá hợp lệ
                         df = df.dropna(subset=[price_col])
                         print(f"Dữ liệu sau khi lọc NA: {len(df)} hàng")
                         
@@ -1034,12 +1029,7 @@ class VisualizeAgent:
                             print(f"Kiểu dữ liệu daily_return: {df['daily_return'].dtype}")
                             
                             # Xử lý các giá trị đặc biệt
-                            df['daily_return'] = df['daily_return'].apply(lambda x: 
-                                float(x) if isinstance(x, (int, float, decimal.Decimal)) 
-                                else (0 if x is None or x == 'N/A' or str(x).strip() == '' 
-                                    else float(str(x).replace('%', '').strip()) 
-                                        if isinstance(x, str) and str(x).strip() != 'N/A' 
-                                        else 0))
+                            df['daily_return'] = coerce_numeric(df['daily_return']).fillna(0)
                             
                             # Loại bỏ outliers nếu có
                             q1 = df['daily_return'].quantile(0.01)
@@ -1054,7 +1044,7 @@ class VisualizeAgent:
                             price_col = price_columns[0] if price_columns else [col for col in df.columns if col != 'date' and pd.api.types.is_numeric_dtype(df[col])][0]
                             
                             # Chuyển các giá trị không phải số thành float
-                            df[price_col] = df[price_col].apply(lambda x: float(x) if isinstance(x, (int, float, decimal.Decimal)) else (0 if x is None else float(x)))
+                            df[price_col] = coerce_numeric(df[price_col]).fillna(0)
                             
                             # Sắp xếp dữ liệu theo ngày
                             if pd.api.types.is_datetime64_dtype(df['date']):
@@ -0,0 +1,337 @@
+import os
+import re
+import json
+import time
+import zlib
+import threading
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+from ..agent.conversation import GREETINGS, COMMON_QUESTIONS
+from ..agent.charts.inference import match_chart_keyword
+from ..agent.companies import EntityResolver
+
+logger = logging.getLogger(__name__)
+
+AGENT_NAMES = ["database_query", "google_search", "visualize", "conversation"]
+
+# Từ khóa chỉ cột dữ liệu giá và thông tin công ty có trong cơ sở dữ liệu (đủ để chọn database_query)
+DATABASE_KEYWORDS = [
+    "stock price", "stock prices", "share price", "share prices", "closing price", "closing prices",
+    "close price", "opening price", "giá cổ phiếu", "giá đóng cửa", "giá mở cửa", "market cap",
+    "market capitalization", "vốn hóa", "dividend", "dividends", "dividend yield", "cổ tức",
+    "pe ratio", "p/e", "trading volume", "daily return", "djia", "dow jones",
+]
+
+# Từ khóa chung chỉ được tính khi câu hỏi đã nhắc đến một công ty hoặc một cột dữ liệu ở trên
+# ("highest mountain", "average inflation", "tech industry" không phải câu hỏi về cơ sở dữ liệu)
+DATABASE_MODIFIERS = [
+    "volume", "khối lượng", "average", "trung bình", "highest", "lowest", "cao nhất", "thấp nhất",
+    "sector", "ngành", "industry", "company", "companies", "công ty", "employees", "nhân viên",
+    "headquarters", "trụ sở", "volatility", "biến động",
+]
+
+# Từ khóa yêu cầu thông tin mới nhất từ internet
+SEARCH_KEYWORDS = [
+    "news", "tin tức", "latest", "mới nhất", "today", "hôm nay", "google", "tìm kiếm",
+    "search", "recent", "recently", "gần đây", "right now", "announcement", "thông báo",
+]
+
+# Từ khóa chung về trực quan hóa (bổ sung cho từ khóa loại biểu đồ)
+VISUALIZE_KEYWORDS = [
+    "chart", "plot", "graph", "visualize", "visualise", "visualization", "biểu đồ",
+    "đồ thị", "trực quan", "vẽ",
+]
+
+# Số từ tối đa để một tin nhắn chỉ có lời chào được coi là lời chào
+MAX_GREETING_WORDS = 8
+
+# Điểm của luật: cột dữ liệu, công ty được nhắc đến, từ khóa chung (khi đã có một trong hai)
+DATABASE_KEYWORD_SCORE = 2.0
+DATABASE_ENTITY_SCORE = 1.5
+DATABASE_MODIFIER_SCORE = 0.5
+SEARCH_KEYWORD_SCORE = 2.0
+
+# Điểm giả của "không rõ" cộng vào mẫu số khi tính độ chắc chắn của luật: một tín hiệu
+# yếu (điểm 1.5) chỉ cho margin 0.43, dưới ROUTER_LOCAL_MARGIN mặc định (0.5)
+RULE_PRIOR = 2.0
+
+
+def _compile(keywords: Sequence[str]) -> re.Pattern:
+    """Tạo regex so khớp bất kỳ từ khóa nào theo ranh giới từ."""
+    alternatives = "|".join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)")
+
+
+_GREETING_PATTERN = _compile(GREETINGS)
+_HELP_PATTERN = _compile(COMMON_QUESTIONS)
+_DATABASE_PATTERN = _compile(DATABASE_KEYWORDS)
+_DATABASE_MODIFIER_PATTERN = _compile(DATABASE_MODIFIERS)
+_SEARCH_PATTERN = _compile(SEARCH_KEYWORDS)
+_VISUALIZE_PATTERN = _compile(VISUALIZE_KEYWORDS)
+
+_resolver = EntityResolver()
+
+
+def normalize_text(text: str) -> str:
+    """Chữ thường, gộp khoảng trắng."""
+    return " ".join(text.lower().split())
+
+
+def hashed_ngrams(text: str, n_min: int, n_max: int, n_features: int):
+    """
+    Băm các n-gram ký tự của văn bản vào không gian đặc trưng cố định.
+
+    Args:
+        text (str): Văn bản đầu vào
+        n_min (int): Độ dài n-gram nhỏ nhất
+        n_max (int): Độ dài n-gram lớn nhất
+        n_features (int): Số chiều không gian băm
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Chỉ số đặc trưng (không trùng) và số lần xuất hiện
+    """
+    text = f" {normalize_text(text)} "
+    hashes = [
+        zlib.crc32(text[i:i + n].encode("utf-8")) % n_features
+        for n in range(n_min, n_max + 1)
+        for i in range(len(text) - n + 1)
+    ]
+    return np.unique(np.asarray(hashes, dtype=np.int64), return_counts=True)
+
+
+def rule_scores(question: str) -> Dict[str, float]:
+    """
+    Tính điểm thô cho từng agent bằng luật từ khóa.
+
+    database_query chỉ có điểm khi câu hỏi nhắc đến một công ty (mã cổ phiếu hoặc tên)
+    hoặc một cột dữ liệu; điểm tăng theo số lần khớp và độ cụ thể của từ khóa.
+
+    Args:
+        question (str): Câu hỏi của người dùng
+    Returns:
+        Dict[str, float]: Điểm thô của các agent có từ khóa khớp (rỗng nếu không khớp luật nào)
+    """
+    text = normalize_text(question)
+    scores: Dict[str, float] = {}
+
+    db_score = DATABASE_KEYWORD_SCORE * len(_DATABASE_PATTERN.findall(text))
+    if _resolver.resolve(question):
+        db_score += DATABASE_ENTITY_SCORE
+    if db_score:
+        db_score += DATABASE_MODIFIER_SCORE * len(_DATABASE_MODIFIER_PATTERN.findall(text))
+        scores["database_query"] = db_score
+
+    search_hits = len(_SEARCH_PATTERN.findall(text))
+    if search_hits:
+        scores["google_search"] = SEARCH_KEYWORD_SCORE * search_hits
+
+    chart = match_chart_keyword(text)
+    if (chart and chart["explicit"]) or _VISUALIZE_PATTERN.search(text):
+        # VisualizeAgent tự truy vấn dữ liệu nên không cần chạy thêm database_query
+        scores["visualize"] = 3.0 + scores.pop("database_query", 0.0)
+
+    if not scores:
+        if _HELP_PATTERN.search(text):
+            scores["conversation"] = 2.0
+        elif _GREETING_PATTERN.search(text) and len(text.split()) <= MAX_GREETING_WORDS:
+            scores["conversation"] = 2.0
+    return scores
+
+
+class NGramNaiveBayes:
+    """
+    Bộ phân loại Naive Bayes trên n-gram ký tự (băm vào không gian đặc trưng cố định).
+
+    Nhẹ và đủ nhanh để chạy trước mỗi lần định tuyến (vài chục micro giây cho một câu hỏi).
+    """
+
+    def __init__(self, n_min: int = 2, n_max: int = 4, n_features: int = 2 ** 17, alpha: float = 0.5):
+        """
+        Args:
+            n_min (int): Độ dài n-gram nhỏ nhất
+            n_max (int): Độ dài n-gram lớn nhất
+            n_features (int): Số chiều không gian băm
+            alpha (float): Hệ số làm mịn Laplace
+        """
+        self.n_min = n_min
+        self.n_max = n_max
+        self.n_features = n_features
+        self.alpha = alpha
+        self.classes_: List[str] = []
+        self.class_log_prior_: Optional[np.ndarray] = None
+        self.feature_log_prob_: Optional[np.ndarray] = None
+
+    def _features(self, text: str):
+        return hashed_ngrams(text, self.n_min, self.n_max, self.n_features)
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str]) -> "NGramNaiveBayes":
+        """
+        Huấn luyện mô hình.
+
+        Args:
+            texts (Sequence[str]): Các câu hỏi
+            labels (Sequence[str]): Nhãn (tên agent) tương ứng
+        Returns:
+            NGramNaiveBayes: Chính mô hình
+        """
+        self.classes_ = sorted(set(labels))
+        class_index = {c: i for i, c in enumerate(self.classes_)}
+        counts = np.zeros((len(self.classes_), self.n_features), dtype=np.float64)
+        class_counts = np.zeros(len(self.classes_), dtype=np.float64)
+        for text, label in zip(texts, labels):
+            idx, cnt = self._features(text)
+            row = class_index[label]
+            counts[row, idx] += cnt
+            class_counts[row] += 1
+        smoothed = counts + self.alpha
+        self.feature_log_prob_ = np.log(smoothed / smoothed.sum(axis=1, keepdims=True)).astype(np.float32)
+        self.class_log_prior_ = np.log(class_counts / class_counts.sum())
+        return self
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """
+        Xác suất của từng lớp cho một câu hỏi.
+
+        Args:
+            text (str): Câu hỏi
+        Returns:
+            Dict[str, float]: Xác suất theo tên agent
+        """
+        idx, cnt = self._features(text)
+        joint = self.class_log_prior_ + self.feature_log_prob_[:, idx] @ cnt
+        joint = joint - joint.max()
+        proba = np.exp(joint)
+        proba /= proba.sum()
+        return dict(zip(self.classes_, proba.tolist()))
+
+
+class LocalIntentClassifier:
+    """
+    Bộ phân loại ý định cục bộ đặt trước LLM của router.
+
+    Kết hợp luật từ khóa với mô hình n-gram huấn luyện từ log định tuyến (nếu có).
+    Router chỉ gọi LLM khi khoảng cách (margin) giữa hai agent có điểm cao nhất quá nhỏ.
+    """
+
+    # Số mẫu tối thiểu để huấn luyện mô hình n-gram
+    MIN_TRAINING_SAMPLES = 20
+
+    def __init__(self, log_path: Optional[str] = None, rule_weight: float = 0.5):
+        """
+        Khởi tạo bộ phân loại và huấn luyện mô hình từ log định tuyến nếu có.
+
+        Args:
+            log_path (Optional[str]): Tệp JSONL chứa log định tuyến đã gán nhãn
+            rule_weight (float): Trọng số của luật khi kết hợp với mô hình (0-1)
+        """
+        self.log_path = log_path
+        self.rule_weight = rule_weight
+        self.model: Optional[NGramNaiveBayes] = None
+        self._lock = threading.Lock()
+        if log_path and os.path.exists(log_path):
+            self.train_from_log(log_path)
+
+    @staticmethod
+    def _label_from_record(record: Dict) -> Optional[str]:
+        """Nhãn của một dòng log: trường "label" hoặc agent có điểm tin cậy cao nhất."""
+        if record.get("label") in AGENT_NAMES:
+            return record["label"]
+        confidences = {k: v for k, v in (record.get("confidences") or {}).items() if k in AGENT_NAMES}
+        if confidences:
+            return max(confidences, key=confidences.get)
+        return None
+
+    def train_from_log(self, log_path: str) -> bool:
+        """
+        Huấn luyện mô hình n-gram từ log định tuyến.
+
+        Args:
+            log_path (str): Tệp JSONL, mỗi dòng gồm "question" và "label" hoặc "confidences"
+        Returns:
+            bool: True nếu huấn luyện thành công
+        """
+        texts, labels = [], []
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                label = self._label_from_record(record)
+                if record.get("question") and label:
+                    texts.append(record["question"])
+                    labels.append(label)
+
+        if len(texts) < self.MIN_TRAINING_SAMPLES or len(set(labels)) < 2:
+            logger.info(f"Chưa đủ dữ liệu để huấn luyện bộ phân loại cục bộ ({len(texts)} mẫu)")
+            return False
+
+        start = time.perf_counter()
+        self.model = NGramNaiveBayes().fit(texts, labels)
+        logger.info(f"Đã huấn luyện bộ phân loại cục bộ với {len(texts)} mẫu "
+                    f"trong {time.perf_counter() - start:.2f}s")
+        return True
+
+    def record(self, question: str, confidences: Dict[str, float]):
+        """
+        Ghi kết quả định tuyến của LLM vào log để huấn luyện lại mô hình sau này.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+            confidences (Dict[str, float]): Điểm tin cậy do LLM trả về
+        """
+        if not self.log_path:
+            return
+        line = json.dumps({"question": question, "confidences": confidences,
+                           "timestamp": time.time()}, ensure_ascii=False)
+        try:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Không thể ghi log định tuyến: {e}")
+
+    def classify(self, question: str) -> Optional[Dict]:
+        """
+        Phân loại câu hỏi bằng luật và mô hình cục bộ.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Optional[Dict]: {"confidences", "margin", "source"} hoặc None nếu không có tín hiệu nào
+        """
+        scores = rule_scores(question)
+        rule_conf = None
+        if scores:
+            total = sum(scores.values())
+            rule_conf = {name: scores.get(name, 0.0) / total for name in AGENT_NAMES}
+            # Độ chắc chắn của luật tăng theo tổng điểm: một từ khóa đơn lẻ không đủ bỏ qua LLM
+            rule_strength = total / (total + RULE_PRIOR)
+
+        model_conf = None
+        if self.model is not None:
+            proba = self.model.predict_proba(question)
+            model_conf = {name: proba.get(name, 0.0) for name in AGENT_NAMES}
+
+        margin_scale = 1.0
+        if rule_conf and model_conf:
+            weight = self.rule_weight * rule_strength
+            confidences = {
+                name: weight * rule_conf[name] + (1 - weight) * model_conf[name]
+                for name in AGENT_NAMES
+            }
+            source = "rules+model"
+        elif rule_conf:
+            confidences, source = rule_conf, "rules"
+            margin_scale = rule_strength
+        elif model_conf:
+            confidences, source = model_conf, "model"
+        else:
+            return None
+
+        top, second = sorted(confidences.values(), reverse=True)[:2]
+        return {
+            "confidences": confidences,
+            "margin": (top - second) * margin_scale,
+            "source": source,
+        }
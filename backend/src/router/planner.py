@@ -0,0 +1,127 @@
+import json
+import re
+import logging
+from typing import Any, Dict, Optional
+
+from src.agent.configs.promtting import select_schema_context
+from src.agent.companies import describe_entities
+from src.agent.sql_utils import clean_sql, validate_readonly_sql
+from src.utils.llm import is_complex_question
+
+logger = logging.getLogger(__name__)
+
+# Các agent cần dữ liệu từ cơ sở dữ liệu (planner sinh thêm query nháp cho các agent này)
+DATA_AGENTS = ("database_query", "visualize")
+
+
+class QueryPlanner:
+    """
+    Planner kết hợp định tuyến và sinh SQL trong cùng một lần gọi LLM.
+
+    Với câu hỏi về dữ liệu, thay vì gọi LLM để định tuyến rồi gọi tiếp để sinh
+    query, planner yêu cầu một phản hồi JSON gồm điểm tin cậy của các agent và
+    câu query nháp. Query nháp chỉ được dùng nếu vượt qua bước kiểm tra cú pháp.
+    """
+
+    def __init__(self, model_policy, min_data_confidence: float = 0.2):
+        """
+        Args:
+            model_policy (ModelPolicy): Chính sách tầng mô hình dùng để gọi LLM
+            min_data_confidence (float): Điểm tối thiểu của agent dữ liệu để giữ lại query nháp
+        """
+        self.model_policy = model_policy
+        self.min_data_confidence = min_data_confidence
+
+    def build_prompt(self, question: str) -> str:
+        """
+        Tạo prompt cho planner.
+
+        Phần hướng dẫn cố định đặt đầu, schema rút gọn theo câu hỏi đặt sau, câu hỏi
+        đặt cuối cùng để các prompt có chung tiền tố dài nhất có thể (prompt caching).
+        """
+        return f"""
+        Bạn là bộ định tuyến kiêm chuyên gia SQL cho hệ thống thông tin tài chính.
+
+        Các danh mục:
+        1. database_query - Câu hỏi về thông tin công ty hoặc giá cổ phiếu
+        2. google_search - Câu hỏi yêu cầu tin tức mới nhất về công ty hoặc giá cổ phiếu
+        3. visualize - Câu hỏi yêu cầu tạo biểu đồ, đồ thị hoặc các hình ảnh trực quan hóa dữ liệu
+        4. conversation - Lời chào hoặc giao tiếp thông thường
+
+        Lưu ý:
+        - Nếu câu hỏi yêu cầu biểu đồ, hãy ưu tiên "visualize" (điểm trên 0.9).
+        - Nếu database_query hoặc visualize phù hợp, hãy viết một câu query SELECT chuẩn PostgreSQL
+          lấy dữ liệu cần thiết vào trường "sql"; nếu không, để "sql" là null.
+
+        Trả về duy nhất một JSON theo mẫu:
+        {{"confidences": {{"database_query": 0.7, "google_search": 0.1, "visualize": 0.1, "conversation": 0.1}}, "sql": "SELECT ..."}}
+
+        Schema cơ sở dữ liệu PostgreSQL:
+        {select_schema_context(question)}
+
+        {describe_entities(question)}
+        Câu hỏi: {question}
+        """
+
+    @staticmethod
+    def parse_plan(raw_output: str) -> Dict[str, Any]:
+        """
+        Phân tích JSON kế hoạch từ đầu ra của LLM.
+
+        Args:
+            raw_output (str): Đầu ra thô từ LLM
+        Returns:
+            Dict[str, Any]: {"confidences": Dict[str, float], "sql": Optional[str]}
+        Raises:
+            ValueError: Khi không tìm thấy JSON hợp lệ
+        """
+        # Lấy khối JSON ngoài cùng (bỏ qua code fence bao quanh nếu có)
+        match = re.search(r'\{.*\}', raw_output, re.DOTALL)
+        if not match:
+            raise ValueError("Không tìm thấy JSON trong phản hồi của planner")
+        plan = json.loads(match.group(0))
+        confidences = plan.get("confidences")
+        if not isinstance(confidences, dict):
+            raise ValueError("Phản hồi của planner thiếu trường confidences")
+        sql = plan.get("sql")
+        return {
+            "confidences": confidences,
+            "sql": clean_sql(sql) if isinstance(sql, str) and sql.strip() else None,
+        }
+
+    def _validate_plan(self, raw_output: str) -> Optional[str]:
+        """Kiểm tra phản hồi có đúng định dạng kế hoạch (trả về thông báo lỗi hoặc None)."""
+        try:
+            self.parse_plan(raw_output)
+        except (ValueError, json.JSONDecodeError) as e:
+            return str(e)
+        return None
+
+    def plan(self, question: str) -> Dict[str, Any]:
+        """
+        Định tuyến và sinh query nháp trong một lần gọi LLM.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Dict[str, Any]: {"confidences": Dict[str, float], "sql": Optional[str]} -
+                "sql" là None nếu không cần dữ liệu hoặc query không hợp lệ
+        """
+        raw_output, _ = self.model_policy.invoke(
+            "planner", self.build_prompt(question),
+            validate=self._validate_plan,
+            complex_question=is_complex_question(question)
+        )
+        plan = self.parse_plan(raw_output)
+
+        sql: Optional[str] = plan["sql"]
+        data_confidence = max(float(plan["confidences"].get(name, 0.0) or 0.0) for name in DATA_AGENTS)
+        if sql and data_confidence < self.min_data_confidence:
+            sql = None
+        if sql:
+            error = validate_readonly_sql(sql)
+            if error:
+                logger.warning(f"Query nháp của planner không hợp lệ: {error}")
+                sql = None
+        plan["sql"] = sql
+        return plan
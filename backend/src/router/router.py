@@ -2,23 +2,78 @@ import os
 import json
 import re
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 import logging
 
+from .local_classifier import LocalIntentClassifier
+from .routing_cache import SemanticRoutingCache
+from .planner import QueryPlanner
+from src.utils.llm import get_model_policy
+from src.utils.cassette import get_cassette
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(frozen=True)
 class Agent:
     name: str
     description: str
     threshold: float  # Ngưỡng confidence để chọn agent
-    confidence: float = 0.0
-    selected: bool = False
+
+class AgentScore(NamedTuple):
+    """Điểm tin cậy của một agent trong một lần định tuyến."""
+    name: str
+    confidence: float
+    threshold: float
+    selected: bool
+
+class RoutingDecision(NamedTuple):
+    """
+    Kết quả bất biến của một lần định tuyến (mỗi lời gọi có kết quả riêng,
+    an toàn khi nhiều request định tuyến đồng thời).
+    
+    Attributes:
+        question (str): Câu hỏi của người dùng
+        scores (Tuple[AgentScore, ...]): Điểm của từng agent theo thứ tự định nghĩa
+        source (str): Nguồn quyết định (rules, model, rules+model, cache, llm, planner, fallback)
+        draft_sql (Optional[str]): Query nháp do planner sinh ra (đã kiểm tra cú pháp)
+    """
+    question: str
+    scores: Tuple[AgentScore, ...]
+    source: str
+    draft_sql: Optional[str] = None
+    
+    @property
+    def selected_agents(self) -> List[str]:
+        """Tên các agent được chọn (mặc định conversation nếu không agent nào vượt ngưỡng)."""
+        selected = [score.name for score in self.scores if score.selected]
+        return selected if selected else ["conversation"]
+    
+    def confidences(self) -> Dict[str, float]:
+        """Điểm tin cậy theo tên agent."""
+        return {score.name: score.confidence for score in self.scores}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Thông tin định tuyến chi tiết (định dạng trả về của detailed_routing)."""
+        info = {
+            "question": self.question,
+            "agents": [
+                {
+                    "name": score.name,
+                    "confidence": round(score.confidence, 2),
+                    "threshold": score.threshold,
+                    "selected": score.selected
+                } for score in self.scores
+            ],
+            "selected_agents": self.selected_agents,
+            "source": self.source
+        }
+        if self.draft_sql:
+            info["draft_sql"] = self.draft_sql
+        return info
 
 class FinancialMultiAgentRouter:
     def __init__(self):
@@ -27,12 +82,11 @@ class FinancialMultiAgentRouter:
         Không bao gồm vector_search và chỉ dùng visualize khi confidence > 0.9
         """
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            openai_api_key=self.api_key
-        )
+        # Định tuyến luôn bắt đầu ở tầng mô hình nhỏ, chỉ leo thang khi phản hồi không hợp lệ
+        self.model_policy = get_model_policy()
             
-        self.agents = [
+        # Định nghĩa agent chỉ đọc, dùng chung giữa các request
+        self.agents = (
             Agent(
                 name="database_query",
                 description="Xử lý truy vấn cơ sở dữ liệu về thông tin công ty và giá cổ phiếu.",
@@ -53,7 +107,41 @@ class FinancialMultiAgentRouter:
                 description="Xử lý các tương tác giao tiếp và lời chào.",
                 threshold=0.2
             )
-        ]
+        )
+        
+        # Bộ phân loại cục bộ: chỉ gọi LLM khi margin giữa hai agent cao nhất nhỏ hơn ngưỡng
+        self.local_classifier = LocalIntentClassifier(log_path=os.getenv("ROUTING_LOG_PATH") or None)
+        self.local_margin = float(os.getenv("ROUTER_LOCAL_MARGIN", "0.5"))
+        
+        # Bộ nhớ đệm định tuyến theo ngữ nghĩa (đặt giữa bộ phân loại cục bộ và LLM)
+        self.routing_cache = self._create_routing_cache()
+        
+        # Chế độ planner: định tuyến và sinh query nháp trong cùng một lần gọi LLM
+        self.planner = QueryPlanner(self.model_policy) if os.getenv("ROUTER_PLANNER", "false").lower() == "true" else None
+    
+    def _create_routing_cache(self):
+        """
+        Khởi tạo bộ nhớ đệm định tuyến theo biến môi trường ROUTING_CACHE_EMBEDDER
+        ("hash" - vector hóa cục bộ, "openai" - OpenAIEmbedding, "off" - tắt).
+        
+        Returns:
+            SemanticRoutingCache hoặc None nếu bị tắt
+        """
+        embedder_name = os.getenv("ROUTING_CACHE_EMBEDDER", "hash").lower()
+        if embedder_name == "off":
+            return None
+        
+        # Ngưỡng mặc định khác nhau vì phân bố cosine của hai loại vector khác nhau
+        embedder, default_threshold = None, "0.85"
+        if embedder_name == "openai":
+            from src.utils.embed import OpenAIEmbedding
+            embedder, default_threshold = OpenAIEmbedding(api_key=self.api_key), "0.92"
+        
+        return SemanticRoutingCache(
+            embedder=embedder,
+            capacity=int(os.getenv("ROUTING_CACHE_SIZE", "1024")),
+            threshold=float(os.getenv("ROUTING_CACHE_THRESHOLD", default_threshold))
+        )
 
     def parse_confidence_json(self, raw_output: str) -> Dict[str, float]:
         """
@@ -83,30 +171,64 @@ class FinancialMultiAgentRouter:
                     confidence_dict[agent.name] = float(match.group(1))
             return confidence_dict
 
-    def calculate_confidence(self, question: str) -> List[Agent]:
+    def route(self, question: str) -> RoutingDecision:
         """
-        Tính toán điểm tin cậy cho mỗi tác nhân dựa trên câu hỏi.
+        Định tuyến câu hỏi: bộ phân loại cục bộ -> bộ nhớ đệm ngữ nghĩa -> LLM.
         
         Args:
             question (str): Câu hỏi của người dùng
         Returns:
-            Danh sách các tác nhân với điểm tin cậy được cập nhật
+            RoutingDecision: Kết quả định tuyến bất biến của riêng lời gọi này
         """
+        local = self.local_classifier.classify(question)
+        if local and local["margin"] >= self.local_margin:
+            return self._decide(question, local["confidences"], local["source"])
+        
+        vector = None
+        if self.routing_cache is not None:
+            cached, vector = self.routing_cache.lookup(question)
+            if cached is not None:
+                return self._decide(question, cached, "cache")
+        
+        if self.planner is not None:
+            try:
+                plan = self.planner.plan(question)
+                self.local_classifier.record(question, plan["confidences"])
+                if self.routing_cache is not None:
+                    self.routing_cache.add(question, plan["confidences"], vector)
+                return self._decide(question, plan["confidences"], "planner", plan["sql"])
+            except Exception as e:
+                logger.warning(f"Planner thất bại, chuyển sang phân loại thông thường: {e}")
+        
         try:
-            agents = self._llm_intent_classification(question)
-            return agents
+            confidence_scores = self._llm_intent_classification(question)
         except Exception as e:
             logger.error(f"Phân loại bằng LLM thất bại: {e}")
-            return self.agents
+            return self._decide(question, {}, "fallback")
+        
+        if self.routing_cache is not None:
+            self.routing_cache.add(question, confidence_scores, vector)
+        return self._decide(question, confidence_scores, "llm")
+
+    def calculate_confidence(self, question: str) -> List[AgentScore]:
+        """
+        Tính toán điểm tin cậy cho mỗi tác nhân dựa trên câu hỏi.
+        
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Danh sách điểm tin cậy của các tác nhân
+        """
+        return list(self.route(question).scores)
 
-    def _llm_intent_classification(self, question: str) -> List[Agent]:
+    def _llm_intent_classification(self, question: str) -> Dict[str, float]:
         """
         Sử dụng LLM để phân loại ý định của câu hỏi.
         
         Args:
             question (str): Câu hỏi của người dùng
         Returns:
-            Danh sách các tác nhân với điểm tin cậy được cập nhật
+            Dict chứa điểm tin cậy cho từng tác nhân
         """
         prompt = f"""
         Phân loại câu hỏi sau vào một hoặc nhiều danh mục sau:
@@ -126,14 +248,43 @@ class FinancialMultiAgentRouter:
         Ví dụ: {{"database_query": 0.2, "google_search": 0.1, "visualize": 0.6, "conversation": 0.1}}
         """
         
-        raw_output = self.llm.invoke(prompt)
-        confidence_scores = self.parse_confidence_json(raw_output.content)
+        raw_output, _ = self.model_policy.invoke("router", prompt, validate=self._validate_confidences)
+        confidence_scores = self.parse_confidence_json(raw_output)
+        self.local_classifier.record(question, confidence_scores)
         
-        for agent in self.agents:
-            agent.confidence = confidence_scores.get(agent.name, 0.0)
-            agent.selected = agent.confidence >= agent.threshold
+        return confidence_scores
+    
+    def _validate_confidences(self, raw_output: str):
+        """Kiểm tra phản hồi của LLM có chứa điểm tin cậy hợp lệ (trả về thông báo lỗi hoặc None)."""
+        try:
+            scores = self.parse_confidence_json(raw_output)
+            if any(float(scores.get(agent.name, 0.0) or 0.0) > 0 for agent in self.agents):
+                return None
+        except Exception:
+            pass
+        return "Không đọc được điểm tin cậy từ phản hồi"
+
+    def _decide(self, question: str, confidence_scores: Dict[str, float], source: str,
+                draft_sql: Optional[str] = None) -> RoutingDecision:
+        """
+        Tạo kết quả định tuyến từ điểm tin cậy mà không thay đổi định nghĩa agent.
         
-        return self.agents
+        Args:
+            question (str): Câu hỏi của người dùng
+            confidence_scores (Dict[str, float]): Điểm tin cậy theo tên tác nhân
+            source (str): Nguồn của điểm tin cậy
+            draft_sql (Optional[str]): Query nháp do planner sinh ra
+        Returns:
+            RoutingDecision: Kết quả định tuyến
+        """
+        scores = []
+        for agent in self.agents:
+            try:
+                confidence = float(confidence_scores.get(agent.name, 0.0))
+            except (TypeError, ValueError):
+                confidence = 0.0
+            scores.append(AgentScore(agent.name, confidence, agent.threshold, confidence >= agent.threshold))
+        return RoutingDecision(question, tuple(scores), source, draft_sql)
 
     def select_agents(self, question: str) -> List[str]:
         """
@@ -144,33 +295,18 @@ class FinancialMultiAgentRouter:
         Returns:
             Danh sách tên các tác nhân được chọn
         """
-        agents = self.calculate_confidence(question)
-        selected_agents = [agent.name for agent in agents if agent.selected]
-        return selected_agents if selected_agents else ["conversation"]
+        return self.route(question).selected_agents
 
     def detailed_routing(self, question: str) -> Dict[str, Any]:
         """
-        Cung cấp thông tin định tuyến chi tiết.
+        Cung cấp thông tin định tuyến chi tiết (chỉ định tuyến một lần).
         
         Args:
             question (str): Câu hỏi của người dùng
         Returns:
             Thông tin định tuyến chi tiết
         """
-        agents = self.calculate_confidence(question)
-        
-        return {
-            "question": question,
-            "agents": [
-                {
-                    "name": agent.name,
-                    "confidence": round(agent.confidence, 2),
-                    "threshold": agent.threshold,
-                    "selected": agent.selected
-                } for agent in agents
-            ],
-            "selected_agents": self.select_agents(question)
-        }
+        return self.route(question).to_dict()
 
 def main():
     router = FinancialMultiAgentRouter()
@@ -194,6 +330,9 @@ def main():
                   f"{agent['confidence']:.2f}/{agent['threshold']:.2f} {'(Được chọn)' if agent['selected'] else ''}")
         
         print(f"Các tác nhân được chọn: {routing_info['selected_agents']}")
+    
+    if get_cassette():
+        print(f"\nCassette: {get_cassette().stats()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+import threading
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from .local_classifier import hashed_ngrams
+
+logger = logging.getLogger(__name__)
+
+
+class HashedTextEmbedder:
+    """
+    Vector hóa văn bản cục bộ bằng n-gram ký tự băm (không cần gọi API).
+
+    Có cùng giao diện create_embedding với OpenAIEmbedding trong src/utils/embed.py.
+    """
+
+    def __init__(self, n_features: int = 2 ** 12, n_min: int = 3, n_max: int = 5):
+        """
+        Args:
+            n_features (int): Số chiều vector
+            n_min (int): Độ dài n-gram nhỏ nhất
+            n_max (int): Độ dài n-gram lớn nhất
+        """
+        self.dimensions = n_features
+        self.n_min = n_min
+        self.n_max = n_max
+
+    def create_embedding(self, text: str) -> np.ndarray:
+        """
+        Tạo vector cho văn bản.
+
+        Args:
+            text (str): Văn bản cần vector hóa
+        Returns:
+            np.ndarray: Vector float32 (chưa chuẩn hóa)
+        """
+        idx, cnt = hashed_ngrams(text, self.n_min, self.n_max, self.dimensions)
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        vector[idx] = cnt
+        return vector
+
+
+class SemanticRoutingCache:
+    """
+    Bộ nhớ đệm định tuyến theo ngữ nghĩa.
+
+    Lưu vector của các câu hỏi đã định tuyến (đã chuẩn hóa) trong một ma trận NumPy
+    cấp phát sẵn, cùng với điểm tin cậy tương ứng. Câu hỏi mới có độ tương đồng
+    cosine vượt ngưỡng sẽ dùng lại quyết định định tuyến cũ. Khi đầy, mục ít được
+    dùng gần đây nhất bị loại bỏ (LRU).
+    """
+
+    def __init__(self, embedder=None, capacity: int = 1024, threshold: float = 0.92):
+        """
+        Args:
+            embedder: Đối tượng có phương thức create_embedding (mặc định HashedTextEmbedder)
+            capacity (int): Số câu hỏi tối đa được lưu
+            threshold (float): Ngưỡng cosine để dùng lại kết quả
+        """
+        self.embedder = embedder or HashedTextEmbedder()
+        self.capacity = capacity
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._questions: List[Optional[str]] = [None] * capacity
+        self._values: List[Optional[Dict[str, float]]] = [None] * capacity
+        self._size = 0
+        self._clock = 0
+
+    def embed(self, question: str) -> Optional[np.ndarray]:
+        """
+        Tạo vector đã chuẩn hóa cho câu hỏi.
+
+        Args:
+            question (str): Câu hỏi
+        Returns:
+            Optional[np.ndarray]: Vector đơn vị, hoặc None nếu không tạo được
+        """
+        try:
+            vector = np.asarray(self.embedder.create_embedding(question), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Không thể tạo embedding cho bộ nhớ đệm định tuyến: {e}")
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+    def lookup(self, question: str) -> Tuple[Optional[Dict[str, float]], Optional[np.ndarray]]:
+        """
+        Tìm quyết định định tuyến của câu hỏi gần nhất.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+        Returns:
+            Tuple: (điểm tin cậy nếu trúng bộ nhớ đệm hoặc None, vector của câu hỏi để dùng lại khi add)
+        """
+        vector = self.embed(question)
+        if vector is None:
+            return None, None
+        with self._lock:
+            if self._size == 0:
+                self.misses += 1
+                return None, vector
+            similarities = self._matrix[:self._size] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None, vector
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            logger.info(f"Trúng bộ nhớ đệm định tuyến (cosine={similarities[best]:.3f}): "
+                        f"{self._questions[best]!r}")
+            return dict(self._values[best]), vector
+
+    def add(self, question: str, confidences: Dict[str, float], vector: Optional[np.ndarray] = None):
+        """
+        Lưu quyết định định tuyến của một câu hỏi.
+
+        Args:
+            question (str): Câu hỏi của người dùng
+            confidences (Dict[str, float]): Điểm tin cậy của các agent
+            vector (Optional[np.ndarray]): Vector đã tính ở lookup (tránh gọi embedding lần nữa)
+        """
+        if vector is None:
+            vector = self.embed(question)
+            if vector is None:
+                return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            if question in self._questions[:self._size]:
+                slot = self._questions.index(question)
+            elif self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._clock += 1
+            self._matrix[slot] = vector
+            self._last_used[slot] = self._clock
+            self._questions[slot] = question
+            self._values[slot] = dict(confidences)
+
+    def stats(self) -> Dict[str, float]:
+        """Thống kê số lần trúng/trượt của bộ nhớ đệm."""
+        total = self.hits + self.misses
+        return {
+            "size": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay", "auto")
+
+
+class CassetteMiss(Exception):
+    """Không có bản ghi cho yêu cầu khi đang ở chế độ replay."""
+
+
+def request_key(kind: str, payload: Any) -> str:
+    """
+    Khóa của một yêu cầu: sha256 của loại và nội dung đã chuẩn hóa.
+
+    Args:
+        kind (str): Loại lời gọi (đường dẫn API hoặc "tavily")
+        payload (Any): Nội dung yêu cầu có thể chuyển sang JSON
+    Returns:
+        str: Khóa dạng hex
+    """
+    canonical = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CassetteStore:
+    """
+    Kho ghi/phát lại các lời gọi LLM, embedding và tìm kiếm (file JSONL, mỗi dòng một bản ghi).
+
+    - record: gọi dịch vụ thật và ghi lại yêu cầu, phản hồi và độ trễ quan sát được
+    - replay: chỉ phát lại từ kho (không truy cập mạng), yêu cầu chưa có bản ghi gây CassetteMiss
+    - auto: phát lại nếu có bản ghi, nếu không thì gọi thật và ghi lại
+
+    Khi phát lại, độ trễ ban đầu được mô phỏng lại (latency="recorded") hoặc bỏ qua
+    (latency="zero"). Một khóa có nhiều bản ghi (ví dụ cùng prompt gọi nhiều lần) được
+    phát lại lần lượt theo vòng.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency: str = "recorded"):
+        """
+        Args:
+            path (str): Đường dẫn file cassette
+            mode (str): "record", "replay" hoặc "auto"
+            latency (str): "recorded" (giữ độ trễ ban đầu) hoặc "zero"
+        """
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"Chế độ cassette không hợp lệ: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Bỏ qua dòng cassette không hợp lệ trong {self.path}")
+                    continue
+                self._entries.setdefault(entry["key"], []).append(entry)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Bản ghi tiếp theo cho một khóa (None nếu cần gọi dịch vụ thật).
+
+        Raises:
+            CassetteMiss: Khi ở chế độ replay và khóa chưa được ghi
+        """
+        if self.mode == "record":
+            return None
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CassetteMiss(f"Không có bản ghi cho yêu cầu {key[:12]} trong {self.path}")
+                return None
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            self.hits += 1
+            entry = entries[index % len(entries)]
+        if self.latency == "recorded":
+            time.sleep(entry.get("latency", 0.0))
+        return entry
+
+    def record(self, key: str, kind: str, request: Any, response: Any, latency: float, **extra):
+        """Ghi thêm một bản ghi vào kho."""
+        entry = {"key": key, "kind": kind, "request": request, "response": response,
+                 "latency": round(latency, 4), **extra}
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self.recorded += 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def http_client(self) -> httpx.Client:
+        """httpx.Client cho các client OpenAI (ChatOpenAI, OpenAIEmbeddings) đi qua kho."""
+        return httpx.Client(transport=CassetteTransport(self), timeout=None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+            }
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    Transport httpx ghi/phát lại các yêu cầu HTTP tới API tương thích OpenAI.
+
+    Khóa gồm phương thức, đường dẫn và body JSON (không gồm header nên API key không bị ghi lại).
+    """
+
+    def __init__(self, store: CassetteStore, transport: Optional[httpx.BaseTransport] = None):
+        self.store = store
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = body.decode("utf-8", errors="replace")
+        kind = f"{request.method} {request.url.path}"
+        key = request_key(kind, payload)
+
+        entry = self.store.lookup(key)
+        if entry is not None:
+            response = entry["response"]
+            return httpx.Response(
+                response["status"],
+                headers={"content-type": response.get("content_type", "application/json")},
+                content=response["body"].encode("utf-8"),
+                request=request,
+            )
+
+        start = time.perf_counter()
+        live = self._transport.handle_request(request)
+        content = live.read()
+        latency = time.perf_counter() - start
+        content_type = live.headers.get("content-type", "application/json")
+        # Chỉ ghi lại phản hồi thành công để lỗi tạm thời không bị phát lại mãi
+        if live.status_code < 400:
+            self.store.record(key, kind, payload, {
+                "status": live.status_code,
+                "content_type": content_type,
+                "body": content.decode("utf-8", errors="replace"),
+            }, latency)
+        return httpx.Response(
+            live.status_code,
+            headers={"content-type": content_type},
+            content=content,
+            request=request,
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+class CassetteSearch:
+    """Bọc công cụ tìm kiếm (TavilySearch) để ghi/phát lại các lời gọi invoke."""
+
+    def __init__(self, search: Any, store: CassetteStore):
+        self.search = search
+        self.store = store
+
+    def invoke(self, query: Any) -> Any:
+        payload = {"query": query, "max_results": getattr(self.search, "max_results", None)}
+        key = request_key("tavily", payload)
+        entry = self.store.lookup(key)
+        if entry is not None:
+            return entry["response"]
+        start = time.perf_counter()
+        response = self.search.invoke(query)
+        self.store.record(key, "tavily", payload, response, time.perf_counter() - start)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.search, name)
+
+
+_cassette: Optional[CassetteStore] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[CassetteStore]:
+    """
+    Kho cassette dùng chung theo biến môi trường CASSETTE_MODE (off | record | replay | auto),
+    CASSETTE_PATH và CASSETTE_LATENCY (recorded | zero).
+
+    Returns:
+        Optional[CassetteStore]: None nếu tắt
+    """
+    global _cassette
+    mode = os.getenv("CASSETTE_MODE", "off").lower()
+    if mode == "off":
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = CassetteStore(
+                path=os.getenv("CASSETTE_PATH", "data/cassettes.jsonl"),
+                mode=mode,
+                latency=os.getenv("CASSETTE_LATENCY", "recorded").lower(),
+            )
+            logger.info(f"Cassette {mode}: {_cassette.path}")
+        return _cassette
+
+
+def cassette_http_client() -> Optional[httpx.Client]:
+    """httpx.Client đi qua kho cassette, hoặc None nếu tắt."""
+    cassette = get_cassette()
+    return cassette.http_client() if cassette else None
+
+
+def wrap_search(search: Any) -> Any:
+    """Bọc công cụ tìm kiếm bằng CassetteSearch nếu cassette đang bật."""
+    cassette = get_cassette()
+    return CassetteSearch(search, cassette) if cassette else search
@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from src.utils.synthesis import format_value, render_table
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken là tùy chọn, ước lượng theo số ký tự nếu không có
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách token cho toàn bộ context tổng hợp theo mô hình
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o-mini": 6000,
+    "gpt-4o": 8000,
+}
+DEFAULT_CONTEXT_BUDGET = 6000
+
+# Tỷ lệ ngân sách của từng agent (được chuẩn hóa theo các agent có kết quả)
+AGENT_BUDGET_WEIGHTS = {
+    "database_query": 0.5,
+    "google_search": 0.3,
+    "visualize": 0.1,
+    "conversation": 0.1,
+}
+
+# Số dòng đầu/cuối tối đa khi tóm tắt bảng lớn
+MAX_EDGE_ROWS = 10
+
+
+@lru_cache(maxsize=8)
+def _encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model_name: str = "gpt-4o-mini") -> int:
+    """
+    Đếm số token của văn bản (dùng tiktoken nếu có, nếu không thì ước lượng ~4 ký tự/token).
+
+    Args:
+        text (str): Văn bản
+        model_name (str): Tên mô hình để chọn bộ mã hóa
+    Returns:
+        int: Số token
+    """
+    if tiktoken is not None:
+        return len(_encoding(model_name).encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str = "gpt-4o-mini") -> str:
+    """Cắt văn bản để không vượt quá số token cho phép."""
+    if count_tokens(text, model_name) <= max_tokens:
+        return text
+    if tiktoken is not None:
+        encoding = _encoding(model_name)
+        return encoding.decode(encoding.encode(text)[:max(max_tokens - 1, 0)]) + "…"
+    return text[:max(max_tokens * 4 - 1, 0)] + "…"
+
+
+def context_budget(model_name: str) -> int:
+    """
+    Ngân sách token cho context tổng hợp của một mô hình.
+
+    Có thể ghi đè bằng biến môi trường SYNTHESIS_CONTEXT_TOKENS.
+    """
+    override = os.getenv("SYNTHESIS_CONTEXT_TOKENS")
+    if override:
+        return int(override)
+    return MODEL_CONTEXT_BUDGETS.get(model_name, DEFAULT_CONTEXT_BUDGET)
+
+
+def agent_budgets(agent_names: List[str], total_budget: int) -> Dict[str, int]:
+    """
+    Chia ngân sách token cho các agent có kết quả theo AGENT_BUDGET_WEIGHTS.
+
+    Args:
+        agent_names (List[str]): Tên các agent có kết quả
+        total_budget (int): Tổng ngân sách token
+    Returns:
+        Dict[str, int]: Ngân sách theo agent
+    """
+    names = list(dict.fromkeys(agent_names))
+    weights = {name: AGENT_BUDGET_WEIGHTS.get(name, 0.1) for name in names}
+    total_weight = sum(weights.values()) or 1.0
+    return {name: int(total_budget * weight / total_weight) for name, weight in weights.items()}
+
+
+def _column_profile(df: pd.DataFrame) -> List[str]:
+    """Tóm tắt từng cột: min/max/trung bình cho cột số, khoảng thời gian, số giá trị phân biệt."""
+    lines = []
+    for col in df.columns:
+        series = df[col].dropna()
+        if series.empty:
+            lines.append(f"- {col}: toàn bộ là null")
+            continue
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notna().all():
+            lines.append(f"- {col}: min={format_value(numeric.min())}, max={format_value(numeric.max())}, "
+                         f"trung bình={format_value(numeric.mean())}, tổng={format_value(numeric.sum())}")
+            continue
+        first = series.iloc[0]
+        if hasattr(first, "isoformat"):
+            lines.append(f"- {col}: từ {format_value(series.min())} đến {format_value(series.max())}")
+            continue
+        counts = series.astype(str).value_counts()
+        top = ", ".join(f"{value} ({count})" for value, count in counts.head(5).items())
+        lines.append(f"- {col}: {len(counts)} giá trị phân biệt; phổ biến nhất: {top}")
+    return lines
+
+
+def summarize_table(columns: List[str], rows: List[Dict[str, Any]], max_tokens: int,
+                    model_name: str = "gpt-4o-mini", query: Optional[str] = None) -> str:
+    """
+    Hiển thị kết quả truy vấn trong giới hạn token.
+
+    Bảng vừa ngân sách được hiển thị đầy đủ; bảng lớn được tóm tắt bằng số dòng,
+    thống kê theo cột và một số dòng đầu/cuối.
+
+    Args:
+        columns (List[str]): Tên các cột
+        rows (List[Dict[str, Any]]): Các dòng kết quả
+        max_tokens (int): Ngân sách token
+        model_name (str): Tên mô hình để đếm token
+        query (Optional[str]): Câu query SQL (hiển thị kèm nếu có)
+    Returns:
+        str: Nội dung context
+    """
+    header = f"SQL: {query}\n\n" if query else ""
+    if not rows:
+        return header + "Không tìm thấy dữ liệu phù hợp."
+
+    full = header + render_table(columns, rows)
+    if len(rows) <= 2 * MAX_EDGE_ROWS and count_tokens(full, model_name) <= max_tokens:
+        return full
+
+    df = pd.DataFrame(rows, columns=columns)
+    summary = header + f"Tổng số dòng: {len(rows)}\nThống kê theo cột:\n" + "\n".join(_column_profile(df))
+    n_edge = min(MAX_EDGE_ROWS, len(rows) // 2)
+    while n_edge > 0:
+        text = (summary + f"\n\n{n_edge} dòng đầu:\n" + render_table(columns, rows[:n_edge]) +
+                f"\n\n{n_edge} dòng cuối:\n" + render_table(columns, rows[-n_edge:]))
+        if count_tokens(text, model_name) <= max_tokens:
+            return text
+        n_edge //= 2
+    return truncate_to_tokens(summary, max_tokens, model_name)
+
+
+def _relevance(question: str, item: Dict[str, Any]) -> float:
+    """Điểm liên quan của một kết quả tìm kiếm: điểm của Tavily cộng tỷ lệ từ khóa trùng với câu hỏi."""
+    words = set(re.findall(r"\w+", question.lower()))
+    text = f"{item.get('title', '')} {item.get('content', '')}".lower()
+    overlap = len(words & set(re.findall(r"\w+", text))) / (len(words) or 1)
+    return float(item.get("score") or 0.0) + overlap
+
+
+def summarize_search(question: str, results: List[Dict[str, Any]], max_tokens: int,
+                     model_name: str = "gpt-4o-mini") -> str:
+    """
+    Xếp hạng và cắt bớt các kết quả tìm kiếm để vừa ngân sách token.
+
+    Args:
+        question (str): Câu hỏi của người dùng
+        results (List[Dict[str, Any]]): Kết quả tìm kiếm (title, url, content, score)
+        max_tokens (int): Ngân sách token
+        model_name (str): Tên mô hình để đếm token
+    Returns:
+        str: Nội dung context
+    """
+    if not results:
+        return "Không tìm thấy kết quả phù hợp."
+    ranked = sorted(results, key=lambda item: _relevance(question, item), reverse=True)
+    per_item = max(max_tokens // len(ranked), 40)
+    parts, used = [], 0
+    for i, item in enumerate(ranked, 1):
+        head = f"{i}. {item.get('title', 'Không có tiêu đề')} ({item.get('url', 'Không có URL')})\n"
+        body = truncate_to_tokens(item.get("content", ""), per_item - count_tokens(head, model_name), model_name)
+        block = head + "   " + body
+        cost = count_tokens(block, model_name)
+        if used + cost > max_tokens:
+            break
+        parts.append(block)
+        used += cost
+    return "\n".join(parts)
+
+
+def summarize_chart(chart_info: Dict[str, Any]) -> str:
+    """Chỉ giữ các trường cần thiết của thông tin biểu đồ."""
+    keys = ("chart_type", "title", "x_column", "y_column", "explanation")
+    compact = {key: chart_info[key] for key in keys if chart_info.get(key)}
+    return json.dumps(compact, ensure_ascii=False)
+
+
+def build_synthesis_context(question: str, agent_results: List[Dict[str, Any]],
+                            model_name: str = "gpt-4o-mini") -> str:
+    """
+    Tạo context cho bước tổng hợp, mỗi agent không vượt quá ngân sách token của mình.
+
+    Args:
+        question (str): Câu hỏi của người dùng
+        agent_results (List[Dict[str, Any]]): Kết quả của các agent
+        model_name (str): Mô hình tổng hợp (quyết định tổng ngân sách)
+    Returns:
+        str: Context cho prompt tổng hợp
+    """
+    budgets = agent_budgets([r["agent_name"] for r in agent_results], context_budget(model_name))
+    sections = []
+    for result in agent_results:
+        name = result["agent_name"]
+        data = result.get("additional_data") or {}
+        budget = budgets[name]
+        if name == "database_query" and data.get("success"):
+            body = summarize_table(data.get("columns", []), data.get("results", []), budget,
+                                   model_name, data.get("query"))
+        elif name == "google_search" and data.get("search_results"):
+            body = summarize_search(question, data["search_results"], budget, model_name)
+        elif name == "visualize" and data.get("success"):
+            body = truncate_to_tokens(
+                result["content"] + "\nThông tin biểu đồ: " + summarize_chart(data.get("chart_info") or {}),
+                budget, model_name
+            )
+        else:
+            body = truncate_to_tokens(result["content"], budget, model_name)
+        sections.append(f"\n--- Kết quả từ {name} ---\n{body}\n")
+    context = "".join(sections)
+    logger.info(f"Context tổng hợp: ~{count_tokens(context, model_name)} token")
+    return context
@@ -5,6 +5,8 @@ from langchain_core.documents import Document
 from dotenv import load_dotenv
 import os
 
+from src.utils.cassette import cassette_http_client
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -28,7 +30,8 @@ class OpenAIEmbedding:
         self.embeddings = OpenAIEmbeddings(
             model=self.model,
             api_key=self.api_key,
-            dimensions=self.dimensions
+            dimensions=self.dimensions,
+            http_client=cassette_http_client()
         )
         logger.info(f"Đã khởi tạo OpenAIEmbeddings với model: {model} ({self.dimensions} chiều)")
         
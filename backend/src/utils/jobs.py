@@ -0,0 +1,132 @@
+import uuid
+import time
+import queue
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """
+    Thông tin một tác vụ chạy nền.
+
+    Attributes:
+        job_id (str): Mã tác vụ
+        status (str): pending | running | done | failed
+        result (Any): Kết quả khi hoàn thành
+        error (Optional[str]): Thông báo lỗi nếu thất bại
+    """
+    job_id: str
+    func: Callable = field(repr=False)
+    args: tuple = field(default=(), repr=False)
+    kwargs: Dict[str, Any] = field(default_factory=dict, repr=False)
+    status: str = "pending"
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Trả về trạng thái tác vụ dưới dạng dict để trả về qua API."""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Hàng đợi tác vụ nền có giới hạn, dùng cho các biểu đồ tốn thời gian render.
+
+    Số worker và kích thước hàng đợi đều cố định nên các tác vụ chậm không thể
+    chiếm hết thread pool phục vụ các câu hỏi hội thoại nhanh.
+    """
+
+    def __init__(self, num_workers: int = 2, max_queue_size: int = 20, result_ttl: float = 3600):
+        """
+        Khởi tạo hàng đợi và các worker.
+
+        Args:
+            num_workers (int): Số worker chạy song song
+            max_queue_size (int): Số tác vụ tối đa đang chờ
+            result_ttl (float): Thời gian (giây) giữ kết quả sau khi hoàn thành
+        """
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_queue_size)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func: Callable, *args, **kwargs) -> str:
+        """
+        Đưa một tác vụ vào hàng đợi.
+
+        Args:
+            func (Callable): Hàm cần chạy
+            args, kwargs: Tham số cho hàm
+        Returns:
+            str: Mã tác vụ
+        Raises:
+            queue.Full: Khi hàng đợi đã đầy
+        """
+        self._evict_expired()
+        job = Job(job_id=uuid.uuid4().hex, func=func, args=args, kwargs=kwargs)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            raise
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Lấy thông tin tác vụ theo mã (None nếu không tồn tại hoặc đã hết hạn)."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        """Số tác vụ đang chờ trong hàng đợi."""
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.status = "done"
+            except Exception as e:
+                logger.error(f"Tác vụ nền {job.job_id} thất bại: {e}")
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    def _evict_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.result_ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
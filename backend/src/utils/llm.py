@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from src.utils.cassette import cassette_http_client
+from src.utils.tracing import span
+from src.utils.metrics import LLM_CALLS_TOTAL
+from src.utils.usage import record_llm_call
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Thứ tự các tầng mô hình, từ rẻ/nhanh đến mạnh
+TIERS = ["small", "large"]
+
+DEFAULT_TIER_MODELS = {
+    "small": "gpt-4o-mini",
+    "large": "gpt-4o",
+}
+
+# Từ khóa cho thấy câu hỏi cần tính toán phức tạp (nhiều CTE, hàm cửa sổ, thống kê)
+COMPLEX_KEYWORDS = [
+    "sharpe", "volatility", "correlation", "rolling", "moving average", "standard deviation",
+    "annualized", "cumulative", "drawdown", "beta", "compare", "comparison", "rank", "ranking",
+    "percentile", "year-over-year", "yoy", "cagr", "growth rate", "for each", "each month",
+    "per month", "tương quan", "độ lệch chuẩn", "biến động", "so sánh", "xếp hạng",
+    "trung bình động", "lũy kế", "tăng trưởng",
+]
+
+_COMPLEX_PATTERN = re.compile(
+    r"(?<!\w)(?:" + "|".join(re.escape(kw) for kw in COMPLEX_KEYWORDS) + r")(?!\w)"
+)
+_YEAR_PATTERN = re.compile(r"\b(?:19|20)\d{2}\b")
+
+# Câu hỏi dài hơn số từ này được coi là phức tạp
+MAX_SIMPLE_WORDS = 30
+
+
+def tier_model_name(tier: str) -> str:
+    """Tên mô hình của một tầng (biến môi trường LLM_TIER_<TẦNG> hoặc mặc định)."""
+    return os.getenv(f"LLM_TIER_{tier.upper()}", DEFAULT_TIER_MODELS.get(tier, DEFAULT_TIER_MODELS["small"]))
+
+
+def create_chat_model(model_name: Optional[str] = None, tier: Optional[str] = None, **kwargs) -> ChatOpenAI:
+    """
+    Tạo mô hình chat dùng chung cho mọi thành phần.
+
+    Args:
+        model_name (Optional[str]): Tên mô hình; nếu None thì lấy theo tầng
+        tier (Optional[str]): Tầng mô hình ("small" hoặc "large"), mặc định "small"
+        **kwargs: Tham số bổ sung cho ChatOpenAI
+    Returns:
+        ChatOpenAI: Mô hình chat
+    """
+    tier = tier or "small"
+    env_prefix = f"LLM_TIER_{tier.upper()}"
+    model_name = model_name or tier_model_name(tier)
+    # Tầng nhỏ có thể trỏ tới một mô hình cục bộ tương thích OpenAI API
+    base_url = os.getenv(f"{env_prefix}_BASE_URL")
+    if base_url and "base_url" not in kwargs:
+        kwargs["base_url"] = base_url
+    # Ghi/phát lại lời gọi qua cassette (CASSETTE_MODE)
+    http_client = cassette_http_client()
+    if http_client is not None and "http_client" not in kwargs:
+        kwargs["http_client"] = http_client
+    return ChatOpenAI(
+        model_name=model_name,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        **kwargs
+    )
+
+
+def is_complex_question(question: str) -> bool:
+    """
+    Ước lượng câu hỏi có phức tạp không (cần mô hình mạnh hơn).
+
+    Args:
+        question (str): Câu hỏi của người dùng
+    Returns:
+        bool: True nếu câu hỏi chứa phép tính phức tạp, nhiều mốc năm hoặc quá dài
+    """
+    text = question.lower()
+    if _COMPLEX_PATTERN.search(text):
+        return True
+    if len(set(_YEAR_PATTERN.findall(text))) >= 2:
+        return True
+    return len(text.split()) > MAX_SIMPLE_WORDS
+
+
+class ModelPolicy:
+    """
+    Chính sách chọn tầng mô hình và leo thang (cascade).
+
+    Mỗi lời gọi bắt đầu ở tầng nhỏ (hoặc tầng lớn nếu câu hỏi phức tạp) và chỉ
+    leo lên tầng lớn khi lời gọi lỗi hoặc kết quả không qua bước kiểm tra. Độ
+    trễ và tỷ lệ thành công được ghi lại theo từng thành phần và tầng; khi tỷ lệ
+    thành công của tầng nhỏ cho một thành phần xuống dưới ngưỡng, thành phần đó
+    bắt đầu thẳng ở tầng lớn để không tốn thêm một lượt gọi thất bại.
+    """
+
+    def __init__(self, min_success_rate: float = 0.7, min_samples: int = 20, window: int = 200,
+                 probe_every: int = 10):
+        """
+        Args:
+            min_success_rate (float): Tỷ lệ thành công tối thiểu để tiếp tục bắt đầu ở tầng nhỏ
+            min_samples (int): Số mẫu tối thiểu trước khi dùng tỷ lệ thành công để quyết định
+            window (int): Số lời gọi gần nhất được giữ lại để tính thống kê
+            probe_every (int): Khi đang bỏ qua tầng nhỏ, cứ sau số lời gọi này lại thử tầng nhỏ
+                một lần để thống kê có thể phục hồi
+        """
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.probe_every = probe_every
+        self._skipped: Dict[str, int] = {}
+        self._models: Dict[str, ChatOpenAI] = {}
+        self._metrics: Dict[Tuple[str, str], Dict[str, deque]] = {}
+        self._lock = threading.Lock()
+
+    def model(self, tier: str) -> ChatOpenAI:
+        """Mô hình của một tầng (tạo một lần và dùng lại)."""
+        with self._lock:
+            if tier not in self._models:
+                self._models[tier] = create_chat_model(tier=tier)
+            return self._models[tier]
+
+    def _success_rate(self, component: str, tier: str) -> Optional[float]:
+        metrics = self._metrics.get((component, tier))
+        if not metrics or len(metrics["success"]) < self.min_samples:
+            return None
+        return sum(metrics["success"]) / len(metrics["success"])
+
+    def tiers_for(self, component: str, complex_question: bool = False) -> List[str]:
+        """
+        Danh sách tầng sẽ thử theo thứ tự cho một lời gọi.
+
+        Args:
+            component (str): Tên thành phần (router, sql, synthesis...)
+            complex_question (bool): Câu hỏi được đánh giá là phức tạp
+        Returns:
+            List[str]: Các tầng theo thứ tự leo thang
+        """
+        start = 0
+        if complex_question:
+            start = len(TIERS) - 1
+        else:
+            rate = self._success_rate(component, TIERS[0])
+            if rate is not None and rate < self.min_success_rate:
+                with self._lock:
+                    skipped = self._skipped.get(component, 0) + 1
+                    self._skipped[component] = 0 if skipped >= self.probe_every else skipped
+                if skipped < self.probe_every:
+                    start = len(TIERS) - 1
+        return TIERS[start:]
+
+    def record(self, component: str, tier: str, success: bool, latency: float):
+        """Ghi lại kết quả của một lời gọi mô hình."""
+        with self._lock:
+            metrics = self._metrics.setdefault((component, tier), {
+                "success": deque(maxlen=self.window),
+                "latency": deque(maxlen=self.window),
+            })
+            metrics["success"].append(1 if success else 0)
+            metrics["latency"].append(latency)
+        LLM_CALLS_TOTAL.inc(component=component, tier=tier, status="ok" if success else "error")
+
+    def invoke(self, component: str, prompt: Any, validate: Optional[Callable[[str], Optional[str]]] = None,
+               complex_question: bool = False, temperature: Optional[float] = None) -> Tuple[str, str]:
+        """
+        Gọi mô hình theo chính sách tầng, leo thang khi lỗi hoặc kết quả không hợp lệ.
+
+        Args:
+            component (str): Tên thành phần gọi mô hình
+            prompt (Any): Prompt (chuỗi hoặc danh sách message)
+            validate (Optional[Callable]): Hàm kiểm tra nội dung trả về, trả về thông báo lỗi hoặc None
+            complex_question (bool): Bắt đầu thẳng ở tầng lớn
+            temperature (Optional[float]): Ghi đè temperature của mô hình cho lời gọi này
+        Returns:
+            Tuple[str, str]: Nội dung phản hồi và tầng đã dùng
+        Raises:
+            Exception: Khi mọi tầng đều thất bại
+        """
+        last_error = None
+        for tier in self.tiers_for(component, complex_question):
+            start = time.perf_counter()
+            response = None
+            with span("llm", component=component, tier=tier, model=tier_model_name(tier)) as llm_span:
+                try:
+                    if temperature is None:
+                        response = self.model(tier).invoke(prompt)
+                    else:
+                        response = self.model(tier).invoke(prompt, temperature=temperature)
+                    content = response.content if hasattr(response, "content") else str(response)
+                    error = validate(content) if validate else None
+                except Exception as e:
+                    error = str(e)
+                if llm_span and error:
+                    llm_span.status, llm_span.error = "error", error[:300]
+            latency = time.perf_counter() - start
+            # Token và thời gian được tính cho yêu cầu và agent hiện tại (kể cả khi kết quả không hợp lệ)
+            record_llm_call(component, tier_model_name(tier), response, latency, success=response is not None)
+            self.record(component, tier, error is None, latency)
+            if error is None:
+                return content, tier
+            last_error = error
+            logger.warning(f"[{component}] Tầng {tier} thất bại: {error}")
+        raise Exception(f"Mọi tầng mô hình đều thất bại cho {component}: {last_error}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Thống kê độ trễ và tỷ lệ thành công theo thành phần và tầng.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: {"component/tier": {"calls", "success_rate", "p50_latency", "p95_latency"}}
+        """
+        result = {}
+        with self._lock:
+            for (component, tier), metrics in self._metrics.items():
+                latencies = sorted(metrics["latency"])
+                n = len(latencies)
+                result[f"{component}/{tier}"] = {
+                    "calls": n,
+                    "success_rate": round(sum(metrics["success"]) / n, 3) if n else 0.0,
+                    "p50_latency": round(latencies[n // 2], 3) if n else 0.0,
+                    "p95_latency": round(latencies[min(n - 1, int(n * 0.95))], 3) if n else 0.0,
+                }
+        return result
+
+
+_policy: Optional[ModelPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_model_policy() -> ModelPolicy:
+    """Chính sách mô hình dùng chung cho toàn bộ tiến trình."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = ModelPolicy(
+                min_success_rate=float(os.getenv("LLM_TIER_MIN_SUCCESS_RATE", "0.7")),
+                min_samples=int(os.getenv("LLM_TIER_MIN_SAMPLES", "20")),
+            )
+        return _policy
@@ -0,0 +1,248 @@
+import re
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.utils.tracing import Span, add_span_listener
+
+logger = logging.getLogger(__name__)
+
+# Ngưỡng (giây) của histogram độ trễ: từ truy vấn cục bộ vài ms đến lời gọi LLM hàng chục giây
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Mẫu do collector trả về: (tên metric, mô tả, nhãn, giá trị) - luôn là gauge
+Sample = Tuple[str, str, Dict[str, str], float]
+
+_LABEL_ESCAPE = re.compile(r'(["\\\n])')
+
+
+def _label_text(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = _LABEL_ESCAPE.sub(lambda m: "\\n" if m.group(1) == "\n" else "\\" + m.group(1), str(value))
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Cơ sở cho các loại metric có nhãn."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} cần các nhãn {self.labels}, nhận được {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(dict(zip(self.labels, key)))} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Giá trị tăng giảm tùy ý (ví dụ số yêu cầu đang xử lý)."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(dict(zip(self.labels, key)))} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Histogram tích lũy theo các ngưỡng cố định (định dạng Prometheus _bucket/_sum/_count)."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_text(dict(labels, le=_format_value(bound)))} {count}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Tập hợp các metric và collector, xuất ra định dạng văn bản của Prometheus.
+
+    Collector là hàm được gọi lúc scrape và trả về các gauge tính tại chỗ (độ sâu hàng
+    đợi, tỷ lệ trúng cache...) để không phải cập nhật chúng trên đường xử lý yêu cầu.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Toàn bộ metric ở định dạng văn bản Prometheus (text/plain; version=0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.lines())
+
+        gauges: Dict[str, Tuple[str, List[str]]] = {}
+        for collector in collectors:
+            try:
+                for name, help_text, labels, value in collector():
+                    if value is None:
+                        continue
+                    gauges.setdefault(name, (help_text, []))[1].append(
+                        f"{name}{_label_text(labels)} {_format_value(value)}"
+                    )
+            except Exception as e:
+                logger.warning(f"Lỗi khi thu thập metric: {e}")
+        for name, (help_text, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    "agent_requests_total", "Số yêu cầu API theo endpoint và mã trạng thái", ("endpoint", "status"))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "agent_requests_in_flight", "Số yêu cầu API đang xử lý")
+REQUEST_DURATION = REGISTRY.histogram(
+    "agent_request_duration_seconds", "Độ trễ yêu cầu API", ("endpoint",))
+STAGE_DURATION = REGISTRY.histogram(
+    "agent_stage_duration_seconds",
+    "Độ trễ theo bước xử lý (node của đồ thị, llm, db.execute, search, chart.render...)", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "agent_stage_errors_total", "Số bước xử lý kết thúc bằng lỗi", ("stage",))
+RETRIES_TOTAL = REGISTRY.counter(
+    "agent_retries_total", "Số lần thử lại theo thành phần", ("component",))
+LLM_CALLS_TOTAL = REGISTRY.counter(
+    "agent_llm_calls_total", "Số lời gọi LLM theo thành phần, tầng và kết quả", ("component", "tier", "status"))
+LLM_TOKENS_TOTAL = REGISTRY.counter(
+    "agent_llm_tokens_total", "Số token LLM theo mô hình và loại (prompt | completion)", ("model", "type"))
+
+
+def _observe_span(span: Span):
+    stage = span.name
+    if stage == "llm" and span.attributes.get("component"):
+        stage = f"llm.{span.attributes['component']}"
+    STAGE_DURATION.observe(span.duration_ms / 1000, stage=stage)
+    if span.status == "error":
+        STAGE_ERRORS.inc(stage=stage)
+
+
+add_span_listener(_observe_span)
+
+
+def record_token_usage(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """Cộng số token của một lời gọi LLM vào metric theo mô hình."""
+    if prompt_tokens:
+        LLM_TOKENS_TOTAL.inc(prompt_tokens, model=model, type="prompt")
+    if completion_tokens:
+        LLM_TOKENS_TOTAL.inc(completion_tokens, model=model, type="completion")
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from src.utils.tracing import request_threads
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Thư mục backend: chỉ lấy mẫu các thread đang chạy mã của dự án
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Chỉ một yêu cầu được profile tại một thời điểm (tracemalloc và việc lấy mẫu là toàn cục)
+_profile_lock = threading.Lock()
+
+
+def profiling_enabled() -> bool:
+    """Cho phép profile theo yêu cầu (biến môi trường PROFILING_ENABLED)."""
+    return os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+
+
+class ProfilerBusy(Exception):
+    """Đang có một yêu cầu khác được profile."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(PROJECT_ROOT):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Profiler lấy mẫu: một thread nền đọc stack của mọi thread theo chu kỳ.
+
+    Khác với cProfile (chỉ đo thread gọi enable), cách này thấy được mọi thread mà
+    yêu cầu đi qua (thread pool của API, các node song song của LangGraph, ứng viên SQL).
+    Thread không có frame nào thuộc mã của dự án (worker đang rảnh, event loop đang chờ)
+    bị bỏ qua; nếu có thread_filter thì chỉ lấy mẫu các thread mà hàm này trả về.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128,
+                 thread_filter: Optional[Callable[[], Set[int]]] = None):
+        """
+        Args:
+            interval (float): Khoảng thời gian giữa hai lần lấy mẫu (giây)
+            max_depth (int): Số frame tối đa của mỗi stack
+            thread_filter (Optional[Callable[[], Set[int]]]): Trả về ident của các thread cần lấy mẫu
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.thread_filter = thread_filter
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = 0.0
+
+    def _sample(self):
+        own = threading.get_ident()
+        allowed = self.thread_filter() if self.thread_filter is not None else None
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (allowed is not None and ident not in allowed):
+                continue
+            stack = []
+            in_project = False
+            while frame is not None and len(stack) < self.max_depth:
+                if frame.f_code.co_filename.startswith(PROJECT_ROOT):
+                    in_project = True
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if in_project:
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+            self.samples += 1
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._started_at
+
+    def collapsed(self) -> str:
+        """Stack dạng collapsed (mỗi dòng "thread;frame;...;frame số_mẫu"), dùng được với flamegraph.pl."""
+        lines = [";".join((thread,) + stack) + f" {count}" for (thread, stack), count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        """Profile dạng speedscope JSON (mỗi thread một profile kiểu "sampled", đơn vị mili giây)."""
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[str, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        weight = round(self.interval * 1000, 3)
+        for (thread, stack), count in self.stacks.items():
+            indexes = []
+            for label in stack:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(frame_index[label])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": thread, "unit": "milliseconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(indexes)
+            profile["weights"].append(weight * count)
+            profile["endValue"] += weight * count
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "src.utils.profiling",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def top_functions(self, limit: int = 15) -> List[Dict[str, Any]]:
+        """Các hàm tốn thời gian nhất (self: frame ở đỉnh stack, total: có mặt trong stack)."""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for (_, stack), count in self.stacks.items():
+            if stack:
+                self_counts[stack[-1]] += count
+            for label in set(stack):
+                total_counts[label] += count
+        total = sum(self.stacks.values()) or 1
+        return [
+            {"function": label, "self_pct": round(100 * count / total, 1),
+             "total_pct": round(100 * total_counts[label] / total, 1)}
+            for label, count in self_counts.most_common(limit)
+        ]
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int = 15) -> List[Dict[str, Any]]:
+    """Các vị trí cấp phát bộ nhớ lớn nhất (còn giữ lại khi kết thúc yêu cầu)."""
+    result = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        filename = frame.filename
+        if filename.startswith(PROJECT_ROOT):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        result.append({
+            "location": f"{filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        })
+    return result
+
+
+@contextmanager
+def profile_request(request_id: str, output_dir: Optional[str] = None,
+                    interval: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Profile một yêu cầu bằng profiler lấy mẫu và tracemalloc, lưu artifact theo request id.
+
+    Ghi ba file vào output_dir: <request_id>.speedscope.json, <request_id>.collapsed.txt và
+    <request_id>.allocations.json. Dict được yield sẽ chứa bản tóm tắt khi khối lệnh kết thúc.
+
+    Chỉ lấy mẫu các thread đang chạy trong trace của yêu cầu (request_id phải trùng với
+    request id của trace); phần chạy trên event loop không được lấy mẫu. tracemalloc là toàn
+    cục nên vị trí cấp phát có thể gồm cả của các yêu cầu chạy đồng thời.
+
+    Args:
+        request_id (str): Mã yêu cầu
+        output_dir (Optional[str]): Thư mục lưu artifact (mặc định PROFILE_DIR hoặc "profiles")
+        interval (Optional[float]): Chu kỳ lấy mẫu (giây), mặc định PROFILE_INTERVAL_MS
+    Yields:
+        Dict[str, Any]: Bản tóm tắt (top hàm, top vị trí cấp phát, đường dẫn artifact)
+    Raises:
+        ValueError: Khi đường dẫn artifact nằm ngoài output_dir (request id không hợp lệ)
+        ProfilerBusy: Khi đang có yêu cầu khác được profile
+    """
+    output_dir = os.path.realpath(output_dir or os.getenv("PROFILE_DIR", "profiles"))
+    artifacts = {
+        "speedscope": os.path.join(output_dir, f"{request_id}.speedscope.json"),
+        "collapsed": os.path.join(output_dir, f"{request_id}.collapsed.txt"),
+        "allocations": os.path.join(output_dir, f"{request_id}.allocations.json"),
+    }
+    for path in artifacts.values():
+        if os.path.dirname(os.path.realpath(path)) != output_dir:
+            raise ValueError(f"Request id không hợp lệ cho tên file profile: {request_id!r}")
+
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Đang có một yêu cầu khác được profile")
+    interval = interval or float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+    summary: Dict[str, Any] = {"request_id": request_id}
+    profiler = SamplingProfiler(interval=interval, thread_filter=lambda: request_threads(request_id))
+    started_tracemalloc = not tracemalloc.is_tracing()
+    try:
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler.start()
+        try:
+            yield summary
+        finally:
+            profiler.stop()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+            allocations = top_allocations(snapshot)
+            os.makedirs(output_dir, exist_ok=True)
+            with open(artifacts["speedscope"], "w", encoding="utf-8") as f:
+                json.dump(profiler.speedscope(f"request {request_id}"), f)
+            with open(artifacts["collapsed"], "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed())
+            with open(artifacts["allocations"], "w", encoding="utf-8") as f:
+                json.dump({"request_id": request_id, "peak_kb": round(peak / 1024, 1),
+                           "top_allocations": top_allocations(snapshot, limit=50)}, f, ensure_ascii=False, indent=2)
+
+            summary.update({
+                "duration_s": round(profiler.duration, 3),
+                "samples": profiler.samples,
+                "interval_ms": round(interval * 1000, 3),
+                "peak_memory_kb": round(peak / 1024, 1),
+                "top_functions": profiler.top_functions(),
+                "top_allocations": allocations,
+                "artifacts": artifacts,
+                "note": "Chỉ lấy mẫu thread của yêu cầu này (không gồm event loop); "
+                        "vị trí cấp phát bộ nhớ là toàn tiến trình",
+            })
+            logger.info(f"Đã lưu profile của yêu cầu {request_id} vào {output_dir}")
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,112 @@
+import decimal
+import datetime
+from typing import Any, Dict, List, Optional
+
+# Bảng kết quả nhỏ hơn ngưỡng này được hiển thị trực tiếp, không cần LLM tổng hợp
+SHORT_TABLE_MAX_ROWS = 10
+SHORT_TABLE_MAX_COLUMNS = 6
+
+
+def format_value(value: Any) -> str:
+    """
+    Định dạng một giá trị từ cơ sở dữ liệu để hiển thị.
+
+    Args:
+        value (Any): Giá trị (số, Decimal, ngày, chuỗi...)
+    Returns:
+        str: Chuỗi hiển thị
+    """
+    if value is None:
+        return "N/A"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, (float, decimal.Decimal)):
+        text = f"{float(value):,.4f}".rstrip("0").rstrip(".")
+        return text or "0"
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def render_table(columns: List[str], rows: List[Dict[str, Any]]) -> str:
+    """Hiển thị các dòng kết quả dưới dạng bảng markdown."""
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "| " + " | ".join("-" * max(len(col), 3) for col in columns) + " |",
+    ]
+    for row in rows:
+        lines.append("| " + " | ".join(format_value(row.get(col)) for col in columns) + " |")
+    return "\n".join(lines)
+
+
+def render_database_answer(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Hiển thị kết quả database_query bằng mẫu nếu kết quả là một giá trị hoặc một bảng ngắn.
+
+    Args:
+        data (Dict[str, Any]): additional_data của database_query (query, columns, results)
+    Returns:
+        Optional[str]: Câu trả lời, hoặc None nếu cần LLM tổng hợp
+    """
+    if not data.get("success"):
+        return None
+    columns = data.get("columns") or []
+    rows = data.get("results") or []
+    if not rows:
+        return "Không tìm thấy dữ liệu phù hợp với câu hỏi trong cơ sở dữ liệu."
+    if len(rows) == 1 and len(columns) == 1:
+        return f"Kết quả: **{columns[0]}** = **{format_value(rows[0].get(columns[0]))}**"
+    if len(rows) <= SHORT_TABLE_MAX_ROWS and len(columns) <= SHORT_TABLE_MAX_COLUMNS:
+        return f"Kết quả truy vấn ({len(rows)} dòng):\n\n{render_table(columns, rows)}"
+    return None
+
+
+def render_visualization_answer(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Mô tả biểu đồ đã tạo từ thông tin biểu đồ.
+
+    Args:
+        data (Dict[str, Any]): additional_data của visualize
+    Returns:
+        Optional[str]: Câu trả lời, hoặc None nếu tạo biểu đồ thất bại
+    """
+    if not data.get("success"):
+        return None
+    chart_info = data.get("chart_info") or {}
+    title = chart_info.get("title") or "Biểu đồ dữ liệu"
+    answer = f"Đã tạo biểu đồ **{title}**"
+    if chart_info.get("chart_type"):
+        answer += f" (dạng {chart_info['chart_type']})"
+    answer += "."
+    explanation = (chart_info.get("explanation") or "").strip().rstrip(".")
+    if explanation:
+        answer += f" {explanation}."
+    return answer
+
+
+def template_answer(agent_results: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Tạo câu trả lời không cần LLM cho các trường hợp đơn giản.
+
+    - Một kết quả từ conversation: trả nguyên văn (đã là câu trả lời hoàn chỉnh)
+    - Một kết quả database_query dạng một giá trị hoặc bảng ngắn: hiển thị theo mẫu
+    - Một biểu đồ từ visualize: mô tả theo thông tin biểu đồ
+
+    Args:
+        agent_results (List[Dict[str, Any]]): Kết quả của các agent
+    Returns:
+        Optional[str]: Câu trả lời, hoặc None nếu cần LLM tổng hợp (nhiều agent, dữ liệu lớn...)
+    """
+    if len(agent_results) != 1:
+        return None
+    result = agent_results[0]
+    data = result.get("additional_data") or {}
+    if result["agent_name"] == "conversation":
+        return result["content"]
+    if result["agent_name"] == "database_query":
+        return render_database_answer(data)
+    if result["agent_name"] == "visualize":
+        return render_visualization_answer(data)
+    return None
@@ -0,0 +1,424 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Giá trị thuộc tính dài hơn số ký tự này bị cắt (câu query, câu hỏi...)
+MAX_ATTRIBUTE_LENGTH = 300
+
+
+@dataclass
+class Span:
+    """
+    Một khoảng thời gian được đo trong quá trình xử lý một yêu cầu.
+
+    Attributes:
+        name (str): Tên span (node.router, llm, db.execute, search, chart.render...)
+        trace_id (str): Mã trace (một trace cho mỗi yêu cầu)
+        span_id (str): Mã span
+        parent_id (Optional[str]): Mã span cha
+        attributes (Dict[str, Any]): Thuộc tính bổ sung
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+    thread: str = field(default_factory=lambda: threading.current_thread().name)
+
+    def set(self, **attributes):
+        """Thêm thuộc tính cho span."""
+        for key, value in attributes.items():
+            if isinstance(value, str) and len(value) > MAX_ATTRIBUTE_LENGTH:
+                value = value[:MAX_ATTRIBUTE_LENGTH] + "..."
+            self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration_ms, 2),
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """Các span của một yêu cầu, gắn với request id."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        origin = spans[0].start if spans else time.time()
+        root = spans[0] if spans else None
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "name": root.name if root else None,
+            "start": origin,
+            "duration_ms": round(root.duration_ms, 2) if root else 0.0,
+            "spans": [span.to_dict(origin) for span in spans],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+# Hàm được gọi khi mỗi span kết thúc (ví dụ để cập nhật metrics)
+_span_listeners: List[Callable[[Span], None]] = []
+
+
+def add_span_listener(listener: Callable[[Span], None]):
+    """Đăng ký hàm được gọi mỗi khi một span kết thúc."""
+    _span_listeners.append(listener)
+
+
+# Các thread đang chạy mã của từng yêu cầu (ident -> số span đang mở theo request id), dùng để
+# profiler chỉ lấy mẫu thread của yêu cầu được profile
+_thread_requests: Dict[int, Dict[str, int]] = {}
+_thread_lock = threading.Lock()
+
+
+def current_request_id() -> Optional[str]:
+    """Request id của yêu cầu đang xử lý trong context hiện tại."""
+    trace_ = _current_trace.get()
+    return trace_.request_id if trace_ else None
+
+
+def request_threads(request_id: str) -> Set[int]:
+    """Ident của các thread đang chạy mã của một yêu cầu (không gồm thread của event loop)."""
+    with _thread_lock:
+        return {ident for ident, requests in _thread_requests.items() if request_id in requests}
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+@contextmanager
+def _bind_thread(request_id: str) -> Iterator[None]:
+    """
+    Gắn thread hiện tại với một yêu cầu trong khối lệnh.
+
+    Thread của event loop được dùng xen kẽ bởi mọi yêu cầu nên không được gắn.
+    """
+    if _in_event_loop():
+        yield
+        return
+    ident = threading.get_ident()
+    with _thread_lock:
+        requests = _thread_requests.setdefault(ident, {})
+        requests[request_id] = requests.get(request_id, 0) + 1
+    try:
+        yield
+    finally:
+        with _thread_lock:
+            requests = _thread_requests[ident]
+            requests[request_id] -= 1
+            if not requests[request_id]:
+                del requests[request_id]
+            if not requests:
+                del _thread_requests[ident]
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Đo một bước xử lý bên trong trace hiện tại (không làm gì nếu không có trace).
+
+    Args:
+        name (str): Tên span
+        **attributes: Thuộc tính ban đầu của span
+    Yields:
+        Optional[Span]: Span đang đo, hoặc None nếu không có trace
+    """
+    trace_ = _current_trace.get()
+    if trace_ is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name=name, trace_id=trace_.trace_id, span_id=uuid.uuid4().hex[:16],
+                   parent_id=parent.span_id if parent else None)
+    current.set(**attributes)
+    token = _current_span.set(current)
+    try:
+        with _bind_thread(trace_.request_id):
+            yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = str(e)[:MAX_ATTRIBUTE_LENGTH]
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+        trace_.add(current)
+        for listener in _span_listeners:
+            try:
+                listener(current)
+            except Exception as e:
+                logger.warning(f"Lỗi trong span listener: {e}")
+
+
+@contextmanager
+def trace(name: str, request_id: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Bắt đầu trace cho một yêu cầu; nếu đã có trace trong context thì chỉ tạo span con.
+
+    Khi span gốc kết thúc, trace được xuất theo TRACE_EXPORT.
+
+    Args:
+        name (str): Tên span gốc
+        request_id (Optional[str]): Request id (tự sinh nếu không truyền)
+        **attributes: Thuộc tính của span gốc
+    Yields:
+        Optional[Span]: Span gốc
+    """
+    if _current_trace.get() is not None:
+        with span(name, **attributes) as current:
+            yield current
+        return
+    trace_ = Trace(request_id or uuid.uuid4().hex)
+    token = _current_trace.set(trace_)
+    try:
+        with span(name, request_id=trace_.request_id, **attributes) as current:
+            yield current
+    finally:
+        _current_trace.reset(token)
+        exporter = get_exporter()
+        if exporter:
+            exporter.export(trace_)
+
+
+def traced(name: str) -> Callable:
+    """Decorator đo toàn bộ lời gọi hàm bằng một span."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    Giữ context hiện tại (trace, span cha) khi hàm được chạy trong thread khác.
+
+    ThreadPoolExecutor.submit và run_in_executor không tự sao chép contextvars.
+    """
+    context = contextvars.copy_context()
+    trace_ = context.get(_current_trace)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if trace_ is None:
+            return context.copy().run(func, *args, **kwargs)
+        with _bind_thread(trace_.request_id):
+            return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+class TraceExporter:
+    """
+    Xuất trace trong thread nền để không làm chậm yêu cầu.
+
+    - file: mỗi trace một dòng JSON trong TRACE_PATH
+    - otlp: gửi OTLP/HTTP JSON tới TRACE_OTLP_ENDPOINT (collector hoặc stand-in cục bộ)
+    """
+
+    def __init__(self, mode: str = "file", path: str = "traces.jsonl",
+                 endpoint: str = "http://localhost:4318/v1/traces", service_name: str = "financial-agent"):
+        self.mode = mode
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+        self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._worker.start()
+
+    def export(self, trace_: Trace):
+        try:
+            self._queue.put_nowait(trace_)
+        except queue.Full:
+            logger.warning("Hàng đợi xuất trace đầy, bỏ qua trace")
+
+    def flush(self, timeout: float = 5.0):
+        """Chờ các trace đang chờ được xuất xong."""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            trace_ = self._queue.get()
+            try:
+                if self.mode == "otlp":
+                    self._send_otlp(trace_)
+                else:
+                    self._write_file(trace_)
+            except Exception as e:
+                logger.warning(f"Không thể xuất trace {trace_.request_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write_file(self, trace_: Trace):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace_.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def _send_otlp(self, trace_: Trace):
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        spans = []
+        for s in list(trace_.spans):
+            attributes = dict(s.attributes, request_id=trace_.request_id, thread=s.thread)
+            spans.append({
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int(s.start * 1e9)),
+                "endTimeUnixNano": str(int((s.end or s.start) * 1e9)),
+                "attributes": [{"key": k, "value": value(v)} for k, v in attributes.items()],
+                "status": {"code": 2, "message": s.error or ""} if s.status == "error" else {"code": 1},
+            })
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "src.utils.tracing"}, "spans": spans}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[TraceExporter]:
+    """
+    Exporter dùng chung theo biến môi trường TRACE_EXPORT (off | file | otlp),
+    TRACE_PATH và TRACE_OTLP_ENDPOINT.
+    """
+    global _exporter
+    mode = os.getenv("TRACE_EXPORT", "off").lower()
+    if mode == "off":
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TraceExporter(
+                mode=mode,
+                path=os.getenv("TRACE_PATH", "traces.jsonl"),
+                endpoint=os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+            )
+        return _exporter
+
+
+def format_waterfall(trace_data: Dict[str, Any], width: int = 50) -> str:
+    """
+    Biểu diễn một trace (dạng dict đã xuất ra file) thành biểu đồ thác nước dạng văn bản.
+
+    Args:
+        trace_data (Dict[str, Any]): Trace đọc từ file TRACE_PATH
+        width (int): Độ rộng của thanh thời gian
+    Returns:
+        str: Mỗi span một dòng: tên (thụt lề theo cấp), thanh thời gian, thời lượng
+    """
+    spans = trace_data.get("spans", [])
+    total = max((s["offset_ms"] + s["duration_ms"] for s in spans), default=0.0) or 1.0
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+
+    lines = [f"request {trace_data.get('request_id')} - {trace_data.get('duration_ms', 0.0):.1f} ms"]
+
+    def walk(parent_id, depth):
+        for s in sorted(children.get(parent_id, []), key=lambda s: s["offset_ms"]):
+            start = int(s["offset_ms"] / total * width)
+            length = max(1, int(s["duration_ms"] / total * width))
+            bar = " " * start + "█" * min(length, width - start)
+            label = ("  " * depth + s["name"])[:36]
+            marker = " !" if s["status"] == "error" else ""
+            lines.append(f"{label:<36} |{bar:<{width}}| {s['duration_ms']:>9.1f} ms{marker}")
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    """Đọc các trace đã xuất ra file."""
+    traces = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                traces.append(json.loads(line))
+    return traces
+
+
+if __name__ == "__main__":
+    # python -m src.utils.tracing [TRACE_PATH] [request_id]: in waterfall của một yêu cầu (mặc định là yêu cầu mới nhất)
+    path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("TRACE_PATH", "traces.jsonl")
+    traces = load_traces(path)
+    if len(sys.argv) > 2:
+        traces = [t for t in traces if t["request_id"] == sys.argv[2]]
+    if not traces:
+        print("Không tìm thấy trace")
+        sys.exit(1)
+    print(format_waterfall(traces[-1]))
@@ -0,0 +1,213 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.utils.metrics import REGISTRY, record_token_usage
+
+# Giá (USD cho 1 triệu token prompt, completion); mô hình không có trong bảng tính chi phí 0
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+LLM_AGENT_TOKENS = REGISTRY.counter(
+    "agent_llm_agent_tokens_total", "Số token LLM theo agent, thành phần và loại (prompt | completion)",
+    ("agent", "component", "type"))
+LLM_AGENT_SECONDS = REGISTRY.counter(
+    "agent_llm_agent_seconds_total", "Tổng thời gian chờ LLM theo agent và thành phần", ("agent", "component"))
+LLM_COST = REGISTRY.counter(
+    "agent_llm_cost_usd_total", "Chi phí LLM ước tính (USD) theo agent và mô hình", ("agent", "model"))
+
+
+def token_usage(response: Any) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Số token prompt và completion của một phản hồi LangChain (None nếu không có).
+
+    Args:
+        response (Any): Phản hồi của mô hình chat (AIMessage)
+    Returns:
+        Tuple[Optional[int], Optional[int]]: (prompt_tokens, completion_tokens)
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Chi phí ước tính (USD) của một lời gọi theo bảng MODEL_PRICES."""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+@dataclass
+class LLMCall:
+    """
+    Một lời gọi LLM.
+
+    Attributes:
+        agent (str): Agent (hoặc router, speculation) đang xử lý khi gọi
+        component (str): Thành phần gọi mô hình (router, planner, sql, synthesis, conversation, visualize)
+        model (str): Tên mô hình
+        prompt_tokens (int): Số token prompt
+        completion_tokens (int): Số token completion
+        seconds (float): Thời gian chờ phản hồi
+        success (bool): Lời gọi có thành công không
+    """
+    agent: str
+    component: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
+    success: bool = True
+
+    @property
+    def cost(self) -> float:
+        return estimate_cost(self.model, self.prompt_tokens, self.completion_tokens)
+
+
+class RequestUsage:
+    """Các lời gọi LLM của một yêu cầu (có thể được ghi từ nhiều thread)."""
+
+    def __init__(self):
+        self.calls: List[LLMCall] = []
+        self._lock = threading.Lock()
+
+    def add(self, call: LLMCall):
+        with self._lock:
+            self.calls.append(call)
+
+    @staticmethod
+    def _totals(calls: List[LLMCall]) -> Dict[str, Any]:
+        prompt = sum(c.prompt_tokens for c in calls)
+        completion = sum(c.completion_tokens for c in calls)
+        return {
+            "calls": len(calls),
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "llm_seconds": round(sum(c.seconds for c in calls), 3),
+            "cost_usd": round(sum(c.cost for c in calls), 6),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Tổng hợp token, thời gian và chi phí của yêu cầu.
+
+        Returns:
+            Dict[str, Any]: {"total": {...}, "by_agent": {agent: {...}}, "by_component": {component: {...}}}
+        """
+        with self._lock:
+            calls = list(self.calls)
+        by_agent: Dict[str, List[LLMCall]] = {}
+        by_component: Dict[str, List[LLMCall]] = {}
+        for call in calls:
+            by_agent.setdefault(call.agent, []).append(call)
+            by_component.setdefault(call.component, []).append(call)
+        return {
+            "total": self._totals(calls),
+            "by_agent": {name: self._totals(group) for name, group in by_agent.items()},
+            "by_component": {name: self._totals(group) for name, group in by_component.items()},
+        }
+
+
+_current_usage: contextvars.ContextVar[Optional[RequestUsage]] = contextvars.ContextVar("usage", default=None)
+_current_agent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_agent", default=None)
+
+
+def current_usage() -> Optional[RequestUsage]:
+    """Bộ ghi usage của yêu cầu đang xử lý (None nếu không có)."""
+    return _current_usage.get()
+
+
+@contextmanager
+def track_usage() -> Iterator[RequestUsage]:
+    """
+    Bắt đầu ghi usage cho một yêu cầu; nếu đã có bộ ghi trong context thì dùng lại.
+
+    Yields:
+        RequestUsage: Bộ ghi usage của yêu cầu
+    """
+    usage = _current_usage.get()
+    if usage is not None:
+        yield usage
+        return
+    usage = RequestUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+@contextmanager
+def agent_scope(agent: str) -> Iterator[None]:
+    """Gán các lời gọi LLM bên trong cho một agent."""
+    token = _current_agent.set(agent)
+    try:
+        yield
+    finally:
+        _current_agent.reset(token)
+
+
+def record_llm_call(component: str, model: str, response: Any, seconds: float, success: bool = True) -> LLMCall:
+    """
+    Ghi một lời gọi LLM vào yêu cầu hiện tại (nếu có) và vào metrics.
+
+    Args:
+        component (str): Thành phần gọi mô hình
+        model (str): Tên mô hình
+        response (Any): Phản hồi của mô hình (None nếu lời gọi lỗi)
+        seconds (float): Thời gian chờ phản hồi
+        success (bool): Lời gọi có thành công không
+    Returns:
+        LLMCall: Lời gọi đã ghi
+    """
+    prompt_tokens, completion_tokens = token_usage(response) if response is not None else (None, None)
+    call = LLMCall(
+        agent=_current_agent.get() or component,
+        component=component,
+        model=model,
+        prompt_tokens=prompt_tokens or 0,
+        completion_tokens=completion_tokens or 0,
+        seconds=seconds,
+        success=success,
+    )
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(call)
+
+    record_token_usage(model, call.prompt_tokens, call.completion_tokens)
+    LLM_AGENT_TOKENS.inc(call.prompt_tokens, agent=call.agent, component=component, type="prompt")
+    LLM_AGENT_TOKENS.inc(call.completion_tokens, agent=call.agent, component=component, type="completion")
+    LLM_AGENT_SECONDS.inc(seconds, agent=call.agent, component=component)
+    if call.cost:
+        LLM_COST.inc(call.cost, agent=call.agent, model=model)
+    return call
+
+
+@contextmanager
+def timed_llm_call(component: str, model: str) -> Iterator[Dict[str, Any]]:
+    """
+    Đo một lời gọi LLM không đi qua ModelPolicy (ví dụ các chain của LangChain).
+
+    Gán phản hồi vào khóa "response" của dict được yield để số token được ghi lại.
+
+    Yields:
+        Dict[str, Any]: Nơi đặt phản hồi của mô hình
+    """
+    holder: Dict[str, Any] = {"response": None}
+    start = time.perf_counter()
+    success = False
+    try:
+        yield holder
+        success = True
+    finally:
+        record_llm_call(component, model, holder["response"], time.perf_counter() - start, success)
@@ -0,0 +1,13 @@
+from src.agent.evaluation import score_answer
+
+
+def test_text_answer_with_numeric_cells():
+    # Ô số nằm cạnh ô văn bản không được làm lỗi việc so khớp văn bản
+    score = score_answer([{"sector": "Energy", "avg": 1.2}], "Healthcare")
+    assert not score["correct"]
+    assert score["missing"]
+
+
+def test_text_answer_matches_despite_numeric_cells():
+    score = score_answer([{"sector": "Healthcare", "avg": 1.2}], "Healthcare")
+    assert score["correct"]